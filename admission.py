@@ -0,0 +1,135 @@
+"""
+Admission Control
+Caps how many expensive requests run at once and how many may wait for a
+slot; the rest are turned away early with a retry hint instead of piling up
+in memory
+"""
+
+import math
+import threading
+import time
+from typing import Dict
+
+from metrics import REGISTRY
+
+
+ADMISSION_ACTIVE = REGISTRY.gauge(
+    'skincare_admission_active', 'Requests currently holding an admission slot', ['controller']
+)
+ADMISSION_QUEUE_DEPTH = REGISTRY.gauge(
+    'skincare_admission_queue_depth', 'Requests waiting for an admission slot', ['controller']
+)
+ADMISSION_WAIT = REGISTRY.histogram(
+    'skincare_admission_wait_seconds', 'Time spent waiting for an admission slot', ['controller'],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    'skincare_admission_rejected_total', 'Requests turned away by admission control', ['controller', 'reason']
+)
+
+
+class AdmissionRejected(Exception):
+    """No slot available; retry_after is a hint in whole seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Admission rejected ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded wait queue
+
+    Up to `max_concurrent` callers hold a slot at once; up to `max_queue`
+    more wait at most `max_wait` seconds for one. Anyone beyond that, or
+    anyone whose wait expires, gets AdmissionRejected. Newcomers never
+    overtake callers that are already waiting.
+
+    Args:
+        name: Label for this controller's metrics
+        max_concurrent: Slots
+        max_queue: Callers allowed to wait for a slot
+        max_wait: Seconds a caller waits before giving up
+    """
+
+    def __init__(self, name: str, max_concurrent: int = 4, max_queue: int = 8, max_wait: float = 10.0):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._avg_hold = 1.0  # EWMA of slot hold time, seeds the Retry-After hint
+        ADMISSION_ACTIVE.set(0, controller=name)
+        ADMISSION_QUEUE_DEPTH.set(0, controller=name)
+
+    def retry_after(self) -> int:
+        """Rough seconds until a slot frees up for one more caller"""
+        slots_ahead = (self._waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(self._avg_hold * slots_ahead))
+
+    def _reject(self, reason: str):
+        ADMISSION_REJECTED.inc(controller=self.name, reason=reason)
+        raise AdmissionRejected(reason, self.retry_after())
+
+    def acquire(self) -> float:
+        """
+        Take a slot, waiting in the queue if necessary
+
+        Returns:
+            Monotonic time the slot was granted (pass it to release())
+
+        Raises:
+            AdmissionRejected when the queue is full or the wait times out
+        """
+        start = time.monotonic()
+        with self._cond:
+            if self._active < self.max_concurrent and self._waiting == 0:
+                self._active += 1
+                ADMISSION_ACTIVE.set(self._active, controller=self.name)
+                ADMISSION_WAIT.observe(0.0, controller=self.name)
+                return start
+
+            if self._waiting >= self.max_queue:
+                self._reject('queue_full')
+
+            self._waiting += 1
+            ADMISSION_QUEUE_DEPTH.set(self._waiting, controller=self.name)
+            try:
+                deadline = start + self.max_wait
+                while self._active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject('timeout')
+                    self._cond.wait(remaining)
+                self._active += 1
+                ADMISSION_ACTIVE.set(self._active, controller=self.name)
+            finally:
+                self._waiting -= 1
+                ADMISSION_QUEUE_DEPTH.set(self._waiting, controller=self.name)
+
+        granted = time.monotonic()
+        ADMISSION_WAIT.observe(granted - start, controller=self.name)
+        return granted
+
+    def release(self, granted_at: float):
+        """Give a slot back and wake the waiters"""
+        held = time.monotonic() - granted_at
+        with self._cond:
+            self._active -= 1
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+            ADMISSION_ACTIVE.set(self._active, controller=self.name)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'active': self._active,
+                'waiting': self._waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'max_wait': self.max_wait,
+                'avg_hold_seconds': round(self._avg_hold, 3)
+            }
@@ -0,0 +1,211 @@
+"""
+LLM Advice Template Cache
+Stores generated advice per (diagnosis, confidence bucket, age band, gender)
+with placeholders for the patient-specific fields, so similar analyses reuse
+one completion instead of calling the LLM every time
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, Optional
+
+from metrics import REGISTRY
+
+
+# Bump when the template prompt changes so old entries stop matching
+ADVICE_PROMPT_VERSION = 1
+
+NAME_PLACEHOLDER = '{{PATIENT_NAME}}'
+CONFIDENCE_PLACEHOLDER = '{{CONFIDENCE}}'
+
+CONFIDENCE_BUCKET_WIDTH = 10
+AGE_BANDS = ((0, 17), (18, 29), (30, 44), (45, 59), (60, 74), (75, 200))
+
+ADVICE_CACHE_LOOKUPS = REGISTRY.counter(
+    'skincare_advice_cache_lookups_total', 'LLM advice template cache lookups', ['result']
+)
+
+
+def confidence_bucket(confidence: float) -> str:
+    """62.4 -> '60-70' (100 falls in the top bucket)"""
+    low = min(int(float(confidence) // CONFIDENCE_BUCKET_WIDTH) * CONFIDENCE_BUCKET_WIDTH,
+              100 - CONFIDENCE_BUCKET_WIDTH)
+    return f"{low}-{low + CONFIDENCE_BUCKET_WIDTH}"
+
+
+def age_band(age) -> str:
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return 'unknown'
+    for low, high in AGE_BANDS:
+        if low <= age <= high:
+            return f"{low}+" if high >= 200 else f"{low}-{high}"
+    return 'unknown'
+
+
+def gender_key(gender: str) -> str:
+    return (gender or 'unknown').strip().lower()
+
+
+def advice_cache_key(diagnosis: str, confidence: float, age, gender: str, model: str = '') -> str:
+    fields = (f'v{ADVICE_PROMPT_VERSION}', model, diagnosis, confidence_bucket(confidence),
+              age_band(age), gender_key(gender))
+    return '|'.join(str(f) for f in fields)
+
+
+def render_advice(template: str, name: str, confidence: float) -> str:
+    """Fill the patient-specific placeholders of a cached template"""
+    return template.replace(NAME_PLACEHOLDER, str(name)).replace(CONFIDENCE_PLACEHOLDER, f"{float(confidence):.2f}%")
+
+
+class PlaceholderStream:
+    """
+    Renders placeholders in streamed template text
+
+    Tokens can split a placeholder ('{{PATIENT' + '_NAME}}'), so text from
+    an unclosed '{{' onwards is held back until it completes.
+    """
+
+    def __init__(self, name: str, confidence: float):
+        self.name = name
+        self.confidence = confidence
+        self._pending = ''
+
+    def feed(self, delta: str) -> str:
+        """Add a delta; returns the text that is safe to emit now"""
+        self._pending += delta
+        cut = len(self._pending)
+        start = self._pending.rfind('{{')
+        if start != -1 and self._pending.find('}}', start) == -1:
+            cut = start
+        elif self._pending.endswith('{'):
+            cut -= 1
+        ready, self._pending = self._pending[:cut], self._pending[cut:]
+        return render_advice(ready, self.name, self.confidence)
+
+    def flush(self) -> str:
+        ready, self._pending = self._pending, ''
+        return render_advice(ready, self.name, self.confidence)
+
+
+class AdviceCache:
+    """
+    SQLite-backed advice template store with a time-to-live
+
+    Entries survive restarts and are shared by every process pointing at
+    the same file (web workers and job workers).
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS advice_cache ('
+                'key TEXT PRIMARY KEY, diagnosis TEXT, confidence_bucket TEXT, age_band TEXT, gender TEXT, '
+                'advice TEXT, created_at REAL, hits INTEGER DEFAULT 0)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS advice_leases (name TEXT PRIMARY KEY, holder TEXT, expires_at REAL)'
+            )
+
+    def _connect(self):
+        # Use as `with closing(self._connect()) as conn, conn:` - the connection's
+        # own context manager only commits, it does not close
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        ADVICE_CACHE_LOOKUPS.inc(result='hit' if hit else 'miss')
+
+    def has(self, key: str, max_age: float = None) -> bool:
+        """Whether a live entry exists (younger than max_age, if given); not counted as a lookup"""
+        max_age = min(filter(None, (max_age, self.ttl_seconds)), default=None)
+        try:
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute('SELECT created_at FROM advice_cache WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error:
+            return False
+        return bool(row) and not (max_age and time.time() - row[0] > max_age)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached template for key, or None on a miss or expired entry"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute('SELECT advice, created_at FROM advice_cache WHERE key = ?', (key,)).fetchone()
+                if row and not (self.ttl_seconds and time.time() - row[1] > self.ttl_seconds):
+                    conn.execute('UPDATE advice_cache SET hits = hits + 1 WHERE key = ?', (key,))
+                    self._count(True)
+                    return row[0]
+        except sqlite3.Error as e:
+            print(f"⚠️ Advice cache lookup failed: {e}")
+        self._count(False)
+        return None
+
+    def put(self, key: str, advice: str, diagnosis: str, confidence: float, age, gender: str):
+        """Store advice under key, the advice_cache_key() of the same diagnosis, confidence, age and gender"""
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO advice_cache '
+                    '(key, diagnosis, confidence_bucket, age_band, gender, advice, created_at, hits) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, 0)',
+                    (key, diagnosis, confidence_bucket(confidence), age_band(age), gender_key(gender),
+                     advice, time.time())
+                )
+        except sqlite3.Error as e:
+            print(f"⚠️ Advice cache write failed: {e}")
+
+    def acquire_lease(self, name: str, holder: str, seconds: float) -> bool:
+        """
+        Take or renew the named lease for seconds; False while another holder's lease is live
+
+        Lets one of the processes sharing the cache file (on any host) run a
+        periodic job, with another taking over once the holder stops renewing.
+        """
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                cursor = conn.execute(
+                    'INSERT INTO advice_leases (name, holder, expires_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at '
+                    'WHERE advice_leases.holder = excluded.holder OR advice_leases.expires_at < ?',
+                    (name, holder, now + seconds, now)
+                )
+                return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"⚠️ Advice cache lease failed: {e}")
+            return False
+
+    def entries(self) -> int:
+        try:
+            with closing(self._connect()) as conn, conn:
+                return conn.execute('SELECT COUNT(*) FROM advice_cache').fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            hits, misses = self.hits, self.misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'entries': self.entries(),
+            'ttl_seconds': self.ttl_seconds
+        }
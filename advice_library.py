@@ -0,0 +1,159 @@
+"""
+Precomputed Advice Library
+Generates advice templates for every condition and common patient bucket
+ahead of time and stores them in the advice cache, so analyze_with_llm can
+answer from the library instantly and only calls the LLM live for unusual
+cases (unlisted genders, unparseable ages, a changed model or prompt)
+
+Usage:
+    python advice_library.py                     # generate missing entries
+    python advice_library.py --refresh           # regenerate every entry
+    python advice_library.py --base-url http://127.0.0.1:9100   # against standin_server.py
+"""
+
+import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from advice_cache import AGE_BANDS, CONFIDENCE_BUCKET_WIDTH, advice_cache_key
+from metrics import REGISTRY
+
+
+# Analyses under 60% confidence are rejected before the LLM stage
+LIBRARY_MIN_CONFIDENCE = 60
+LIBRARY_GENDERS = tuple(g.strip() for g in os.getenv('ADVICE_LIBRARY_GENDERS', 'male,female,other').split(',') if g.strip())
+LIBRARY_WORKERS = int(os.getenv('ADVICE_LIBRARY_WORKERS', '2'))
+LIBRARY_DEADLINE = float(os.getenv('ADVICE_LIBRARY_DEADLINE', '60'))
+# Refreshers sharing an advice cache file take this lease before warming;
+# a start-only warm-up (no refresh interval) holds it for an hour
+LIBRARY_LEASE_NAME = 'advice_library'
+LIBRARY_STARTUP_LEASE_SECONDS = 3600
+
+LIBRARY_ENTRIES = REGISTRY.counter(
+    'skincare_advice_library_entries_total', 'Advice library entries processed by warm-up runs', ['result']
+)
+
+# (diagnosis, confidence, age, gender) with values inside the bucket they stand for
+LibraryEntry = Tuple[str, float, int, str]
+
+
+def library_entries(conditions: Iterable[str], genders: Iterable[str] = LIBRARY_GENDERS,
+                    min_confidence: int = LIBRARY_MIN_CONFIDENCE) -> List[LibraryEntry]:
+    """One entry per condition x confidence bucket x age band x gender"""
+    confidences = [low + CONFIDENCE_BUCKET_WIDTH / 2 for low in range(min_confidence, 100, CONFIDENCE_BUCKET_WIDTH)]
+    return [
+        (condition, confidence, low_age, gender)
+        for condition in conditions
+        for confidence in confidences
+        for low_age, _ in AGE_BANDS
+        for gender in genders
+    ]
+
+
+def build_advice_library(generate: Callable[..., str], cache, entries: List[LibraryEntry], model: str,
+                         refresh: bool = False, max_age: float = None, workers: int = LIBRARY_WORKERS) -> Dict:
+    """
+    Generate and store the templates that are missing from the cache
+
+    Args:
+        generate: generate(diagnosis, confidence, age, gender) -> template text
+        cache: AdviceCache the library lives in
+        entries: Output of library_entries()
+        model: LLM model name (part of the cache key)
+        refresh: Regenerate entries that already exist
+        max_age: Also regenerate entries older than this many seconds
+        workers: Concurrent generations
+
+    Returns:
+        Counts of generated, skipped and failed entries plus the run time
+    """
+    start = time.monotonic()
+    todo = [
+        entry for entry in entries
+        if refresh or not cache.has(advice_cache_key(*entry, model=model), max_age=max_age)
+    ]
+    counts = {'generated': 0, 'skipped': len(entries) - len(todo), 'failed': 0}
+    lock = threading.Lock()
+
+    def build(entry):
+        try:
+            template = generate(*entry)
+            cache.put(advice_cache_key(*entry, model=model), template, *entry)
+            result = 'generated'
+        except Exception as e:
+            print(f"⚠️ Advice library entry {entry} failed: {e}")
+            result = 'failed'
+        LIBRARY_ENTRIES.inc(result=result)
+        with lock:
+            counts[result] += 1
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='advice-library') as executor:
+        list(executor.map(build, todo))
+
+    counts['seconds'] = round(time.monotonic() - start, 2)
+    print(f"✅ Advice library: {counts['generated']} generated, {counts['skipped']} up to date, "
+          f"{counts['failed']} failed in {counts['seconds']}s")
+    return counts
+
+
+def warm_app_library(refresh: bool = False, max_age: float = None, workers: int = LIBRARY_WORKERS) -> Dict:
+    """Build the library for the app's conditions, model and advice cache"""
+    from app import CONDITION_INFO, LLM_MODEL, advice_cache, generate_advice_template
+
+    if advice_cache is None:
+        print("⚠️ Advice cache disabled (ADVICE_CACHE_ENABLED=false), nothing to warm")
+        return {'generated': 0, 'skipped': 0, 'failed': 0, 'seconds': 0.0}
+
+    def generate(diagnosis, confidence, age, gender):
+        return generate_advice_template(diagnosis, confidence, age, gender, deadline=LIBRARY_DEADLINE)
+
+    return build_advice_library(generate, advice_cache, library_entries(CONDITION_INFO), LLM_MODEL,
+                                refresh=refresh, max_age=max_age, workers=workers)
+
+
+def start_library_refresher(interval_hours: float, holder: str) -> threading.Thread:
+    """
+    Warm the library now in a background thread and, if interval_hours > 0,
+    regenerate entries older than the interval every interval_hours
+
+    Each run first takes the library lease in the advice cache, so processes
+    sharing one cache file warm it once per interval rather than once each.
+    """
+    def loop():
+        from app import advice_cache
+
+        max_age = interval_hours * 3600 if interval_hours > 0 else None
+        while True:
+            try:
+                if advice_cache is None or advice_cache.acquire_lease(
+                        LIBRARY_LEASE_NAME, holder, max_age or LIBRARY_STARTUP_LEASE_SECONDS):
+                    warm_app_library(max_age=max_age)
+                else:
+                    print("ℹ️ Advice library is warmed by another worker, skipping this run")
+            except Exception as e:
+                print(f"❌ Advice library warm-up failed: {e}")
+            if not max_age:
+                return
+            time.sleep(max_age)
+
+    thread = threading.Thread(target=loop, name='advice-library', daemon=True)
+    thread.start()
+    return thread
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute the LLM advice library')
+    parser.add_argument('--refresh', action='store_true', help='Regenerate entries that already exist')
+    parser.add_argument('--base-url', help='OpenAI-compatible server to generate with (sets GROQ_BASE_URL)')
+    parser.add_argument('--workers', type=int, default=LIBRARY_WORKERS, help='Concurrent generations')
+    args = parser.parse_args()
+
+    # Must be set before app is imported
+    if args.base_url:
+        os.environ['GROQ_BASE_URL'] = args.base_url
+        os.environ.setdefault('GROQ_API_KEY', 'standin')
+
+    counts = warm_app_library(refresh=args.refresh, workers=args.workers)
+    raise SystemExit(1 if counts['failed'] else 0)
@@ -0,0 +1,89 @@
+"""
+Content-Addressed Analysis Result Cache
+Returns the stored response for a re-submitted image instead of re-running the pipeline
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+class AnalysisCache:
+    """
+    In-memory LRU cache of analysis responses with a time-to-live
+
+    Keys combine the SHA-256 of the uploaded bytes with every patient field
+    that ends up in the response or report (name, age, gender, location,
+    postal code) and the owning user, so a cached response is never served
+    to a different account or with another patient's identity.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (stored_at, response, file_stamp)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    KEY_FIELDS = ('name', 'age', 'gender', 'location', 'postal_code')
+
+    @staticmethod
+    def make_key(image_sha256: str, user_id, patient: Dict) -> str:
+        """Build the cache key from the upload's digest and parse_patient_form() fields"""
+        values = [user_id] + [patient.get(field, '') for field in AnalysisCache.KEY_FIELDS]
+        fields = '|'.join(str(v).strip().lower() for v in values)
+        return f"{image_sha256}:{fields}"
+
+    def get(self, key: str) -> Optional[Tuple[Dict, Optional[Tuple]]]:
+        """Return (response, file_stamp) for key, or None on a miss or expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, response, file_stamp = entry
+            if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response, file_stamp
+
+    def put(self, key: str, response: Dict, file_stamp: Tuple = None):
+        """
+        Store a response, evicting the least recently used entries beyond max_entries
+
+        file_stamp identifies the stored input image (see file_stamp()) so a
+        hit can be checked against the file on disk without reading it.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic(), response, file_stamp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: str):
+        """Drop a single entry (e.g. when its artifacts were deleted)"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds
+            }
@@ -7,25 +7,29 @@ import os
 import json
 import base64
 from io import BytesIO
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, Request, Response, g, render_template, request, jsonify, redirect, url_for, flash
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from roboflow import Roboflow
 from dotenv import load_dotenv
-from groq import Groq
 from PIL import Image
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import numpy as np
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.lib.utils import ImageReader
 from reportlab.lib import colors
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
+import uuid
+import hashlib
+import queue
+import threading
+import time
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect as sa_inspect, text as sa_text
 from flask_login import (
     LoginManager,
     UserMixin,
@@ -233,32 +237,50 @@ def wrap_text(text, max_width, canvas_obj, font_name, font_size):
     
     return lines if lines else ['']
 
-# Import XGBoost ensemble and XAI modules
-try:
-    from ensemble_model import SkinCancerEnsemble, simulate_cnn_predictions
-    ENSEMBLE_AVAILABLE = True
-except ImportError:
-    ENSEMBLE_AVAILABLE = False
-    print("⚠️ Ensemble model not available")
-
-try:
-    from explainability import SkinCancerExplainer
-    XAI_AVAILABLE = True
-except ImportError:
-    XAI_AVAILABLE = False
-    print("⚠️ XAI module not available")
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from stage_executor import StageExecutor
+from analysis_cache import AnalysisCache
+from image_ingest import IngestedImage, MAX_UPLOAD_BYTES, ingest_file, ingest_stream, spool_stream
+import metrics
+from metrics import timed_stage, stage_timer, record_stage_error
+from prescreen import PRESCREEN_ENABLED, prescreen_image
+from inference_backend import create_inference_backend
+from lazy_resource import LazyResource
+from tta import TTA_NUM_VIEWS, build_tta_views, tta_predictions, views_to_model_rows
+from model_pool import create_model_pool
+from admission import AdmissionController, AdmissionRejected
+from llm_client import StreamingLLMClient, LLMDeadlineExceeded
+from singleflight import SingleFlight
+from advice_cache import (
+    AdviceCache, PlaceholderStream, advice_cache_key, render_advice, age_band, confidence_bucket,
+    NAME_PLACEHOLDER, CONFIDENCE_PLACEHOLDER
+)
+from batch_scheduler import MicroBatchScheduler, InferenceOverloaded
+from prediction_cache import PredictionCache, dhash
+from resilience import CircuitOpenError
 
 # Load environment variables
 load_dotenv()
 
+class AppRequest(Request):
+    """Request with a larger body limit for the batch upload route"""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'analyze_batch':
+            return BATCH_MAX_CONTENT_LENGTH
+        return super().max_content_length
+
+
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = AppRequest
 # Enable CORS for React frontend with credentials support
 CORS(app, supports_credentials=True, origins=['http://localhost:3000', 'http://localhost:5173', 'http://127.0.0.1:3000', 'http://127.0.0.1:5173'])
 
 # Configuration
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES  # MAX_CONTENT_LENGTH env var, 16MB by default
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -305,7 +327,9 @@ class Analysis(db.Model):
     report_path = db.Column(db.String(500))
     all_predictions = db.Column(db.Text)  # JSON string of all predictions
     llm_advice = db.Column(db.Text)  # LLM generated advice
+    llm_status = db.Column(db.String(20), default='ready')  # pending (deferred to a worker) | ready | fallback (static advice)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
+    llm_usage = db.relationship('LLMUsage', backref='analysis', lazy=True, cascade='all, delete-orphan')
     
     def to_dict(self):
         """Convert analysis record to dictionary"""
@@ -322,54 +346,294 @@ class Analysis(db.Model):
             'report_path': self.report_path,
             'all_predictions': json.loads(self.all_predictions) if self.all_predictions else [],
             'llm_advice': self.llm_advice,
+            'llm_status': self.llm_status or 'ready',
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
         }
 
 
+LLM_USAGE_FIELDS = (
+    'model', 'source', 'prompt_kind', 'outcome', 'finish_reason', 'prompt_tokens', 'completion_tokens',
+    'total_tokens', 'tokens_estimated', 'max_tokens', 'prompt_chars', 'completion_chars',
+    'latency_seconds', 'first_token_seconds'
+)
+
+
+class LLMUsage(db.Model):
+    """Token usage and latency of the LLM advice call behind one analysis"""
+    __tablename__ = 'llm_usage'
+    id = db.Column(db.Integer, primary_key=True)
+    analysis_id = db.Column(db.Integer, db.ForeignKey('analysis.id'), nullable=False, index=True)
+    model = db.Column(db.String(100), nullable=False)
+    source = db.Column(db.String(20), nullable=False)  # live | coalesced | cache
+    prompt_kind = db.Column(db.String(20))  # template | personal
+    outcome = db.Column(db.String(20))  # ok | timeout | error | cancelled
+    finish_reason = db.Column(db.String(20))  # 'length' means max_tokens cut the answer off
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+    total_tokens = db.Column(db.Integer, default=0)
+    tokens_estimated = db.Column(db.Boolean, default=False)  # provider reported no usage
+    max_tokens = db.Column(db.Integer)
+    prompt_chars = db.Column(db.Integer)
+    completion_chars = db.Column(db.Integer)
+    latency_seconds = db.Column(db.Float)
+    first_token_seconds = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    @classmethod
+    def from_usage(cls, usage):
+        """Row from a usage dict produced by complete_llm()"""
+        return cls(**{column: usage.get(column) for column in LLM_USAGE_FIELDS})
+
+    def to_dict(self):
+        """Convert usage record to dictionary"""
+        return {
+            'id': self.id,
+            'analysis_id': self.analysis_id,
+            **{column: getattr(self, column) for column in LLM_USAGE_FIELDS},
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None
+        }
+
+
+class AnalysisJob(db.Model):
+    """Queued analysis request consumed by worker.py processes"""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(20), default='analyze', nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False, index=True)  # queued | running | done | failed
+    payload = db.Column(db.Text, nullable=False)  # JSON: uploaded file and patient fields
+    result = db.Column(db.Text)  # JSON: partial results while running, final response when done
+    status_code = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    worker_id = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        """Convert job record to dictionary"""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'status_code': self.status_code,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S') if self.started_at else None,
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None
+        }
+
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
 
+# Columns added after the first release; create_all() does not alter existing tables
+ADDED_COLUMNS = (
+    (Analysis, 'llm_status'),
+)
+
+
+def add_missing_columns():
+    """ALTER TABLE in columns listed in ADDED_COLUMNS that an older database lacks"""
+    inspector = sa_inspect(db.engine)
+    for model, column in ADDED_COLUMNS:
+        table = model.__tablename__
+        if column in {c['name'] for c in inspector.get_columns(table)}:
+            continue
+        column_type = model.__table__.columns[column].type.compile(dialect=db.engine.dialect)
+        with db.engine.begin() as conn:
+            conn.execute(sa_text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+        print(f"✅ Added column {table}.{column}")
+
+
 def init_db():
     """Initialize database tables."""
     with app.app_context():
         db.create_all()
+        add_missing_columns()
 
 
 init_db()
 
-# Initialize Roboflow
-API_KEY = os.getenv("ROBOFLOW_API_KEY")
-WORKSPACE = os.getenv("WORKSPACE")
-PROJECT = os.getenv("PROJECT")
-VERSION = os.getenv("VERSION")
+# Model and API clients are built on first use (see lazy_resource.py), so the
+# app starts without network access and auth/history work while they are down
+INFERENCE_BACKEND_NAME = os.getenv('INFERENCE_BACKEND', 'roboflow').lower()
+
+# Test-time augmentation for ensemble uncertainty: 'auto' enables it for the
+# local model only, since each view is a separate call to a remote service
+ENSEMBLE_TTA = os.getenv('ENSEMBLE_TTA', 'auto').lower()
+ENSEMBLE_TTA = INFERENCE_BACKEND_NAME == 'onnx' if ENSEMBLE_TTA == 'auto' else ENSEMBLE_TTA == 'true'
+
 
-rf = Roboflow(api_key=API_KEY)
-project = rf.workspace(WORKSPACE).project(PROJECT)
-model = project.version(VERSION).model
+def load_inference_backend():
+    """Build the classifier (Roboflow, hosted HTTP or local ONNX, see INFERENCE_BACKEND)"""
+    backend = create_inference_backend(INFERENCE_BACKEND_NAME)
+    print(f"✅ Inference backend: {backend.name}")
+    return backend
 
-# Initialize Groq client
-GROQ_API_KEY = os.getenv("GROQ_API_KEY", "your-groq-api-key-here")
-groq_client = Groq(api_key=GROQ_API_KEY)
 
-# Initialize XGBoost Ensemble
-ensemble_model = None
-if ENSEMBLE_AVAILABLE:
+def load_groq_client():
+    from groq import Groq
+    # GROQ_BASE_URL points the client at another OpenAI-compatible server (e.g. standin_server.py)
+    return Groq(
+        api_key=os.getenv("GROQ_API_KEY", "your-groq-api-key-here"),
+        base_url=os.getenv("GROQ_BASE_URL") or None
+    )
+
+
+def load_ensemble_model():
+    """XGBoost ensemble, or None when the module or model file is unavailable"""
+    try:
+        from ensemble_model import SkinCancerEnsemble
+    except ImportError:
+        print("⚠️ Ensemble model not available")
+        return None
     try:
-        ensemble_model = SkinCancerEnsemble(model_path='models/xgboost_ensemble.pkl')
+        model = SkinCancerEnsemble(model_path='models/xgboost_ensemble.pkl')
         print("✅ XGBoost ensemble initialized")
+        return model
     except Exception as e:
         print(f"⚠️ Could not initialize ensemble: {e}")
+        return None
+
 
-# Initialize XAI Explainer
-explainer = None
-if XAI_AVAILABLE:
+def load_explainer():
+    """XAI explainer, or None when its dependencies are unavailable"""
     try:
-        explainer = SkinCancerExplainer()
+        from explainability import SkinCancerExplainer
+    except ImportError:
+        print("⚠️ XAI module not available")
+        return None
+    try:
+        xai = SkinCancerExplainer()
         print("✅ XAI explainer initialized")
+        return xai
     except Exception as e:
         print(f"⚠️ Could not initialize explainer: {e}")
+        return None
+
+
+def load_model_pool():
+    """Process pool of local ensemble member models, or None when not configured or mismatched"""
+    model = ensemble_model.get()
+    xgb_model = model.xgb_model if model and model.is_trained else None
+    try:
+        return create_model_pool(n_features=getattr(xgb_model, 'n_features_in_', None))
+    except Exception as e:
+        print(f"⚠️ Could not start ensemble model pool: {e}")
+        return None
+
+
+inference_backend = LazyResource('inference_backend', load_inference_backend)
+groq_client = LazyResource('groq_client', load_groq_client)
+ensemble_model = LazyResource('ensemble_model', load_ensemble_model)
+explainer = LazyResource('explainer', load_explainer)
+model_pool = LazyResource('model_pool', load_model_pool)
+
+# Concurrent requests are coalesced into batched backend calls. 'auto' enables
+# it for the local model only: for remote backends a batch is just concurrent
+# single-image calls, and the slowest one would hold up the next batch
+INFERENCE_BATCHING = os.getenv('INFERENCE_BATCHING', 'auto').lower()
+INFERENCE_BATCHING = INFERENCE_BACKEND_NAME == 'onnx' if INFERENCE_BATCHING == 'auto' else INFERENCE_BATCHING == 'true'
+
+inference_scheduler = None
+if INFERENCE_BATCHING:
+    inference_scheduler = MicroBatchScheduler(
+        inference_backend,
+        max_batch_size=int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '8')),
+        max_wait_ms=float(os.getenv('INFERENCE_MAX_WAIT_MS', '10')),
+        max_queue_depth=int(os.getenv('INFERENCE_MAX_QUEUE_DEPTH', '64')),
+        workers=int(os.getenv('INFERENCE_BATCH_WORKERS', '1')),
+        request_timeout=float(os.getenv('INFERENCE_REQUEST_TIMEOUT', '60'))
+    )
+    metrics.REGISTRY.callback_gauge(
+        'skincare_inference_queue_depth', 'Requests waiting for the inference batch scheduler',
+        inference_scheduler.queue_depth
+    )
+    metrics.REGISTRY.callback_gauge(
+        'skincare_inference_scheduler_config', 'Configured inference batch scheduler limits',
+        lambda: {(name,): value for name, value in inference_scheduler.stats().items() if name != 'queue_depth'},
+        ['name']
+    )
+
+# Repeat camera captures of the same lesion (analyses posted with source=camera)
+# reuse the user's own earlier capture prediction; file uploads never touch it
+prediction_cache = None
+if os.getenv('PREDICTION_CACHE_ENABLED', 'true').lower() == 'true':
+    prediction_cache = PredictionCache(
+        max_distance=int(os.getenv('PREDICTION_CACHE_MAX_DISTANCE', '2')),
+        max_entries=int(os.getenv('PREDICTION_CACHE_MAX_ENTRIES', '1024')),
+        ttl_seconds=float(os.getenv('PREDICTION_CACHE_TTL', '86400')),
+        disk_path=os.getenv('PREDICTION_CACHE_PATH') or None,
+        namespace=INFERENCE_BACKEND_NAME
+    )
+    metrics.REGISTRY.callback_gauge(
+        'skincare_prediction_cache_entries', 'Entries held in memory by the perceptual-hash prediction cache',
+        lambda: prediction_cache.stats()['entries']
+    )
+
+# Analyses (single, streamed and each image of a batch) running at once, see analyze_admission
+ANALYZE_MAX_CONCURRENT = int(os.getenv('ANALYZE_MAX_CONCURRENT', '4'))
+
+# Shared pools for the independent post-prediction stages of the pipeline. The
+# LLM stage mostly waits on the network (up to LLM_DEADLINE_SECONDS), so it has
+# its own threads and never queues the visualization, ensemble and saliency
+# stages of other analyses; the default sizes let every admitted analysis run
+# all of its stages at once
+pipeline_executor = StageExecutor(
+    max_workers=int(os.getenv('PIPELINE_MAX_WORKERS', str(3 * ANALYZE_MAX_CONCURRENT))),
+    dedicated_workers={'llm_advice': int(os.getenv('PIPELINE_LLM_WORKERS', str(ANALYZE_MAX_CONCURRENT)))}
+)
+
+# Generated LLM advice is reused across patients with the same diagnosis,
+# confidence bucket, age band and gender (persisted in SQLite)
+advice_cache = None
+if os.getenv('ADVICE_CACHE_ENABLED', 'true').lower() == 'true':
+    advice_cache = AdviceCache(
+        os.getenv('ADVICE_CACHE_PATH', 'advice_cache.db'),
+        ttl_seconds=float(os.getenv('ADVICE_CACHE_TTL', str(7 * 24 * 3600)))
+    )
+    metrics.REGISTRY.callback_gauge(
+        'skincare_advice_cache_hit_ratio', 'Hit rate of the LLM advice template cache since start',
+        lambda: advice_cache.stats()['hit_rate']
+    )
+
+# Bound how many analyses (and camera captures) hold decoded images, figures
+# and PDFs in memory at once; the overflow waits briefly, then gets 429
+analyze_admission = AdmissionController(
+    'analyze',
+    max_concurrent=ANALYZE_MAX_CONCURRENT,
+    max_queue=int(os.getenv('ANALYZE_MAX_QUEUE', '8')),
+    max_wait=float(os.getenv('ANALYZE_MAX_QUEUE_WAIT', '10'))
+)
+capture_admission = AdmissionController(
+    'capture',
+    max_concurrent=int(os.getenv('CAPTURE_MAX_CONCURRENT', '8')),
+    max_queue=int(os.getenv('CAPTURE_MAX_QUEUE', '16')),
+    max_wait=float(os.getenv('CAPTURE_MAX_QUEUE_WAIT', '5'))
+)
+
+# Re-submissions of the same photo and patient fields reuse the stored response
+analysis_cache = AnalysisCache(
+    ttl_seconds=float(os.getenv('ANALYSIS_CACHE_TTL', '3600')),
+    max_entries=int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '256'))
+)
+metrics.REGISTRY.callback_gauge(
+    'skincare_analysis_cache_hits_total', 'Analysis result cache hits',
+    lambda: analysis_cache.hits, kind='counter'
+)
+metrics.REGISTRY.callback_gauge(
+    'skincare_analysis_cache_misses_total', 'Analysis result cache misses',
+    lambda: analysis_cache.misses, kind='counter'
+)
+metrics.REGISTRY.callback_gauge(
+    'skincare_analysis_cache_entries', 'Entries held by the analysis result cache',
+    lambda: analysis_cache.stats()['entries']
+)
 
 # Skin condition information
 CONDITION_INFO = {
@@ -410,21 +674,97 @@ CONDITION_INFO = {
     }
 }
 
-def analyze_with_llm(name, age, gender, prediction, confidence, location="Unknown", latitude=None, longitude=None):
-    """
-    Get medical advice and insights from Groq LLM
-    """
-    try:
-        condition_info = CONDITION_INFO.get(prediction, {})
-        severity = condition_info.get('severity', 'Unknown')
-        description = condition_info.get('description', 'Consult a healthcare professional')
+# Rejection payloads shared by the local pre-screen and the post-prediction checks
+NO_LESION_ERROR = {
+    'error': 'No skin lesion detected',
+    'message': 'Unable to detect a skin lesion in this image. Please ensure:\n• The image shows a clear view of the skin lesion\n• The lesion is in focus and well-lit\n• The photo is taken from a close distance\n• Try uploading a different image'
+}
+NOT_SKIN_ERROR = {
+    'error': 'Unable to identify skin lesion',
+    'message': 'The AI cannot confidently identify a skin lesion in this image.\n\n❌ This image may not contain a skin lesion at all.\n\n✅ Please ensure you upload:\n• A real photograph of a skin lesion/mole/spot\n• NOT drawings, cartoons, or unrelated images\n• Clear, focused photo of actual skin\n\n📸 The image should show human skin with a visible lesion.'
+}
+INFERENCE_BUSY_ERROR = {
+    'error': 'Service busy',
+    'message': 'The analysis service is handling too many images right now. Please try again in a few seconds.',
+    'retry_after': 2
+}
+INFERENCE_UNAVAILABLE_ERROR = {
+    'error': 'Classifier unavailable',
+    'message': 'The image classification service is not responding right now. Please try again shortly.'
+}
+# Returned when the streaming client disconnects mid-analysis; never sent
+ANALYSIS_CANCELLED_ERROR = {'error': 'Analysis cancelled'}
+PRESCREEN_ERRORS = {
+    'not_skin': NOT_SKIN_ERROR,
+    'blurry': NO_LESION_ERROR,
+    'underexposed': NO_LESION_ERROR,
+    'overexposed': NO_LESION_ERROR
+}
 
-        # Prepare location context
-        location_context = f"Location: {location}"
-        if latitude and longitude:
-            location_context += f" (Coordinates: {latitude:.4f}, {longitude:.4f})"
+LLM_MODEL = os.getenv('LLM_MODEL', 'openai/gpt-oss-20b')
+# USD per million tokens, for the cost estimate in /api/llm/usage
+LLM_PROMPT_COST_PER_MTOK = float(os.getenv('LLM_PROMPT_COST_PER_MTOK', '0'))
+LLM_COMPLETION_COST_PER_MTOK = float(os.getenv('LLM_COMPLETION_COST_PER_MTOK', '0'))
+
+# 'inline' runs the LLM inside the analysis; 'deferred' returns without advice
+# and lets worker.py backfill it (see backfill_llm_advice)
+LLM_ADVICE_MODE = os.getenv('LLM_ADVICE_MODE', 'inline').lower()
+ADVICE_PENDING_TEXT = "*Medical insights are being generated and will be added to this report shortly.*"
+LLM_SYSTEM_PROMPT = "You are a helpful medical information assistant using advanced GPT technology. Always emphasize that AI predictions are not medical diagnoses and patients should consult healthcare professionals."
+
+# The whole completion must finish within LLM_DEADLINE_SECONDS, otherwise the
+# static advice below is returned instead
+llm_client = StreamingLLMClient(
+    groq_client,
+    LLM_MODEL,
+    deadline=float(os.getenv('LLM_DEADLINE_SECONDS', '20')),
+    first_token_timeout=float(os.getenv('LLM_FIRST_TOKEN_TIMEOUT', '8')) or None,
+    max_tokens=1000,
+    temperature=0.7
+)
 
-        prompt = f"""
+
+def _static_advice_template(condition, info):
+    urgency = (
+        "Please book an appointment with a dermatologist as soon as possible."
+        if info['severity'] in ('High Risk', 'VERY HIGH RISK')
+        else "Mention it to a dermatologist or your doctor at your next visit, sooner if it changes."
+    )
+    return f"""## 📋 Condition Overview
+The AI model suggests **{condition}** for {NAME_PLACEHOLDER} with {CONFIDENCE_PLACEHOLDER} confidence.
+
+- **Risk level:** {info['severity']}
+- **Summary:** {info['description']}
+
+## ⚠️ Important Precautions
+- {urgency}
+- Watch the lesion for changes in size, shape, colour or border, and for bleeding or itching
+- Protect your skin from the sun with SPF 30+ sunscreen and protective clothing
+- Take dated photos of the lesion so changes are easy to spot
+
+*This is an automated summary, not a medical diagnosis. Always consult a qualified healthcare professional.*
+"""
+
+
+# Identical prompts in flight at the same time (same advice cache key, or
+# the same patient twice) wait on one completion
+llm_flight = SingleFlight('llm')
+
+
+# Precomputed per-condition advice (None: unknown condition), filled in with render_advice()
+FALLBACK_ADVICE = {condition: _static_advice_template(condition, info) for condition, info in CONDITION_INFO.items()}
+FALLBACK_ADVICE[None] = _static_advice_template('an unrecognised condition', {
+    'severity': 'Unknown', 'description': 'Consult a healthcare professional'
+})
+
+
+def build_advice_prompt(name, age, gender, prediction, confidence, location_context):
+    """User prompt for the advice completion; name/confidence/age may be placeholders"""
+    condition_info = CONDITION_INFO.get(prediction, {})
+    severity = condition_info.get('severity', 'Unknown')
+    description = condition_info.get('description', 'Consult a healthcare professional')
+
+    return f"""
         As a medical AI assistant, provide helpful information about skin cancer detection results.
         Please be cautious and emphasize that this is NOT a medical diagnosis.
 
@@ -436,7 +776,7 @@ def analyze_with_llm(name, age, gender, prediction, confidence, location="Unknow
 
         AI Model Prediction:
         - Condition: {prediction}
-        - Confidence: {confidence:.2f}%
+        - Confidence: {confidence}
         - Risk Level: {severity}
         - Description: {description}
 
@@ -453,59 +793,221 @@ def analyze_with_llm(name, age, gender, prediction, confidence, location="Unknow
         Always stress that this is not a substitute for professional medical advice.
         """
 
-        response = groq_client.chat.completions.create(
-            model="openai/gpt-oss-20b",
-            messages=[
-                {"role": "system", "content": "You are a helpful medical information assistant using advanced GPT technology. Always emphasize that AI predictions are not medical diagnoses and patients should consult healthcare professionals."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.7
+
+def llm_usage_record(source, prompt_kind, **fields):
+    """Usage dict for advice that did not need its own upstream completion"""
+    return {
+        'model': LLM_MODEL, 'source': source, 'prompt_kind': prompt_kind, 'outcome': 'ok',
+        'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, **fields
+    }
+
+
+def complete_llm(prompt, on_token=None, deadline=None, usage_sink=None, prompt_kind='personal'):
+    """
+    Run one streamed chat completion within the LLM deadline, passing deltas to on_token
+
+    Concurrent calls with the same prompt share a single upstream request.
+    usage_sink, if given, receives the usage dict of the call: 'live' for the
+    caller that made the request, 'coalesced' (no tokens) for those that waited on it.
+    """
+    messages = [
+        {"role": "system", "content": LLM_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    key = hashlib.sha256(f"{LLM_MODEL}\n{LLM_SYSTEM_PROMPT}\n{prompt}".encode('utf-8')).hexdigest()
+    usage = {}
+    start = time.perf_counter()
+    deadline = deadline or llm_client.deadline
+    streamed = []
+
+    def relay(delta):
+        streamed.append(delta)
+        on_token(delta)
+
+    try:
+        # A follower waits no longer than its own deadline, even when the shared
+        # call has a longer one (e.g. an advice library generation)
+        return llm_flight.do(
+            key,
+            lambda publish: llm_client.complete(messages, on_token=publish, deadline=deadline, on_usage=usage.update),
+            on_token=relay if on_token else None,
+            timeout=deadline
         )
+    except LLMDeadlineExceeded:
+        usage.setdefault('outcome', 'timeout')
+        raise
+    except TimeoutError:
+        usage.setdefault('outcome', 'timeout')
+        raise LLMDeadlineExceeded('coalesced', deadline, ''.join(streamed))
+    except Exception:
+        usage.setdefault('outcome', 'error')
+        raise
+    finally:
+        if usage_sink:
+            if 'prompt_tokens' in usage:
+                usage_sink({**usage, 'source': 'live', 'prompt_kind': prompt_kind})
+            else:
+                usage_sink(llm_usage_record(
+                    'coalesced', prompt_kind, outcome=usage.get('outcome', 'ok'),
+                    latency_seconds=round(time.perf_counter() - start, 4)
+                ))
 
-        return response.choices[0].message.content
 
-    except Exception as e:
-        return f"Unable to generate medical advice at this time. Error: {str(e)}. Please consult a healthcare professional."
+def fallback_advice(name, prediction, confidence):
+    """Advice text built from CONDITION_INFO, used when the LLM misses its deadline"""
+    return render_advice(FALLBACK_ADVICE.get(prediction, FALLBACK_ADVICE[None]), name, confidence)
+
 
-def process_image_prediction(image_path):
+def generate_advice_template(prediction, confidence, age, gender, on_token=None, deadline=None, usage_sink=None):
     """
-    Process image through Roboflow model
+    Ask the LLM for advice for a (diagnosis, confidence bucket, age band, gender)
+    group, with NAME_PLACEHOLDER and CONFIDENCE_PLACEHOLDER in place of the
+    patient-specific values (see render_advice)
+    """
+    prompt = build_advice_prompt(
+        NAME_PLACEHOLDER,
+        f"{age_band(age)} years",
+        gender,
+        prediction,
+        f"{CONFIDENCE_PLACEHOLDER} (between {confidence_bucket(confidence)}%)",
+        "Location: not provided"
+    ) + f"""
+        Refer to the patient only as {NAME_PLACEHOLDER} and to the model confidence only as
+        {CONFIDENCE_PLACEHOLDER}; copy these placeholders exactly, they are filled in later.
+        """
+    return complete_llm(prompt, on_token=on_token, deadline=deadline, usage_sink=usage_sink, prompt_kind='template')
+
+
+def cached_advice(name, age, gender, prediction, confidence, on_token=None, usage_sink=None):
+    """
+    Advice from the template cache, generating and storing the template on a miss
+
+    The template is written for the (diagnosis, confidence bucket, age band,
+    gender) group with placeholders for the name and exact confidence, which
+    are filled in per patient.
+    """
+    key = advice_cache_key(prediction, confidence, age, gender, LLM_MODEL)
+    template = advice_cache.get(key)
+    if template is not None:
+        advice = render_advice(template, name, confidence)
+        if on_token:
+            on_token(advice)
+        if usage_sink:
+            usage_sink(llm_usage_record('cache', 'template', latency_seconds=0.0))
+        return advice
+
+    # Stream the template with placeholders filled in as they complete
+    stream = PlaceholderStream(name, confidence) if on_token else None
+
+    def emit(delta):
+        text = stream.feed(delta)
+        if text:
+            on_token(text)
+
+    template = generate_advice_template(prediction, confidence, age, gender, on_token=emit if stream else None,
+                                        usage_sink=usage_sink)
+    if stream:
+        tail = stream.flush()
+        if tail:
+            on_token(tail)
+
+    advice_cache.put(key, template, prediction, confidence, age, gender)
+    return render_advice(template, name, confidence)
+
+
+@timed_stage('llm')
+def analyze_with_llm(name, age, gender, prediction, confidence, location="Unknown", latitude=None, longitude=None,
+                     on_token=None, usage_sink=None):
+    """
+    Get medical advice and insights from Groq LLM
+
+    If on_token is given the completion is streamed and on_token(text) is
+    called for every content delta as it arrives; the full text is still returned.
+    With the advice cache enabled, similar patients share one generated template.
+    If the LLM misses its deadline the static advice for the condition is
+    returned (and streamed) instead. usage_sink(dict) receives the token usage
+    and latency of the call (see complete_llm).
+
+    Returns:
+        (advice text, llm_status): 'ready' for LLM advice, 'fallback' when the
+        static or error text was used instead
     """
     try:
-        result = model.predict(image_path)
-        predictions = result.json()
+        if advice_cache is not None:
+            advice = cached_advice(name, age, gender, prediction, confidence, on_token=on_token, usage_sink=usage_sink)
+            return advice, 'ready'
 
-        pred_list = predictions.get('predictions')
-        if not pred_list or not isinstance(pred_list, list) or len(pred_list) == 0:
-            return None
+        # Prepare location context
+        location_context = f"Location: {location}"
+        if latitude and longitude:
+            location_context += f" (Coordinates: {latitude:.4f}, {longitude:.4f})"
 
-        pred_data = predictions['predictions'][0]
-        all_preds = pred_data['predictions']
+        prompt = build_advice_prompt(name, age, gender, prediction, f"{confidence:.2f}%", location_context)
+        return complete_llm(prompt, on_token=on_token, usage_sink=usage_sink), 'ready'
 
-        # Get top class
-        predicted_classes = pred_data.get('predicted_classes', [])
-        if predicted_classes:
-            top_class = predicted_classes[0]
-        else:
-            top_class = max(all_preds, key=lambda x: all_preds[x]['confidence'])
+    except LLMDeadlineExceeded as e:
+        record_stage_error('llm')
+        print(f"⚠️ {e}, using static advice for {prediction}")
+        advice = fallback_advice(name, prediction, confidence)
+        if on_token:
+            # Tokens already streamed are superseded by the static text
+            on_token(f"\n\n---\n\n{advice}" if e.partial else advice)
+        return advice, 'fallback'
 
-        top_confidence = all_preds[top_class]['confidence'] * 100
+    except Exception as e:
+        record_stage_error('llm')
+        return (f"Unable to generate medical advice at this time. Error: {str(e)}. "
+                "Please consult a healthcare professional."), 'fallback'
 
-        return {
-            'top_class': top_class,
-            'confidence': top_confidence,
-            'all_predictions': all_preds,
-            'image_info': pred_data['image']
-        }
 
+@timed_stage('inference')
+def process_image_prediction(image, user_id=None, capture=False):
+    """
+    Classify an image with the configured inference backend
+
+    Args:
+        image: IngestedImage or a file path
+        user_id: Owner of the image (scope of the prediction cache)
+        capture: Camera capture; a near-duplicate of one of the user's earlier
+                 captures reuses its prediction instead of calling the backend
+
+    Raises:
+        InferenceOverloaded when the batch scheduler queue is full,
+        CircuitOpenError / TimeoutError when the remote classifier is unhealthy
+    """
+    try:
+        image_hash = None
+        if capture and prediction_cache is not None and user_id is not None:
+            rgb = image.rgb if hasattr(image, 'rgb') else np.asarray(Image.open(image).convert('RGB'))
+            image_hash = dhash(rgb)
+            cached = prediction_cache.get(image_hash, scope=user_id)
+            if cached is not None:
+                return cached
+
+        if inference_scheduler:
+            result = inference_scheduler.predict(image)
+        else:
+            result = inference_backend.get().predict(image)
+
+        if result and image_hash is not None:
+            prediction_cache.put(image_hash, result, scope=user_id)
+        return result
+
+    except (InferenceOverloaded, CircuitOpenError, TimeoutError):
+        # Counted as a stage error by timed_stage
+        raise
     except Exception as e:
         print(f"Error in prediction: {e}")
+        record_stage_error('inference')
         return None
 
-def create_visualization(image_path, predictions, save_path):
+@timed_stage('visualization')
+def create_visualization(image, predictions, save_path):
     """
     Create visualization chart
+
+    Args:
+        image: IngestedImage (already decoded pixels) or a file path
     """
     try:
         pred_data = predictions
@@ -516,11 +1018,12 @@ def create_visualization(image_path, predictions, save_path):
                              key=lambda x: x[1]['confidence'],
                              reverse=True)
 
-        # Create figure
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 6))
+        # Create figure (object API rather than pyplot, so stages can draw from worker threads)
+        fig = Figure(figsize=(16, 6))
+        ax1, ax2 = fig.subplots(1, 2)
 
         # Left: Original Image
-        img = Image.open(image_path)
+        img = image.rgb if isinstance(image, IngestedImage) else Image.open(image)
         ax1.imshow(img)
         ax1.axis('off')
         ax1.set_title('Input Image', fontsize=16, fontweight='bold', pad=15)
@@ -560,16 +1063,78 @@ def create_visualization(image_path, predictions, save_path):
                 fontweight='bold', color='darkred',
                 bbox=dict(boxstyle='round,pad=0.5', facecolor='yellow', alpha=0.7))
 
-        plt.tight_layout()
-        plt.savefig(save_path, dpi=150, bbox_inches='tight')
-        plt.close()
+        fig.tight_layout()
+        fig.savefig(save_path, dpi=150, bbox_inches='tight')
 
         return True
 
     except Exception as e:
         print(f"Error creating visualization: {e}")
+        record_stage_error('visualization')
         return False
 
+@app.before_request
+def start_request_metrics():
+    if request.endpoint in (None, 'static', 'prometheus_metrics'):
+        return
+    g.metrics_endpoint = request.endpoint
+    g.metrics_started = time.perf_counter()
+    metrics.REQUESTS_IN_FLIGHT.inc(endpoint=request.endpoint)
+
+
+@app.teardown_request
+def finish_request_metrics(exc=None):
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is None:
+        return
+    record_request_metrics(endpoint, g.pop('metrics_started'))
+
+
+def record_request_metrics(endpoint, started):
+    metrics.REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=endpoint)
+    metrics.REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+
+
+def admission_rejected_payload(rejection):
+    """Error body for work turned away by admission control"""
+    return {
+        'error': 'Too many requests',
+        'message': 'The server is busy analyzing other images. Please try again shortly.',
+        'retry_after': rejection.retry_after
+    }
+
+
+def admission_rejected_response(rejection):
+    """429 with a Retry-After header for a request turned away by admission control"""
+    response = jsonify(admission_rejected_payload(rejection))
+    response.status_code = 429
+    response.headers['Retry-After'] = str(rejection.retry_after)
+    return response
+
+
+def admission_controlled(controller):
+    """Run the view only once `controller` grants a slot; answer 429 otherwise"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                granted_at = controller.acquire()
+            except AdmissionRejected as rejection:
+                return admission_rejected_response(rejection)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                controller.release(granted_at)
+        return wrapper
+    return decorator
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.REGISTRY.render(), mimetype=metrics.CONTENT_TYPE)
+
+
 @app.route('/')
 def index():
     return redirect(url_for('dashboard'))
@@ -584,365 +1149,1132 @@ def favicon():
     # Avoid 404s for favicon requests when no icon is provided
     return "", 204
 
-@app.route('/analyze', methods=['POST'])
-@login_required
-def analyze():
-    """Analyze uploaded image"""
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+
+
+def parse_patient_form(form):
+    """
+    Read and validate the patient fields shared by all analysis endpoints
+
+    Returns:
+        (patient dict, None) on success or (None, (error payload, status)) on failure
+    """
+    name = form.get('name', '').strip()
+    age = form.get('age', '').strip()
+    gender = form.get('gender', '').strip()
+    location = form.get('location', 'Unknown').strip()
+    latitude = form.get('latitude')
+    longitude = form.get('longitude')
+
+    # Convert coordinates to float if provided
+    if latitude and longitude:
+        try:
+            latitude = float(latitude)
+            longitude = float(longitude)
+        except ValueError:
+            latitude = None
+            longitude = None
+    else:
+        latitude = None
+        longitude = None
+
+    # Validate required fields
+    if not all([name, age, gender]):
+        return None, ({'error': 'Name, age, and gender are required'}, 400)
+
+    patient = {
+        'name': name,
+        'age': age,
+        'gender': gender,
+        'location': location,
+        'latitude': latitude,
+        'longitude': longitude,
+        'postal_code': form.get('postal_code') or form.get('pin') or '',
+        'source': 'camera' if form.get('source') == 'camera' else 'upload'
+    }
+    return patient, None
+
+
+def validate_upload_filename(file):
+    """
+    Check that an uploaded file is present and has an allowed image extension
+
+    Returns:
+        (secure filename, None) on success or (None, (error payload, status)) on failure
+    """
+    if file is None:
+        return None, ({'error': 'No image file provided'}, 400)
+    if file.filename == '':
+        return None, ({'error': 'No image selected'}, 400)
+
+    filename = secure_filename(file.filename)
+    file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    if file_ext not in ALLOWED_EXTENSIONS:
+        return None, ({
+            'error': 'Invalid file format',
+            'message': 'Please upload a valid image file (JPG, PNG, JPEG, GIF, BMP, or WEBP)'
+        }, 400)
+    return filename, None
+
+
+@timed_stage('ensemble')
+def run_ensemble_prediction(prediction_result, age, gender, location, image=None):
+    """
+    Run the XGBoost ensemble with uncertainty estimation (if available)
+
+    Ensemble inputs, in order of preference: the member models of the
+    process pool (models/ensemble_members.json) scored on test-time augmented
+    copies of `image` (one feature row per view), the per-view probabilities
+    of those copies from the inference backend (one batched call), or
+    predictions simulated around the top class.
+    """
+    model = ensemble_model.get()
+    if not (model and model.is_trained):
+        return None
+
     try:
-        # Get form data
-        name = request.form.get('name', '').strip()
-        age = request.form.get('age', '').strip()
-        gender = request.form.get('gender', '').strip()
-        location = request.form.get('location', 'Unknown').strip()
-        latitude = request.form.get('latitude')
-        longitude = request.form.get('longitude')
+        # Prepare metadata
+        metadata = {
+            'age': int(age),
+            'gender': gender,
+            'location': location
+        }
 
-        # Convert coordinates to float if provided
-        if latitude and longitude:
+        rows = None
+        source = None
+        # The spread across rows is the uncertainty, so the pool needs several views
+        pool = model_pool.get() if image is not None and hasattr(image, 'rgb') and TTA_NUM_VIEWS > 1 else None
+        if pool:
             try:
-                latitude = float(latitude)
-                longitude = float(longitude)
-            except ValueError:
-                latitude = None
-                longitude = None
-
-        # Validate required fields
-        if not all([name, age, gender]):
-            return jsonify({'error': 'Name, age, and gender are required'}), 400
-
-        # Handle image upload
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
-
-        file = request.files['image']
-        if file.filename == '':
-            return jsonify({'error': 'No image selected'}), 400
-
-        # Validate file type
-        filename = secure_filename(file.filename)
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
-        file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-        if file_ext not in allowed_extensions:
-            return jsonify({
-                'error': 'Invalid file format',
-                'message': 'Please upload a valid image file (JPG, PNG, JPEG, GIF, BMP, or WEBP)'
-            }), 400
+                with stage_timer('tta_views'):
+                    views = build_tta_views(image.rgb, TTA_NUM_VIEWS)
+                rows = pool.predict_views(views)
+                source = 'model_pool'
+            except Exception as e:
+                print(f"⚠️ Ensemble model pool failed: {e}")
 
-        # Save uploaded file
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        if rows is None and ENSEMBLE_TTA and image is not None and hasattr(image, 'rgb'):
+            rows = views_to_model_rows(tta_predictions(inference_backend.get(), image))
+            if rows is None:
+                print("⚠️ Too few augmented views classified, using simulated ensemble inputs")
 
-        # Validate if it's actually an image
+        if rows:
+            source = source or 'tta'
+            features = np.vstack([model.prepare_features(row, metadata) for row in rows])
+        else:
+            from ensemble_model import simulate_cnn_predictions
+
+            # Simulate multiple CNN predictions for ensemble
+            source = 'simulated'
+            cnn_predictions = simulate_cnn_predictions(
+                prediction_result['top_class'],
+                noise_level=0.05
+            )
+            features = model.prepare_features(cnn_predictions, metadata)
+
+        # Predict with uncertainty (one predict_proba call for all rows)
+        uncertainty = model.predict_with_uncertainty(features, n_iterations=10)
+
+        ensemble_result = {
+            'prediction': uncertainty['prediction'],
+            'confidence': round(uncertainty['confidence'], 2),
+            'confidence_std': round(uncertainty['confidence_std'], 2),
+            'uncertainty_score': round(uncertainty['uncertainty_score'], 3),
+            'agreement_rate': round(uncertainty['agreement_rate'], 1),
+            'recommendation': uncertainty['recommendation'],
+            'source': source,
+            'feature_rows': len(features)
+        }
+
+        print(f"✅ Ensemble prediction: {ensemble_result['prediction']} "
+              f"({ensemble_result['confidence']:.1f}% ± {ensemble_result['confidence_std']:.1f}%)")
+        return convert_to_serializable(ensemble_result)
+
+    except Exception as e:
+        print(f"⚠️ Ensemble prediction failed: {e}")
+        record_stage_error('ensemble')
+        return None
+
+
+@timed_stage('explainability')
+def generate_explainability(image, filename):
+    """
+    Generate explainability artifacts (if available) and return their public paths
+    """
+    explainability_paths = {}
+    xai = explainer.get()
+    if xai:
         try:
-            img = Image.open(filepath)
-            img.verify()  # Verify it's a valid image
-            img = Image.open(filepath)  # Reopen after verify
-            
-            # Check image dimensions
-            width, height = img.size
-            if width < 50 or height < 50:
-                os.remove(filepath)
-                return jsonify({
-                    'error': 'Image too small',
-                    'message': 'Please upload an image with at least 50x50 pixels for accurate analysis'
-                }), 400
-                
+            # Generate saliency map (always works)
+            saliency_path = os.path.join(app.config['UPLOAD_FOLDER'], f'saliency_{filename}')
+            xai.generate_saliency_map(image, save_path=saliency_path)
+            explainability_paths['saliency'] = f'/static/uploads/saliency_{filename}'
+
+            print("✅ Saliency map generated")
+
         except Exception as e:
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            return jsonify({
-                'error': 'Invalid image file',
-                'message': 'The uploaded file is not a valid image. Please try again with a different photo.'
-            }), 400
+            print(f"⚠️ Explainability generation failed: {e}")
+            record_stage_error('explainability')
+    return explainability_paths
 
-        # Process image
-        prediction_result = process_image_prediction(filepath)
 
-        if not prediction_result:
-            # Clean up the uploaded file
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            return jsonify({
-                'error': 'No skin lesion detected',
-                'message': 'Unable to detect a skin lesion in this image. Please ensure:\n• The image shows a clear view of the skin lesion\n• The lesion is in focus and well-lit\n• The photo is taken from a close distance\n• Try uploading a different image'
-            }), 400
-        
-        # Check if confidence is too low (threshold: 60%)
-        if prediction_result['confidence'] < 60:
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            return jsonify({
-                'error': 'Invalid or unclear image detected',
-                'message': f'The AI model has very low confidence ({prediction_result["confidence"]:.1f}%) in analyzing this image.\n\n⚠️ This usually means:\n• This is NOT a skin lesion image\n• The image shows something else entirely\n• The photo quality is extremely poor\n• The lesion is not visible or in focus\n\n✅ Please upload a clear, close-up photo of an actual skin lesion.\n\n📸 Tips for better results:\n• Use good lighting\n• Focus clearly on the lesion\n• Take photo from 6-12 inches away\n• Ensure the lesion fills most of the frame'
-            }), 400
-        
-        # Additional validation: Check prediction distribution
-        # If all predictions are similar (low variance), likely not a skin lesion
-        all_preds = prediction_result.get('all_predictions', {})
-        if all_preds:
-            confidences = [pred.get('confidence', 0) for pred in all_preds.values()]
-            if len(confidences) > 1:
-                max_conf = max(confidences)
-                min_conf = min(confidences)
-                variance = max_conf - min_conf
-                
-                # If variance is too low, predictions are scattered (not confident about anything)
-                if variance < 0.20 and max_conf < 0.65:  # Less than 20% difference and top is under 65%
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                    return jsonify({
-                        'error': 'Unable to identify skin lesion',
-                        'message': 'The AI cannot confidently identify a skin lesion in this image.\n\n❌ This image may not contain a skin lesion at all.\n\n✅ Please ensure you upload:\n• A real photograph of a skin lesion/mole/spot\n• NOT drawings, cartoons, or unrelated images\n• Clear, focused photo of actual skin\n\n📸 The image should show human skin with a visible lesion.'
-                    }), 400
-
-        # Create visualization
-        viz_path = os.path.join(app.config['UPLOAD_FOLDER'], f'viz_{filename}')
-        create_visualization(filepath, prediction_result, viz_path)
-
-        # XGBoost Ensemble Prediction (if available)
-        ensemble_result = None
-        if ensemble_model and ensemble_model.is_trained:
-            try:
-                # Simulate multiple CNN predictions for ensemble
-                # In production, replace with actual multi-model predictions
-                cnn_predictions = simulate_cnn_predictions(
-                    prediction_result['top_class'], 
-                    noise_level=0.05
-                )
-                
-                # Prepare metadata
-                metadata = {
-                    'age': int(age),
-                    'gender': gender,
-                    'location': location
-                }
-                
-                # Get ensemble features
-                features = ensemble_model.prepare_features(cnn_predictions, metadata)
-                
-                # Predict with uncertainty
-                uncertainty = ensemble_model.predict_with_uncertainty(features, n_iterations=10)
-                
-                ensemble_result = {
-                    'prediction': uncertainty['prediction'],
-                    'confidence': round(uncertainty['confidence'], 2),
-                    'confidence_std': round(uncertainty['confidence_std'], 2),
-                    'uncertainty_score': round(uncertainty['uncertainty_score'], 3),
-                    'agreement_rate': round(uncertainty['agreement_rate'], 1),
-                    'recommendation': uncertainty['recommendation']
-                }
-                
-                print(f"✅ Ensemble prediction: {ensemble_result['prediction']} "
-                      f"({ensemble_result['confidence']:.1f}% ± {ensemble_result['confidence_std']:.1f}%)")
-            
-            except Exception as e:
-                print(f"⚠️ Ensemble prediction failed: {e}")
-        
-        # Generate Explainability (if available)
-        explainability_paths = {}
-        if explainer:
+@timed_stage('report')
+def generate_report(pdf_path, patient, prediction_result, llm_advice, image, viz_path):
+    """
+    Render the PDF analysis report for one prediction
+
+    Args:
+        image: IngestedImage (embedded from decoded pixels) or a file path
+    """
+    c = canvas.Canvas(pdf_path, pagesize=A4)
+    draw_report(c, patient, prediction_result, llm_advice, image, viz_path)
+    c.save()
+
+
+def draw_report(c, patient, prediction_result, llm_advice, image, viz_path):
+    """
+    Draw the report pages for one prediction onto an open canvas
+    """
+    width, height = A4
+
+    margin = 20 * mm
+    usable_width = width - 2 * margin
+    y = height - margin
+
+    # Header
+    c.setFont('Helvetica-Bold', 18)
+    c.drawString(margin, y, 'Skin Cancer Analysis Report')
+    c.setFont('Helvetica', 10)
+    c.setFillColor(colors.gray)
+    c.drawRightString(width - margin, y, f'Generated: {datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")}')
+    c.setFillColor(colors.black)
+    y -= 12 * mm
+
+    # Patient details box
+    c.setStrokeColor(colors.black)
+    c.setLineWidth(0.5)
+    c.rect(margin, y - 40 * mm, usable_width, 40 * mm, stroke=1, fill=0)
+    pd_x = margin + 6 * mm
+    pd_y = y - 8 * mm
+    c.setFont('Helvetica-Bold', 12)
+    c.drawString(pd_x, pd_y, 'Patient Information')
+    c.setFont('Helvetica', 10)
+    pd_y -= 6 * mm
+    c.drawString(pd_x, pd_y, f'Name: {patient["name"]}')
+    pd_y -= 5 * mm
+    c.drawString(pd_x, pd_y, f'Age: {patient["age"]}    Gender: {patient["gender"]}')
+    pd_y -= 5 * mm
+    c.drawString(pd_x, pd_y, f'Location: {patient["location"]}')
+    pd_y -= 5 * mm
+    postal = patient.get('postal_code', '')
+    if postal:
+        c.drawString(pd_x, pd_y, f'PIN/Postal Code: {postal}')
+
+    # Images: input image on left, visualization on right
+    img_y_top = y - 40 * mm - 6 * mm
+    img_height = 80 * mm
+    img_width = (usable_width - 6 * mm) / 2
+
+    try:
+        input_img = ImageReader(image.to_pil() if isinstance(image, IngestedImage) else image)
+        c.drawImage(input_img, margin, img_y_top - img_height, width=img_width, height=img_height, preserveAspectRatio=True, anchor='sw')
+    except Exception:
+        # draw placeholder box
+        c.setStrokeColor(colors.gray)
+        c.rect(margin, img_y_top - img_height, img_width, img_height, stroke=1, fill=0)
+        c.drawString(margin + 6 * mm, img_y_top - 6 * mm, 'Input image could not be embedded')
+
+    try:
+        viz_img = ImageReader(viz_path)
+        c.drawImage(viz_img, margin + img_width + 6 * mm, img_y_top - img_height, width=img_width, height=img_height, preserveAspectRatio=True, anchor='sw')
+    except Exception:
+        c.setStrokeColor(colors.gray)
+        c.rect(margin + img_width + 6 * mm, img_y_top - img_height, img_width, img_height, stroke=1, fill=0)
+        c.drawString(margin + img_width + 12 * mm, img_y_top - 6 * mm, 'Visualization could not be embedded')
+
+    # Move cursor below images
+    y = img_y_top - img_height - 8 * mm
+
+    # Diagnosis summary
+    c.setFont('Helvetica-Bold', 12)
+    c.drawString(margin, y, 'Diagnosis Summary')
+    y -= 6 * mm
+    c.setFont('Helvetica', 11)
+    cond = prediction_result.get('top_class', 'Unknown')
+    conf = prediction_result.get('confidence', 0)
+    severity = CONDITION_INFO.get(cond, {}).get('severity', 'Unknown')
+    description = CONDITION_INFO.get(cond, {}).get('description', '')
+    c.drawString(margin, y, f'Condition: {cond}    Confidence: {conf:.1f}%    Risk: {severity}')
+    y -= 6 * mm
+    # Brief description (wrap)
+    text = c.beginText(margin, y)
+    text.setFont('Helvetica', 10)
+    for line in description.split('\n'):
+        text.textLine(line)
+    c.drawText(text)
+    y -= 18 * mm
+
+    # LLM Advice with proper Markdown parsing
+    c.setFont('Helvetica-Bold', 12)
+    c.drawString(margin, y, 'Medical Insights (AI)')
+    y -= 6 * mm
+
+    # Parse and render Markdown content
+    advice = llm_advice or ''
+    parsed_advice = parse_markdown_for_pdf(advice)
+    y = draw_markdown_content(c, parsed_advice, y, margin, usable_width, height)
+
+    # Footer: date/time and doctor signature
+    footer_y = 25 * mm
+    c.setFont('Helvetica', 9)
+    c.drawString(margin, footer_y + 10 * mm, f'Report generated: {datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")}')
+
+    # Doctor signature block
+    sig_path = os.path.join(app.config['UPLOAD_FOLDER'], 'doctor_signature.png')
+    if os.path.exists(sig_path):
+        try:
+            sig = ImageReader(sig_path)
+            sig_w = 40 * mm
+            sig_h = 20 * mm
+            c.drawImage(sig, width - margin - sig_w, footer_y + 2 * mm, width=sig_w, height=sig_h, preserveAspectRatio=True)
+            c.setFont('Helvetica', 9)
+            c.drawString(width - margin - sig_w, footer_y, 'Doctor Signature')
+        except Exception:
+            c.setFont('Helvetica', 9)
+            c.drawString(width - margin - 60 * mm, footer_y, 'Doctor Signature: ____________________')
+    else:
+        c.setFont('Helvetica', 9)
+        c.drawString(width - margin - 60 * mm, footer_y, 'Doctor Signature: ____________________')
+
+    c.showPage()
+
+
+@timed_stage('pipeline')
+def run_analysis_pipeline(image, filename, patient, user_id, on_stage=None, on_token=None, record_sink=None,
+                          cancelled=None):
+    """
+    Run the full analysis pipeline on an already saved and validated upload.
+
+    Shared by the synchronous /analyze endpoint and the job worker, so it
+    must not touch the Flask request or current_user.
+
+    Args:
+        image: IngestedImage of the saved upload, decoded once and shared by all stages
+        filename: Name of the upload inside UPLOAD_FOLDER
+        patient: Patient fields from parse_patient_form()
+        user_id: Owner of the resulting Analysis record
+        on_stage: Optional callback(stage_name, partial_result) fired as stages finish
+        on_token: Optional callback(text) for streamed LLM tokens; called from a
+                  stage thread, so it must be thread-safe
+        record_sink: Optional list; when given, the Analysis record is appended
+                     to it unsaved instead of being committed (batch transactions)
+        cancelled: Optional threading.Event; once set, the pipeline stops before
+                   the next phase (stage fan-out, report and record) and
+                   returns ANALYSIS_CANCELLED_ERROR with status 499
+
+    With LLM_ADVICE_MODE=deferred (and no on_token/record_sink) the LLM stage
+    is skipped: the record is saved with llm_status 'pending' and an 'advice'
+    job is queued for worker.py, which fills in the advice and the report.
+
+    Returns:
+        (response payload, HTTP status)
+    """
+    def emit(stage, partial):
+        if on_stage and not (cancelled and cancelled.is_set()):
             try:
-                # Generate saliency map (always works)
-                saliency_path = os.path.join(app.config['UPLOAD_FOLDER'], f'saliency_{filename}')
-                explainer.generate_saliency_map(filepath, save_path=saliency_path)
-                explainability_paths['saliency'] = f'/static/uploads/saliency_{filename}'
-                
-                print("✅ Saliency map generated")
-            
+                on_stage(stage, convert_to_serializable(partial))
             except Exception as e:
-                print(f"⚠️ Explainability generation failed: {e}")
-        
-        # Get LLM advice
-        llm_advice = analyze_with_llm(
+                print(f"⚠️ Stage callback failed for {stage}: {e}")
+
+    filepath = image.path
+    name = patient['name']
+    age = patient['age']
+    gender = patient['gender']
+    location = patient['location']
+
+    # Process image
+    try:
+        prediction_result = process_image_prediction(image, user_id, capture=patient.get('source') == 'camera')
+    except InferenceOverloaded:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        return INFERENCE_BUSY_ERROR, 503
+    except (CircuitOpenError, TimeoutError) as e:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        return {**INFERENCE_UNAVAILABLE_ERROR, 'retry_after': int(getattr(e, 'retry_after', 5)) + 1}, 503
+
+    if not prediction_result:
+        # Clean up the uploaded file
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        return NO_LESION_ERROR, 400
+
+    # Check if confidence is too low (threshold: 60%)
+    if prediction_result['confidence'] < 60:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        return {
+            'error': 'Invalid or unclear image detected',
+            'message': f'The AI model has very low confidence ({prediction_result["confidence"]:.1f}%) in analyzing this image.\n\n⚠️ This usually means:\n• This is NOT a skin lesion image\n• The image shows something else entirely\n• The photo quality is extremely poor\n• The lesion is not visible or in focus\n\n✅ Please upload a clear, close-up photo of an actual skin lesion.\n\n📸 Tips for better results:\n• Use good lighting\n• Focus clearly on the lesion\n• Take photo from 6-12 inches away\n• Ensure the lesion fills most of the frame'
+        }, 400
+
+    # Additional validation: Check prediction distribution
+    # If all predictions are similar (low variance), likely not a skin lesion
+    all_preds = prediction_result.get('all_predictions', {})
+    if all_preds:
+        confidences = [pred.get('confidence', 0) for pred in all_preds.values()]
+        if len(confidences) > 1:
+            max_conf = max(confidences)
+            min_conf = min(confidences)
+            variance = max_conf - min_conf
+
+            # If variance is too low, predictions are scattered (not confident about anything)
+            if variance < 0.20 and max_conf < 0.65:  # Less than 20% difference and top is under 65%
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+                return NOT_SKIN_ERROR, 400
+
+    if cancelled and cancelled.is_set():
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        return ANALYSIS_CANCELLED_ERROR, 499
+
+    emit('prediction', {
+        'prediction': prediction_result['top_class'],
+        'confidence': round(prediction_result['confidence'], 2),
+        'all_predictions': prediction_result['all_predictions'],
+        'condition_info': CONDITION_INFO.get(prediction_result['top_class'], {})
+    })
+
+    # Visualization, ensemble, saliency and LLM advice only depend on the
+    # prediction, so run them concurrently; the PDF report waits for all of them
+    viz_path = os.path.join(app.config['UPLOAD_FOLDER'], f'viz_{filename}')
+
+    def visualization_stage():
+        create_visualization(image, prediction_result, viz_path)
+        return f'/static/uploads/viz_{filename}'
+
+    llm_usage = []
+
+    def llm_stage():
+        return analyze_with_llm(
             name=name,
             age=age,
             gender=gender,
             prediction=prediction_result['top_class'],
             confidence=prediction_result['confidence'],
             location=location,
-            latitude=latitude,
-            longitude=longitude
+            latitude=patient.get('latitude'),
+            longitude=patient.get('longitude'),
+            on_token=on_token,
+            usage_sink=llm_usage.append
         )
 
-        # Prepare response
-        response = {
-            'success': True,
-            'prediction': prediction_result['top_class'],
-            'confidence': round(prediction_result['confidence'], 2),
-            'all_predictions': convert_to_serializable(prediction_result['all_predictions']),
-            'condition_info': CONDITION_INFO.get(prediction_result['top_class'], {}),
-            'ensemble_result': convert_to_serializable(ensemble_result),
-            'explainability': explainability_paths,
-            'llm_advice': llm_advice,
-            'image_path': f'/static/uploads/{filename}',
-            'viz_path': f'/static/uploads/viz_{filename}',
-            'patient_info': {
-                'name': name,
-                'age': age,
-                'gender': gender,
-                'location': location
-            }
+    stage_payloads = {
+        'visualization': lambda result: {'viz_path': result},
+        'ensemble': lambda result: {'ensemble_result': result},
+        'explainability': lambda result: {'explainability': result},
+        'llm_advice': lambda result: {'llm_advice': result[0], 'llm_status': result[1]}
+    }
+
+    stages = {
+        'visualization': visualization_stage,
+        'ensemble': lambda: run_ensemble_prediction(prediction_result, age, gender, location, image),
+        'explainability': lambda: generate_explainability(image, filename)
+    }
+    defer_advice = LLM_ADVICE_MODE == 'deferred' and on_token is None and record_sink is None
+    if not defer_advice:
+        stages['llm_advice'] = llm_stage
+
+    stage_results = pipeline_executor.run(
+        stages,
+        on_complete=lambda stage, result: emit(stage, stage_payloads[stage](result)),
+        defaults={'explainability': {}, 'llm_advice': (None, 'fallback')}
+    )
+    ensemble_result = stage_results['ensemble']
+    explainability_paths = stage_results['explainability']
+    llm_advice, llm_status = stage_results.get('llm_advice', (None, 'pending'))
+
+    if cancelled and cancelled.is_set():
+        for path in (filepath, viz_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return ANALYSIS_CANCELLED_ERROR, 499
+
+    # Prepare response
+    response = {
+        'success': True,
+        'prediction': prediction_result['top_class'],
+        'confidence': round(prediction_result['confidence'], 2),
+        'all_predictions': convert_to_serializable(prediction_result['all_predictions']),
+        'condition_info': CONDITION_INFO.get(prediction_result['top_class'], {}),
+        'ensemble_result': convert_to_serializable(ensemble_result),
+        'explainability': explainability_paths,
+        'llm_advice': llm_advice,
+        'llm_status': llm_status,
+        'image_path': f'/static/uploads/{filename}',
+        'viz_path': f'/static/uploads/viz_{filename}',
+        'patient_info': {
+            'name': name,
+            'age': age,
+            'gender': gender,
+            'location': location
         }
+    }
 
-        # Generate a professional PDF report and save it to uploads
-        try:
-            report_filename = f'report_{os.path.splitext(filename)[0]}.pdf'
-            report_filepath = os.path.join(app.config['UPLOAD_FOLDER'], report_filename)
-
-            def generate_report(pdf_path):
-                c = canvas.Canvas(pdf_path, pagesize=A4)
-                width, height = A4
-
-                margin = 20 * mm
-                usable_width = width - 2 * margin
-                y = height - margin
-
-                # Header
-                c.setFont('Helvetica-Bold', 18)
-                c.drawString(margin, y, 'Skin Cancer Analysis Report')
-                c.setFont('Helvetica', 10)
-                c.setFillColor(colors.gray)
-                c.drawRightString(width - margin, y, f'Generated: {datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")}')
-                c.setFillColor(colors.black)
-                y -= 12 * mm
-
-                # Patient details box
-                c.setStrokeColor(colors.black)
-                c.setLineWidth(0.5)
-                c.rect(margin, y - 40 * mm, usable_width, 40 * mm, stroke=1, fill=0)
-                pd_x = margin + 6 * mm
-                pd_y = y - 8 * mm
-                c.setFont('Helvetica-Bold', 12)
-                c.drawString(pd_x, pd_y, 'Patient Information')
-                c.setFont('Helvetica', 10)
-                pd_y -= 6 * mm
-                c.drawString(pd_x, pd_y, f'Name: {name}')
-                pd_y -= 5 * mm
-                c.drawString(pd_x, pd_y, f'Age: {age}    Gender: {gender}')
-                pd_y -= 5 * mm
-                c.drawString(pd_x, pd_y, f'Location: {location}')
-                pd_y -= 5 * mm
-                postal = request.form.get('postal_code') or request.form.get('pin') or ''
-                if postal:
-                    c.drawString(pd_x, pd_y, f'PIN/Postal Code: {postal}')
-
-                # Images: input image on left, visualization on right
-                img_y_top = y - 40 * mm - 6 * mm
-                img_height = 80 * mm
-                img_width = (usable_width - 6 * mm) / 2
+    # Generate a professional PDF report and save it to uploads
+    try:
+        report_filename = f'report_{os.path.splitext(filename)[0]}.pdf'
+        report_filepath = os.path.join(app.config['UPLOAD_FOLDER'], report_filename)
+        generate_report(report_filepath, patient, prediction_result, llm_advice or ADVICE_PENDING_TEXT, image, viz_path)
+        response['report_path'] = f'/static/uploads/{report_filename}'
+    except Exception as e:
+        print(f"⚠️ PDF report generation failed: {e}")
+        response['report_path'] = None
+    emit('report', {'report_path': response['report_path']})
 
-                try:
-                    input_img = ImageReader(filepath)
-                    c.drawImage(input_img, margin, img_y_top - img_height, width=img_width, height=img_height, preserveAspectRatio=True, anchor='sw')
-                except Exception:
-                    # draw placeholder box
-                    c.setStrokeColor(colors.gray)
-                    c.rect(margin, img_y_top - img_height, img_width, img_height, stroke=1, fill=0)
-                    c.drawString(margin + 6 * mm, img_y_top - 6 * mm, 'Input image could not be embedded')
+    # Save analysis to database
+    try:
+        analysis_record = Analysis(
+            user_id=user_id,
+            patient_name=name,
+            age=int(age),
+            gender=gender,
+            location=location,
+            diagnosis=prediction_result['top_class'],
+            confidence=prediction_result['confidence'],
+            image_path=f'/static/uploads/{filename}',
+            viz_path=f'/static/uploads/viz_{filename}',
+            report_path=response.get('report_path'),
+            all_predictions=json.dumps(prediction_result['all_predictions']),
+            llm_advice=llm_advice,
+            llm_status=llm_status,
+            llm_usage=[LLMUsage.from_usage(usage) for usage in llm_usage]
+        )
+        if record_sink is not None:
+            record_sink.append(analysis_record)
+            return response, 200
 
-                try:
-                    viz_img = ImageReader(viz_path)
-                    c.drawImage(viz_img, margin + img_width + 6 * mm, img_y_top - img_height, width=img_width, height=img_height, preserveAspectRatio=True, anchor='sw')
-                except Exception:
-                    c.setStrokeColor(colors.gray)
-                    c.rect(margin + img_width + 6 * mm, img_y_top - img_height, img_width, img_height, stroke=1, fill=0)
-                    c.drawString(margin + img_width + 12 * mm, img_y_top - 6 * mm, 'Visualization could not be embedded')
-
-                # Move cursor below images
-                y = img_y_top - img_height - 8 * mm
-
-                # Diagnosis summary
-                c.setFont('Helvetica-Bold', 12)
-                c.drawString(margin, y, 'Diagnosis Summary')
-                y -= 6 * mm
-                c.setFont('Helvetica', 11)
-                cond = prediction_result.get('top_class', 'Unknown')
-                conf = prediction_result.get('confidence', 0)
-                severity = CONDITION_INFO.get(cond, {}).get('severity', 'Unknown')
-                description = CONDITION_INFO.get(cond, {}).get('description', '')
-                c.drawString(margin, y, f'Condition: {cond}    Confidence: {conf:.1f}%    Risk: {severity}')
-                y -= 6 * mm
-                # Brief description (wrap)
-                text = c.beginText(margin, y)
-                text.setFont('Helvetica', 10)
-                wrap = 95
-                for line in description.split('\n'):
-                    text.textLine(line)
-                c.drawText(text)
-                y -= 18 * mm
-
-                # LLM Advice with proper Markdown parsing
-                c.setFont('Helvetica-Bold', 12)
-                c.drawString(margin, y, 'Medical Insights (AI)')
-                y -= 6 * mm
-                
-                # Parse and render Markdown content
-                advice = llm_advice or ''
-                parsed_advice = parse_markdown_for_pdf(advice)
-                y = draw_markdown_content(c, parsed_advice, y, margin, usable_width, height)
-
-                # Footer: date/time and doctor signature
-                footer_y = 25 * mm
-                c.setFont('Helvetica', 9)
-                c.drawString(margin, footer_y + 10 * mm, f'Report generated: {datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")}')
-
-                # Doctor signature block
-                sig_path = os.path.join(app.config['UPLOAD_FOLDER'], 'doctor_signature.png')
-                if os.path.exists(sig_path):
-                    try:
-                        sig = ImageReader(sig_path)
-                        sig_w = 40 * mm
-                        sig_h = 20 * mm
-                        c.drawImage(sig, width - margin - sig_w, footer_y + 2 * mm, width=sig_w, height=sig_h, preserveAspectRatio=True)
-                        c.setFont('Helvetica', 9)
-                        c.drawString(width - margin - sig_w, footer_y, 'Doctor Signature')
-                    except Exception:
-                        c.setFont('Helvetica', 9)
-                        c.drawString(width - margin - 60 * mm, footer_y, 'Doctor Signature: ____________________')
-                else:
-                    c.setFont('Helvetica', 9)
-                    c.drawString(width - margin - 60 * mm, footer_y, 'Doctor Signature: ____________________')
+        with stage_timer('db_commit'):
+            db.session.add(analysis_record)
+            if defer_advice:
+                # Queue the advice in the same transaction so a saved record always gets it
+                db.session.flush()
+                db.session.add(AnalysisJob(
+                    id=uuid.uuid4().hex,
+                    user_id=user_id,
+                    kind='advice',
+                    status='queued',
+                    payload=json.dumps({'analysis_id': analysis_record.id, 'patient': patient})
+                ))
+            db.session.commit()
+        response['analysis_id'] = analysis_record.id
+        print(f"✅ Analysis record saved (ID: {analysis_record.id})")
+    except Exception as e:
+        print(f"⚠️ Failed to save analysis record: {e}")
+        db.session.rollback()
+        if defer_advice:
+            response['llm_status'] = 'unavailable'
 
-                c.showPage()
-                c.save()
+    return response, 200
 
-            generate_report(report_filepath)
-            response['report_path'] = f'/static/uploads/{report_filename}'
-        except Exception as e:
-            print(f"⚠️ PDF report generation failed: {e}")
-            response['report_path'] = None
 
-        # Save analysis to database
+def backfill_llm_advice(analysis_id, patient):
+    """
+    Generate the deferred LLM advice for a saved analysis and regenerate its report
+
+    Run by worker.py for 'advice' jobs.
+
+    Args:
+        analysis_id: Analysis row saved with llm_status 'pending'
+        patient: Patient fields from parse_patient_form() (for the prompt and report)
+
+    Returns: (response_body_dict, http_status)
+    """
+    analysis = db.session.get(Analysis, analysis_id)
+    if analysis is None:
+        return {'error': 'Analysis not found', 'analysis_id': analysis_id}, 404
+
+    llm_usage = []
+    llm_advice, llm_status = analyze_with_llm(
+        name=analysis.patient_name,
+        age=analysis.age,
+        gender=analysis.gender,
+        prediction=analysis.diagnosis,
+        confidence=analysis.confidence,
+        location=analysis.location or 'Unknown',
+        latitude=patient.get('latitude'),
+        longitude=patient.get('longitude'),
+        usage_sink=llm_usage.append
+    )
+
+    if analysis.report_path:
+        upload_folder = app.config['UPLOAD_FOLDER']
+        prediction_result = {
+            'top_class': analysis.diagnosis,
+            'confidence': analysis.confidence,
+            'all_predictions': json.loads(analysis.all_predictions) if analysis.all_predictions else {}
+        }
         try:
-            analysis_record = Analysis(
-                user_id=current_user.id,
-                patient_name=name,
-                age=int(age),
-                gender=gender,
-                location=location,
-                diagnosis=prediction_result['top_class'],
-                confidence=prediction_result['confidence'],
-                image_path=f'/static/uploads/{filename}',
-                viz_path=f'/static/uploads/viz_{filename}',
-                report_path=response.get('report_path'),
-                all_predictions=json.dumps(prediction_result['all_predictions']),
-                llm_advice=llm_advice
+            generate_report(
+                os.path.join(upload_folder, os.path.basename(analysis.report_path)),
+                patient,
+                prediction_result,
+                llm_advice,
+                os.path.join(upload_folder, os.path.basename(analysis.image_path)),
+                os.path.join(upload_folder, os.path.basename(analysis.viz_path))
             )
-            db.session.add(analysis_record)
-            db.session.commit()
-            print(f"✅ Analysis record saved (ID: {analysis_record.id})")
         except Exception as e:
-            print(f"⚠️ Failed to save analysis record: {e}")
-            db.session.rollback()
+            print(f"⚠️ PDF report regeneration failed for analysis {analysis_id}: {e}")
+
+    analysis.llm_advice = llm_advice
+    analysis.llm_status = llm_status
+    analysis.llm_usage.extend(LLMUsage.from_usage(usage) for usage in llm_usage)
+    db.session.commit()
+    print(f"✅ LLM advice backfilled (analysis {analysis_id})")
+    return {'analysis_id': analysis_id, 'llm_status': llm_status, 'report_path': analysis.report_path}, 200
+
+
+def file_stamp(path):
+    """(size, mtime) of a file, or None if it is missing"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def cached_artifacts_valid(response, stamp):
+    """
+    Check that the files a cached response points to are still on disk and
+    that the stored input image was not overwritten by a later upload
+    """
+    for key in ('image_path', 'viz_path', 'report_path'):
+        public_path = response.get(key)
+        if public_path and not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(public_path))):
+            return False
 
-        return jsonify(response)
+    image_file = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(response.get('image_path', '')))
+    return stamp is not None and file_stamp(image_file) == stamp
+
+
+def prescreen_upload(image):
+    """
+    Run the local pre-screen on an ingested upload
+
+    Returns None when the image may go to the classifier, otherwise discards
+    the spooled file and returns (error payload, status).
+    """
+    if not PRESCREEN_ENABLED:
+        return None
+
+    result = prescreen_image(image.rgb)
+    if result['passed']:
+        return None
+
+    print(f"⚠️ Pre-screen rejected upload ({result['reason']}): {result['stats']}")
+    image.discard()
+    return PRESCREEN_ERRORS[result['reason']], 400
+
+
+def prepare_analysis_upload():
+    """
+    Parse the patient fields and ingest the uploaded image of the current request
+
+    Returns:
+        (patient, filename, image, cache_key, None) ready for run_analysis_pipeline(), or
+        (None, None, None, None, (payload, status)) when the request was rejected or
+        answered from the result cache
+    """
+    patient, error = parse_patient_form(request.form)
+    if error:
+        return None, None, None, None, error
+
+    # Handle image upload
+    file = request.files.get('image')
+    filename, error = validate_upload_filename(file)
+    if error:
+        return None, None, None, None, error
+
+    # Check the header from the stream, then spool and decode once
+    with stage_timer('ingest'):
+        image, error = ingest_stream(file.stream, app.config['UPLOAD_FOLDER'])
+    if error:
+        return None, None, None, None, error
+
+    # Serve re-submissions of the same photo from the result cache
+    cache_key = AnalysisCache.make_key(image.sha256, current_user.id, patient)
+    cached = analysis_cache.get(cache_key)
+    if cached is not None:
+        cached, stamp = cached
+        if cached_artifacts_valid(cached, stamp):
+            image.discard()
+            return None, None, None, None, ({**cached, 'cached': True}, 200)
+        analysis_cache.invalidate(cache_key)
+
+    # Reject obvious non-lesion images locally before paying for the remote model
+    error = prescreen_upload(image)
+    if error:
+        return None, None, None, None, error
+
+    # Move the spooled upload into place
+    image.commit(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    return patient, filename, image, cache_key, None
+
+
+@app.route('/analyze', methods=['POST'])
+@login_required
+@admission_controlled(analyze_admission)
+def analyze():
+    """Analyze uploaded image"""
+    try:
+        patient, filename, image, cache_key, early = prepare_analysis_upload()
+        if early:
+            return jsonify(early[0]), early[1]
+
+        body, status = run_analysis_pipeline(image, filename, patient, current_user.id)
+        if status == 200 and body.get('llm_status') == 'ready':
+            analysis_cache.put(cache_key, body, file_stamp(image.path))
+        return jsonify(body), status
 
     except Exception as e:
         print(f"Error in analyze: {e}")
         return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
 
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(convert_to_serializable(data))}\n\n"
+
+
+@app.route('/analyze/stream', methods=['POST'])
+@login_required
+def analyze_stream():
+    """
+    Analyze uploaded image, streaming results as Server-Sent Events
+
+    Events arrive as stages finish: prediction, then visualization / ensemble /
+    explainability, llm_token deltas, llm_advice, report, and finally complete
+    (the same payload /analyze returns) or error.
+    """
+    # The admission slot is held until the background pipeline finishes,
+    # not just until this view returns the streaming response
+    try:
+        granted_at = analyze_admission.acquire()
+    except AdmissionRejected as rejection:
+        return admission_rejected_response(rejection)
+
+    try:
+        patient, filename, image, cache_key, early = prepare_analysis_upload()
+    except Exception as e:
+        analyze_admission.release(granted_at)
+        print(f"Error in analyze stream: {e}")
+        return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
+
+    if early and early[1] != 200:
+        analyze_admission.release(granted_at)
+        return jsonify(early[0]), early[1]
+
+    events = queue.Queue()
+    done = object()
+    # Set when the client disconnects, so the pipeline thread stops early
+    cancelled = threading.Event()
+
+    if early:
+        # Cache hit - nothing to compute
+        analyze_admission.release(granted_at)
+        events.put(('complete', early[0]))
+        events.put(done)
+    else:
+        user_id = current_user.id
+
+        def relay_token(token):
+            if not cancelled.is_set():
+                events.put(('llm_token', {'token': token}))
+
+        def run():
+            with app.app_context():
+                try:
+                    body, status = run_analysis_pipeline(
+                        image, filename, patient, user_id,
+                        on_stage=lambda stage, data: events.put((stage, data)),
+                        on_token=relay_token,
+                        cancelled=cancelled
+                    )
+                    if status == 200:
+                        if body.get('llm_status') == 'ready':
+                            analysis_cache.put(cache_key, body, file_stamp(image.path))
+                        events.put(('complete', body))
+                    else:
+                        events.put(('error', {**body, 'status': status}))
+                except Exception as e:
+                    print(f"Error in analyze stream: {e}")
+                    events.put(('error', {'error': f'Analysis failed: {str(e)}', 'status': 500}))
+                finally:
+                    analyze_admission.release(granted_at)
+                    events.put(done)
+
+        threading.Thread(target=run, name='analyze-stream', daemon=True).start()
+
+    # teardown_request runs as soon as the view returns, before any event is
+    # sent; the stream records its own duration and in-flight count when it ends
+    metrics_endpoint = g.pop('metrics_endpoint', None)
+    metrics_started = g.pop('metrics_started', None)
+
+    def generate():
+        try:
+            while True:
+                item = events.get()
+                if item is done:
+                    break
+                yield sse_event(*item)
+        except GeneratorExit:
+            cancelled.set()
+            raise
+        finally:
+            if metrics_endpoint is not None:
+                record_request_metrics(metrics_endpoint, metrics_started)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def summarize_llm_usage(rows):
+    """Token, latency and cost aggregates over LLMUsage rows"""
+    live = [r for r in rows if r.source == 'live']
+    prompt_tokens = [r.prompt_tokens or 0 for r in live]
+    completion_tokens = [r.completion_tokens or 0 for r in live]
+    latencies = [r.latency_seconds for r in live if r.latency_seconds is not None]
+    first_tokens = [r.first_token_seconds for r in live if r.first_token_seconds is not None]
+    cost = (sum(prompt_tokens) * LLM_PROMPT_COST_PER_MTOK + sum(completion_tokens) * LLM_COMPLETION_COST_PER_MTOK) / 1e6
+
+    return {
+        'calls': len(rows),
+        'live_calls': len(live),
+        'prompt_tokens': sum(prompt_tokens),
+        'completion_tokens': sum(completion_tokens),
+        'avg_prompt_tokens': round(sum(prompt_tokens) / len(live), 1) if live else 0,
+        'avg_completion_tokens': round(sum(completion_tokens) / len(live), 1) if live else 0,
+        'p95_completion_tokens': percentile(completion_tokens, 95),
+        'max_completion_tokens': max(completion_tokens, default=None),
+        'truncated': sum(1 for r in live if r.finish_reason == 'length'),
+        'timeouts': sum(1 for r in live if r.outcome == 'timeout'),
+        'p50_latency_seconds': percentile(latencies, 50),
+        'p95_latency_seconds': percentile(latencies, 95),
+        'p50_first_token_seconds': percentile(first_tokens, 50),
+        'estimated_cost_usd': round(cost, 6)
+    }
+
+
+@app.route('/api/llm/usage', methods=['GET'])
+@login_required
+def get_llm_usage():
+    """
+    Aggregate LLM usage for the current user's analyses
+
+    Query params: days (default 30, 0 for all time), slowest (default 10).
+    Token and latency figures only count 'live' calls; cached and coalesced
+    advice cost nothing upstream.
+    """
+    try:
+        days = request.args.get('days', default=30, type=int)
+        slowest = request.args.get('slowest', default=10, type=int)
+
+        query = LLMUsage.query.join(Analysis).filter(Analysis.user_id == current_user.id)
+        if days > 0:
+            query = query.filter(LLMUsage.created_at >= datetime.utcnow() - timedelta(days=days))
+        rows = query.all()
+
+        def grouped(key):
+            groups = {}
+            for row in rows:
+                groups.setdefault(key(row) or 'unknown', []).append(row)
+            return {name: summarize_llm_usage(group) for name, group in groups.items()}
+
+        live = sorted((r for r in rows if r.source == 'live' and r.latency_seconds is not None),
+                      key=lambda r: r.latency_seconds, reverse=True)
+
+        return jsonify({
+            'success': True,
+            'days': days,
+            'max_tokens': llm_client.max_tokens,
+            'usage': summarize_llm_usage(rows),
+            'by_source': grouped(lambda r: r.source),
+            'by_model': grouped(lambda r: r.model),
+            'by_prompt_kind': grouped(lambda r: r.prompt_kind),
+            'by_diagnosis': grouped(lambda r: r.analysis.diagnosis),
+            'slowest': [
+                {**r.to_dict(), 'diagnosis': r.analysis.diagnosis} for r in live[:max(0, slowest)]
+            ]
+        })
+
+    except Exception as e:
+        print(f"Error aggregating LLM usage: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/analyze/cache/stats', methods=['GET'])
+@login_required
+def get_analysis_cache_stats():
+    """Get hit/miss counters of the analysis result and prediction caches"""
+    return jsonify({
+        'success': True,
+        'cache': analysis_cache.stats(),
+        'prediction_cache': prediction_cache.stats() if prediction_cache is not None else None,
+        'advice_cache': advice_cache.stats() if advice_cache is not None else None,
+        'llm_singleflight': llm_flight.stats()
+    })
+
+
+# Bounds how many images of one batch run through the pipeline at once; kept
+# separate from pipeline_executor because each image also submits stages there
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('BATCH_MAX_CONCURRENCY', '4')),
+    thread_name_prefix='batch'
+)
+MAX_BATCH_IMAGES = int(os.getenv('MAX_BATCH_IMAGES', '30'))
+# Whole-request limit for /api/analyze/batch (ingest still caps each image at
+# MAX_UPLOAD_BYTES); never more than MAX_BATCH_IMAGES full-size images
+BATCH_MAX_CONTENT_LENGTH = min(
+    int(os.getenv('BATCH_MAX_CONTENT_LENGTH', str(64 * 1024 * 1024))),
+    MAX_BATCH_IMAGES * MAX_UPLOAD_BYTES + 1024 * 1024
+)
+
+
+@app.route('/api/analyze/batch', methods=['POST'])
+@login_required
+def analyze_batch():
+    """
+    Analyze several images that share one set of patient fields
+
+    Form fields are the same as /analyze, with any number of 'images' files.
+    Set combined_report=true to also get one PDF covering every image.
+    Each image takes its own analyze admission slot while its pipeline runs,
+    so batches count against ANALYZE_MAX_CONCURRENT like single analyses; an
+    image that gets no slot is reported with status 429.
+    """
+    try:
+        patient, error = parse_patient_form(request.form)
+        if error:
+            return jsonify(error[0]), error[1]
+
+        files = request.files.getlist('images')
+        if not files:
+            return jsonify({'error': 'No image files provided'}), 400
+        if len(files) > MAX_BATCH_IMAGES:
+            return jsonify({'error': f'At most {MAX_BATCH_IMAGES} images can be analyzed per batch'}), 400
+
+        batch_id = uuid.uuid4().hex[:12]
+        results = [None] * len(files)
+        accepted = []  # (index, filename, filepath)
+
+        # Write every upload to disk on the request thread (the streams belong
+        # to it) but decode lazily in analyze_one, so at most
+        # BATCH_MAX_CONCURRENCY images are held as pixels at once
+        for index, file in enumerate(files):
+            filename, error = validate_upload_filename(file)
+            if not error:
+                filename = f'{batch_id}_{index}_{filename}'
+                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                with stage_timer('ingest'):
+                    error = spool_stream(file.stream, filepath)
+            if error:
+                results[index] = {'filename': file.filename, 'status': error[1], **error[0]}
+                continue
+            accepted.append((index, filename, filepath))
+
+        # Run the pipelines concurrently; Analysis rows are collected, not committed
+        records = {}
+        current_user_id = current_user.id
+
+        def analyze_one(index, filename, filepath):
+            try:
+                granted_at = analyze_admission.acquire()
+            except AdmissionRejected as rejection:
+                os.remove(filepath)
+                return admission_rejected_payload(rejection), 429
+
+            try:
+                with stage_timer('ingest'):
+                    image, error = ingest_file(filepath)
+                if error:
+                    if os.path.exists(filepath):
+                        os.remove(filepath)
+                    return error
+                error = prescreen_upload(image)
+                if error:
+                    return error
+
+                sink = []
+                body, status = run_analysis_pipeline(image, filename, patient, current_user_id, record_sink=sink)
+                if sink:
+                    records[index] = sink[0]
+                return body, status
+            finally:
+                analyze_admission.release(granted_at)
+
+        futures = {
+            batch_executor.submit(analyze_one, index, filename, filepath): (index, filename, filepath)
+            for index, filename, filepath in accepted
+        }
+        for future in as_completed(futures):
+            index, filename, filepath = futures[future]
+            try:
+                body, status = future.result()
+            except Exception as e:
+                print(f"⚠️ Batch item {filename} failed: {e}")
+                body, status = {'error': f'Analysis failed: {str(e)}'}, 500
+            results[index] = {'filename': files[index].filename, 'status': status, **body}
+
+        # Save every Analysis row in one transaction
+        if records:
+            try:
+                with stage_timer('db_commit'):
+                    db.session.add_all(records.values())
+                    db.session.commit()
+                for index, record in records.items():
+                    results[index]['analysis_id'] = record.id
+                print(f"✅ Batch {batch_id}: saved {len(records)} analysis records")
+            except Exception as e:
+                print(f"⚠️ Failed to save batch analysis records: {e}")
+                db.session.rollback()
+
+        succeeded = [(index, filename, filepath) for index, filename, filepath in accepted
+                     if results[index].get('status') == 200]
+
+        response = {
+            'success': bool(succeeded),
+            'batch_id': batch_id,
+            'count': len(files),
+            'succeeded': len(succeeded),
+            'failed': len(files) - len(succeeded),
+            'patient_info': {
+                'name': patient['name'],
+                'age': patient['age'],
+                'gender': patient['gender'],
+                'location': patient['location']
+            },
+            'results': results
+        }
+
+        if succeeded and request.form.get('combined_report', '').lower() in ('1', 'true', 'yes'):
+            try:
+                report_filename = f'report_batch_{batch_id}.pdf'
+                with stage_timer('report'):
+                    c = canvas.Canvas(os.path.join(app.config['UPLOAD_FOLDER'], report_filename), pagesize=A4)
+                    for index, filename, filepath in succeeded:
+                        item = results[index]
+                        draw_report(
+                            c, patient,
+                            {'top_class': item['prediction'], 'confidence': item['confidence']},
+                            item.get('llm_advice'), filepath,
+                            os.path.join(app.config['UPLOAD_FOLDER'], f'viz_{filename}')
+                        )
+                    c.save()
+                response['combined_report_path'] = f'/static/uploads/{report_filename}'
+            except Exception as e:
+                print(f"⚠️ Combined PDF report generation failed: {e}")
+                response['combined_report_path'] = None
+
+        return jsonify(response), 200 if succeeded else 400
+
+    except Exception as e:
+        print(f"Error in batch analyze: {e}")
+        db.session.rollback()
+        return jsonify({'error': f'Batch analysis failed: {str(e)}'}), 500
+
+
+# ===== Asynchronous Analysis Job Endpoints =====
+
+@app.route('/api/analyze/jobs', methods=['POST'])
+@login_required
+def submit_analysis_job():
+    """Queue an analysis for worker.py and return its job id immediately"""
+    try:
+        patient, error = parse_patient_form(request.form)
+        if error:
+            return jsonify(error[0]), error[1]
+
+        file = request.files.get('image')
+        filename, error = validate_upload_filename(file)
+        if error:
+            return jsonify(error[0]), error[1]
+
+        # Prefix with the job id so queued uploads with the same name don't overwrite each other
+        job_id = uuid.uuid4().hex
+        filename = f'{job_id[:12]}_{filename}'
+        image, error = ingest_stream(file.stream, app.config['UPLOAD_FOLDER'])
+        if error:
+            return jsonify(error[0]), error[1]
+
+        error = prescreen_upload(image)
+        if error:
+            return jsonify(error[0]), error[1]
+
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        image.commit(filepath)
+
+        job = AnalysisJob(
+            id=job_id,
+            user_id=current_user.id,
+            kind='analyze',
+            status='queued',
+            payload=json.dumps({
+                'filepath': filepath,
+                'filename': filename,
+                'patient': patient
+            })
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('get_analysis_job', job_id=job.id)
+        }), 202
+
+    except Exception as e:
+        print(f"Error queueing analysis job: {e}")
+        db.session.rollback()
+        return jsonify({'error': f'Could not queue analysis: {str(e)}'}), 500
+
+
+@app.route('/api/analyze/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_analysis_job(job_id):
+    """Get status and partial or final results of a queued analysis"""
+    try:
+        job = AnalysisJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+
+        return jsonify({
+            'success': True,
+            'job': job.to_dict()
+        })
+
+    except Exception as e:
+        print(f"Error fetching analysis job: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/capture', methods=['POST'])
 @login_required
+@admission_controlled(capture_admission)
 def capture():
     """Handle camera capture"""
     try:
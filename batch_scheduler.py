@@ -0,0 +1,200 @@
+"""
+Micro-Batching Inference Scheduler
+Coalesces concurrent classification requests into batched backend calls and
+fans the results back out to the waiting callers
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional
+
+from metrics import REGISTRY
+
+
+BATCH_SIZE = REGISTRY.histogram(
+    'skincare_inference_batch_size', 'Images per batched classifier call',
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    'skincare_inference_queue_wait_seconds', 'Time a request waited before its batch was dispatched',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+QUEUE_REJECTED = REGISTRY.counter(
+    'skincare_inference_queue_rejected_total', 'Requests rejected because the inference queue was full'
+)
+
+
+class InferenceOverloaded(RuntimeError):
+    """Raised when the scheduler queue is full"""
+
+
+class _Request:
+    __slots__ = ('image', 'future', 'enqueued_at')
+
+    def __init__(self, image):
+        self.image = image
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+_STOP = object()
+
+
+class MicroBatchScheduler:
+    """
+    Collects requests for up to `max_wait_ms` or `max_batch_size` images,
+    then sends them to backend.predict_batch() in one call
+
+    A lone request waits at most `max_wait_ms`; under load batches fill up
+    before the deadline, so one forward pass (or one round of pooled HTTP
+    calls) serves many callers.
+
+    Args:
+        backend: InferenceBackend instance
+        max_batch_size: Largest batch sent to the backend
+        max_wait_ms: How long the first request of a batch waits for company
+        max_queue_depth: Pending requests allowed before submit() rejects
+        workers: Dispatcher threads; more than one lets batches overlap
+        request_timeout: Default seconds predict() waits for a result
+
+    Dispatcher threads start on the first submit() and are started again in
+    a forked child (threads do not survive fork), so the scheduler can be
+    created at import time by a process that later forks workers.
+    """
+
+    def __init__(self, backend, max_batch_size: int = 8, max_wait_ms: float = 10,
+                 max_queue_depth: int = 64, workers: int = 1, request_timeout: float = 60.0):
+        self.backend = backend
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_depth = max_queue_depth
+        self.workers = max(1, workers)
+        self.request_timeout = request_timeout
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._threads = []
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # A fresh queue too: an inherited one may hold locks taken by threads that no longer exist
+            self._queue = queue.Queue(maxsize=self.max_queue_depth)
+            self._threads = [
+                threading.Thread(target=self._dispatch_loop, args=(self._queue,),
+                                 name=f'inference-batcher-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, image) -> Future:
+        """Queue an image; the returned Future resolves to the backend's prediction"""
+        self._ensure_started()
+        request = _Request(image)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            QUEUE_REJECTED.inc()
+            raise InferenceOverloaded(f"Inference queue full ({self.max_queue_depth} pending)")
+        return request.future
+
+    def predict(self, image, timeout: float = None) -> Optional[Dict]:
+        """
+        Blocking form of submit()
+
+        Raises:
+            TimeoutError when no result arrives within timeout (default request_timeout)
+        """
+        future = self.submit(image)
+        timeout = self.request_timeout if timeout is None else timeout
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise TimeoutError(f"No inference result within {timeout:g}s")
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _collect(self, requests: queue.Queue) -> Optional[List[_Request]]:
+        """Block for one request, then gather more until the batch is full or its deadline passes"""
+        first = requests.get()
+        if first is _STOP:
+            return None
+
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Past the deadline, still take whatever is already queued (backlog under load)
+                if remaining <= 0:
+                    request = requests.get_nowait()
+                else:
+                    request = requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is _STOP:
+                # Let this batch finish, then stop on the next pass
+                requests.put(_STOP)
+                break
+            batch.append(request)
+        return batch
+
+    def _dispatch_loop(self, requests: queue.Queue):
+        while True:
+            batch = self._collect(requests)
+            if batch is None:
+                return
+            # Drop requests whose caller gave up (predict() timed out)
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if batch:
+                self._run_batch(batch)
+
+    def _run_batch(self, batch: List[_Request]):
+        dispatched_at = time.monotonic()
+        for request in batch:
+            QUEUE_WAIT.observe(dispatched_at - request.enqueued_at)
+        BATCH_SIZE.observe(len(batch))
+
+        try:
+            results = self.backend.predict_batch([request.image for request in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"Backend returned {len(results)} results for {len(batch)} images")
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        for request, result in zip(batch, results):
+            # Backends report per-image failures by returning the exception in place
+            if isinstance(result, Exception):
+                request.future.set_exception(result)
+            else:
+                request.future.set_result(result)
+
+    def stats(self) -> Dict:
+        return {
+            'queue_depth': self.queue_depth(),
+            'max_queue_depth': self.max_queue_depth,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'workers': self.workers,
+            'request_timeout': self.request_timeout
+        }
+
+    def shutdown(self):
+        if self._pid != os.getpid():
+            return
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
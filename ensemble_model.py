@@ -148,31 +148,37 @@ class SkinCancerEnsemble:
     
     def predict_with_uncertainty(self, features: np.ndarray, n_iterations: int = 10) -> Dict:
         """
-        Predict with uncertainty estimation using bootstrap aggregating
+        Predict with uncertainty estimation
+        
+        With a multi-row feature matrix (e.g. one row per group of test-time
+        augmentation views) all rows are scored in a single predict_proba call
+        and the spread across rows gives the uncertainty. A single row is
+        repeated n_iterations times, as before.
         
         Args:
-            features: Feature vector
-            n_iterations: Number of bootstrap iterations for uncertainty
+            features: Feature vector or (n_rows, n_features) matrix
+            n_iterations: Repetitions for a single-row input
         
         Returns:
             Dictionary with prediction, confidence, and uncertainty
         """
-        predictions = []
+        if not self.is_trained:
+            raise ValueError("Model not trained. Call train() first or load pre-trained model.")
         
-        for _ in range(n_iterations):
-            pred_class, confidence, _ = self.predict(features)
-            predictions.append((pred_class, confidence))
+        features = np.atleast_2d(features)
+        probabilities = self.xgb_model.predict_proba(features)
+        if len(probabilities) == 1:
+            probabilities = np.repeat(probabilities, n_iterations, axis=0)
         
         # Most common prediction
-        pred_classes = [p[0] for p in predictions]
-        confidences = [p[1] for p in predictions]
-        
-        from collections import Counter
-        most_common = Counter(pred_classes).most_common(1)[0]
-        final_prediction = most_common[0]
-        agreement_rate = most_common[1] / n_iterations
-        
-        # Uncertainty metrics
+        predicted_idx = np.argmax(probabilities, axis=1)
+        counts = np.bincount(predicted_idx, minlength=probabilities.shape[1])
+        final_idx = int(np.argmax(counts))
+        final_prediction = self.label_encoder.classes_[final_idx]
+        agreement_rate = counts[final_idx] / len(probabilities)
+        
+        # Uncertainty metrics (confidence in the final class across rows)
+        confidences = probabilities[:, final_idx] * 100
         confidence_mean = np.mean(confidences)
         confidence_std = np.std(confidences)
         
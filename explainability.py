@@ -7,12 +7,28 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib
 matplotlib.use('Agg')
+from matplotlib.figure import Figure
 from PIL import Image
 import cv2
 import os
 from typing import Tuple, Dict, Callable
 
 
+def load_rgb(image) -> np.ndarray:
+    """
+    Get RGB pixels for an image input
+
+    Accepts an already decoded image (anything with an `rgb` array, such as
+    image_ingest.IngestedImage), an RGB ndarray, or a file path. Only the
+    file path case decodes.
+    """
+    if hasattr(image, 'rgb'):
+        return image.rgb
+    if isinstance(image, np.ndarray):
+        return image
+    return np.array(Image.open(image).convert('RGB'))
+
+
 class SkinCancerExplainer:
     """
     Explainability tools for skin cancer detection models
@@ -25,7 +41,7 @@ class SkinCancerExplainer:
         self.shap_explainer = None
         
     def explain_with_lime(self, 
-                         image_path: str,
+                         image_path,
                          predict_fn: Callable,
                          top_labels: int = 3,
                          num_samples: int = 1000,
@@ -34,7 +50,7 @@ class SkinCancerExplainer:
         Generate LIME explanation for image classification
         
         Args:
-            image_path: Path to input image
+            image_path: Decoded image (see load_rgb) or path to input image
             predict_fn: Function that takes image and returns probabilities
             top_labels: Number of top classes to explain
             num_samples: Number of samples for LIME
@@ -48,8 +64,7 @@ class SkinCancerExplainer:
             from skimage.segmentation import mark_boundaries
             
             # Load and preprocess image
-            img = Image.open(image_path).convert('RGB')
-            img_array = np.array(img)
+            img_array = load_rgb(image_path)
             
             # Resize to model input size
             img_resized = cv2.resize(img_array, (224, 224))
@@ -234,7 +249,7 @@ class SkinCancerExplainer:
         print(f"✅ SHAP visualization saved to {save_path}")
     
     def generate_grad_cam(self,
-                         image_path: str,
+                         image_path,
                          model,
                          layer_name: str,
                          save_path: str = None) -> np.ndarray:
@@ -252,8 +267,7 @@ class SkinCancerExplainer:
         """
         try:
             # Load image
-            img = Image.open(image_path).convert('RGB')
-            img_array = np.array(img)
+            img_array = load_rgb(image_path)
             img_resized = cv2.resize(img_array, (224, 224))
             
             # Normalize
@@ -322,24 +336,27 @@ class SkinCancerExplainer:
         
         return results
     
-    def generate_saliency_map(self, image_path: str, save_path: str = None) -> np.ndarray:
+    def generate_saliency_map(self, image_path, save_path: str = None) -> np.ndarray:
         """
         Generate simple saliency map using edge detection
         (Fallback method when LIME/SHAP not available)
         
         Args:
-            image_path: Path to input image
+            image_path: Decoded image (see load_rgb) or path to input image
             save_path: Path to save visualization
         
         Returns:
             Saliency map
         """
-        # Load image
-        img = cv2.imread(image_path)
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        # Load image (no decode when the pipeline passes an ingested image)
+        if hasattr(image_path, 'rgb') or isinstance(image_path, np.ndarray):
+            img_rgb = load_rgb(image_path)
+        else:
+            img = cv2.imread(image_path)
+            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         
         # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY)
         
         # Apply Gaussian blur
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
@@ -353,8 +370,10 @@ class SkinCancerExplainer:
         magnitude = np.uint8(magnitude / magnitude.max() * 255)
         
         # Create visualization
+        # Object API rather than pyplot: this runs concurrently with other pipeline stages
         if save_path:
-            fig, axes = plt.subplots(1, 3, figsize=(15, 5))
+            fig = Figure(figsize=(15, 5))
+            axes = fig.subplots(1, 3)
             
             axes[0].imshow(img_rgb)
             axes[0].set_title('Original Image', fontsize=14, fontweight='bold')
@@ -369,12 +388,11 @@ class SkinCancerExplainer:
             axes[2].set_title('Overlay', fontsize=14, fontweight='bold')
             axes[2].axis('off')
             
-            plt.suptitle('Saliency Analysis', fontsize=16, fontweight='bold')
-            plt.tight_layout()
+            fig.suptitle('Saliency Analysis', fontsize=16, fontweight='bold')
+            fig.tight_layout()
             
             os.makedirs(os.path.dirname(save_path) if os.path.dirname(save_path) else '.', exist_ok=True)
-            plt.savefig(save_path, dpi=150, bbox_inches='tight')
-            plt.close()
+            fig.savefig(save_path, dpi=150, bbox_inches='tight')
             
             print(f"✅ Saliency map saved to {save_path}")
         
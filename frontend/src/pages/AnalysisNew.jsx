@@ -151,6 +151,7 @@ export default function AnalysisNew() {
       formData.append('age', age)
       formData.append('gender', gender)
       formData.append('location', patientInfo.location || '')
+      formData.append('source', selectedFile.name === 'captured.jpg' ? 'camera' : 'upload')
 
       const response = await fetch('http://localhost:5001/analyze', {
         method: 'POST',
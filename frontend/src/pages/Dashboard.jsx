@@ -101,7 +101,7 @@ export default function Dashboard() {
     }
   }
 
-  const performAnalysis = async (imageFile) => {
+  const performAnalysis = async (imageFile, source = 'upload') => {
     const { name, age, gender, location, postal_code } = patientInfo
 
     if (!name || !age || !gender) {
@@ -129,6 +129,7 @@ export default function Dashboard() {
       formData.append('age', age)
       formData.append('gender', gender)
       formData.append('location', location)
+      formData.append('source', source)
   // include postal/pin code if present
   formData.append('postal_code', postal_code || '')
 
@@ -178,7 +179,7 @@ export default function Dashboard() {
     const response = await fetch(currentImageData)
     const blob = await response.blob()
     const file = new File([blob], 'captured.jpg', { type: 'image/jpeg' })
-    performAnalysis(file)
+    performAnalysis(file, 'camera')
   }
 
   const formatMarkdown = (text) => {
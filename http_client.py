@@ -0,0 +1,125 @@
+"""
+Pooled HTTP Client
+Persistent keep-alive session with a bounded connection pool, explicit
+connect/read timeouts and jittered retries for calls to hosted services
+"""
+
+import time
+import random
+from typing import Iterable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import REGISTRY
+
+
+# Status codes worth another attempt; everything else is returned to the caller
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+HTTP_CLIENT_LATENCY = REGISTRY.histogram(
+    'skincare_http_client_seconds', 'Latency of individual outbound HTTP attempts', ['target', 'outcome']
+)
+HTTP_CLIENT_RETRIES = REGISTRY.counter(
+    'skincare_http_client_retries_total', 'Outbound HTTP attempts that were retried', ['target', 'reason']
+)
+HTTP_CLIENT_FAILURES = REGISTRY.counter(
+    'skincare_http_client_failures_total', 'Outbound HTTP calls that failed after all retries', ['target', 'reason']
+)
+
+
+class PooledHttpClient:
+    """
+    requests.Session wrapper shared by every request to one service
+
+    Connections (and their TLS sessions) are kept alive in a pool of
+    `pool_size` per host, so concurrent callers reuse them instead of
+    handshaking per request. Failed attempts are retried with full-jitter
+    exponential backoff.
+
+    Args:
+        base_url: Prefix for relative paths passed to request()
+        target: Label used for this client's metrics
+        pool_size: Keep-alive connections per host (match the caller's concurrency)
+        connect_timeout: Seconds to establish a connection
+        read_timeout: Seconds to wait for the response between bytes
+        max_retries: Extra attempts after the first one
+        backoff_base: First backoff ceiling in seconds, doubled per attempt
+        backoff_max: Upper bound for a single backoff
+    """
+
+    def __init__(self, base_url: str, target: str, pool_size: int = 10,
+                 connect_timeout: float = 3.05, read_timeout: float = 20.0,
+                 max_retries: int = 2, backoff_base: float = 0.25, backoff_max: float = 4.0,
+                 retry_statuses: Iterable[int] = RETRY_STATUSES):
+        self.base_url = base_url.rstrip('/')
+        self.target = target
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = set(retry_statuses)
+
+        self.session = requests.Session()
+        # Retries are handled below so they can be jittered and counted
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def backoff(self, attempt: int, retry_after: str = None) -> float:
+        """Seconds to wait before retry number `attempt` (0-based)"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send a request, retrying connection errors, timeouts and retryable statuses
+
+        Returns:
+            The final requests.Response (possibly a non-2xx one)
+
+        Raises:
+            requests.RequestException if every attempt failed without a response
+        """
+        url = path if path.startswith(('http://', 'https://')) else f"{self.base_url}/{path.lstrip('/')}"
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                reason = 'timeout' if isinstance(e, requests.Timeout) else 'connection'
+                HTTP_CLIENT_LATENCY.observe(time.perf_counter() - start, target=self.target, outcome=reason)
+                if last_attempt:
+                    HTTP_CLIENT_FAILURES.inc(target=self.target, reason=reason)
+                    raise
+                HTTP_CLIENT_RETRIES.inc(target=self.target, reason=reason)
+                time.sleep(self.backoff(attempt))
+                continue
+
+            HTTP_CLIENT_LATENCY.observe(time.perf_counter() - start, target=self.target, outcome=str(response.status_code))
+            if response.status_code not in self.retry_statuses:
+                return response
+            if last_attempt:
+                HTTP_CLIENT_FAILURES.inc(target=self.target, reason=str(response.status_code))
+                return response
+
+            HTTP_CLIENT_RETRIES.inc(target=self.target, reason=str(response.status_code))
+            retry_after = response.headers.get('Retry-After')
+            response.close()
+            time.sleep(self.backoff(attempt, retry_after))
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def close(self):
+        self.session.close()
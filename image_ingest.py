@@ -0,0 +1,292 @@
+"""
+Image Ingest for the Analysis Pipeline
+Decodes an upload once into a shared in-memory representation
+that every downstream stage reads from
+"""
+
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+MIN_IMAGE_SIZE = 50  # pixels, per side
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', str(40 * 1000 * 1000)))
+# Per-image limit; app.py also uses it as Flask's MAX_CONTENT_LENGTH
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_CONTENT_LENGTH', str(16 * 1024 * 1024)))
+HEADER_PROBE_LIMIT = 1024 * 1024  # EXIF blocks can push the JPEG size marker far in
+STREAM_CHUNK_SIZE = 64 * 1024
+ALLOWED_FORMATS = {'PNG', 'JPEG', 'MPO', 'GIF', 'BMP', 'WEBP'}
+
+# What the remote classifier receives: longest side and JPEG quality
+MODEL_INPUT_SIZE = int(os.getenv('MODEL_INPUT_SIZE', '512'))
+MODEL_INPUT_JPEG_QUALITY = int(os.getenv('MODEL_INPUT_JPEG_QUALITY', '90'))
+
+INVALID_IMAGE_ERROR = ({
+    'error': 'Invalid image file',
+    'message': 'The uploaded file is not a valid image. Please try again with a different photo.'
+}, 400)
+FILE_TOO_LARGE_ERROR = ({
+    'error': 'File too large',
+    'message': f'Please upload an image smaller than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB'
+}, 413)
+TOO_SMALL_ERROR = ({
+    'error': 'Image too small',
+    'message': 'Please upload an image with at least 50x50 pixels for accurate analysis'
+}, 400)
+
+
+class IngestedImage:
+    """
+    A decoded upload: the original encoded bytes plus an RGB pixel array
+
+    Stages should read `rgb` (or `to_pil()`) instead of opening the file
+    again; `path` is only kept for consumers that need a file on disk.
+    Images wrapped with from_rgb() have no bytes until `encoded` is first read.
+    """
+
+    def __init__(self, encoded: Optional[bytes], rgb: np.ndarray, image_format: str = None, path: str = None,
+                 quality: int = MODEL_INPUT_JPEG_QUALITY):
+        self._encoded = encoded
+        self._quality = quality
+        self.rgb = rgb
+        self.format = image_format
+        self.path = path
+        self._sha256 = None
+        self._pil = None
+        self._model_inputs = {}
+
+    @classmethod
+    def from_bytes(cls, data: bytes, path: str = None) -> 'IngestedImage':
+        """Decode encoded image bytes (raises if they are not a readable image)"""
+        img = Image.open(BytesIO(data))
+        image_format = img.format
+        img.load()
+        rgb = np.asarray(img.convert('RGB'))
+        return cls(data, rgb, image_format=image_format, path=path)
+
+    @classmethod
+    def from_rgb(cls, rgb: np.ndarray, quality: int = MODEL_INPUT_JPEG_QUALITY) -> 'IngestedImage':
+        """Wrap an in-memory RGB array (e.g. an augmented view), JPEG-encoded on first use"""
+        return cls(None, rgb, image_format='JPEG', quality=quality)
+
+    @property
+    def encoded(self) -> bytes:
+        """Encoded image bytes (the upload as received, or the JPEG of a wrapped array)"""
+        if self._encoded is None:
+            buffer = BytesIO()
+            Image.fromarray(self.rgb).save(buffer, format='JPEG', quality=self._quality)
+            self._encoded = buffer.getvalue()
+        return self._encoded
+
+    @property
+    def is_encoded(self) -> bool:
+        """Whether `encoded` is available without encoding the pixels"""
+        return self._encoded is not None
+
+    @property
+    def width(self) -> int:
+        return self.rgb.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.rgb.shape[0]
+
+    @property
+    def sha256(self) -> str:
+        """Hex digest of the encoded bytes"""
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.encoded).hexdigest()
+        return self._sha256
+
+    def to_pil(self) -> Image.Image:
+        """PIL view of the decoded pixels (no second decode)"""
+        if self._pil is None:
+            self._pil = Image.fromarray(self.rgb)
+        return self._pil
+
+    def resized(self, max_side: int) -> np.ndarray:
+        """RGB pixels downscaled so the longest side is at most max_side (never upscaled)"""
+        scale = max_side / max(self.width, self.height)
+        if scale >= 1:
+            return self.rgb
+        size = (max(1, round(self.width * scale)), max(1, round(self.height * scale)))
+        return cv2.resize(self.rgb, size, interpolation=cv2.INTER_AREA)
+
+    def model_input_jpeg(self, max_side: int = MODEL_INPUT_SIZE, quality: int = MODEL_INPUT_JPEG_QUALITY) -> bytes:
+        """
+        JPEG bytes sized for the classifier, encoded in memory once per setting
+
+        An upload that is already a small enough JPEG is sent as is.
+        """
+        key = (max_side, quality)
+        if key not in self._model_inputs:
+            if self.format == 'JPEG' and max(self.width, self.height) <= max_side:
+                self._model_inputs[key] = self.encoded
+            else:
+                buffer = BytesIO()
+                Image.fromarray(self.resized(max_side)).save(buffer, format='JPEG', quality=quality)
+                self._model_inputs[key] = buffer.getvalue()
+        return self._model_inputs[key]
+
+    def commit(self, path: str):
+        """Move a spooled upload (see ingest_stream) to its final path"""
+        os.replace(self.path, path)
+        self.path = path
+
+    def discard(self):
+        """Delete the file backing this image, if any"""
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+
+def ingest_upload(data: bytes, path: str = None) -> Tuple[Optional[IngestedImage], Optional[Tuple[dict, int]]]:
+    """
+    Decode and validate an uploaded image
+
+    Returns:
+        (IngestedImage, None) on success or (None, (error payload, status)) on failure
+    """
+    try:
+        image = IngestedImage.from_bytes(data, path=path)
+    except Exception:
+        return None, INVALID_IMAGE_ERROR
+
+    # Check image dimensions
+    if image.width < MIN_IMAGE_SIZE or image.height < MIN_IMAGE_SIZE:
+        return None, TOO_SMALL_ERROR
+
+    return image, None
+
+
+def ingest_file(path: str) -> Tuple[Optional[IngestedImage], Optional[Tuple[dict, int]]]:
+    """Like ingest_upload() for an image that is already on disk"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None, ({'error': 'Image file not found'}, 400)
+    return ingest_upload(data, path=path)
+
+
+def probe_image_header(stream) -> Tuple[bytes, Optional[Tuple[str, int, int]]]:
+    """
+    Read just enough of a stream for PIL to parse the image header
+
+    Returns:
+        (bytes consumed so far, (format, width, height)) or (bytes, None)
+        when no header was found within HEADER_PROBE_LIMIT
+    """
+    head = b''
+    while len(head) < HEADER_PROBE_LIMIT:
+        chunk = stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        head += chunk
+        try:
+            img = Image.open(BytesIO(head))  # lazy: parses the header only
+            return head, (img.format, img.size[0], img.size[1])
+        except Exception:
+            continue
+    return head, None
+
+
+def check_header(header_info) -> Optional[Tuple[dict, int]]:
+    """Validate format and dimensions from probe_image_header()"""
+    if header_info is None:
+        return INVALID_IMAGE_ERROR
+
+    image_format, width, height = header_info
+    if image_format not in ALLOWED_FORMATS:
+        return INVALID_IMAGE_ERROR
+    if width < MIN_IMAGE_SIZE or height < MIN_IMAGE_SIZE:
+        return TOO_SMALL_ERROR
+    if width * height > MAX_IMAGE_PIXELS:
+        return ({
+            'error': 'Image too large',
+            'message': f'Please upload an image smaller than {MAX_IMAGE_PIXELS // 1000000} megapixels'
+        }, 400)
+    return None
+
+
+def _copy_limited(stream, head: bytes, out):
+    """Write head and the rest of stream to out; OverflowError past MAX_UPLOAD_BYTES"""
+    out.write(head)
+    size = len(head)
+    while True:
+        chunk = stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise OverflowError
+        out.write(chunk)
+
+
+def spool_stream(stream, path: str) -> Optional[Tuple[dict, int]]:
+    """
+    Header-check an upload and write it to path without decoding it
+
+    For callers that decode later (ingest_file) so that many uploads of one
+    request are not held in memory as pixels at the same time.
+
+    Returns:
+        None on success or (error payload, status); nothing is left on disk on error
+    """
+    head, header_info = probe_image_header(stream)
+    error = check_header(header_info)
+    if error:
+        return error
+
+    try:
+        with open(path, 'wb') as out:
+            _copy_limited(stream, head, out)
+    except OverflowError:
+        os.remove(path)
+        return FILE_TOO_LARGE_ERROR
+    return None
+
+
+def ingest_stream(stream, spool_dir: str) -> Tuple[Optional[IngestedImage], Optional[Tuple[dict, int]]]:
+    """
+    Validate an upload from its file stream and spool it to a temporary file
+
+    `stream` is the FileStorage stream Werkzeug has already filled while
+    parsing the multipart body (in memory, or in its own temp file for large
+    parts). The header is checked first, so junk, tiny or oversized images
+    are rejected without writing anything to spool_dir or decoding pixels.
+    Valid uploads are written once to a hidden temp file in spool_dir and
+    read back as the image's encoded bytes; call commit() on the returned
+    image to move it into place or discard() to drop it.
+
+    Returns:
+        (IngestedImage backed by the temp file, None) or (None, (error payload, status))
+    """
+    head, header_info = probe_image_header(stream)
+    error = check_header(header_info)
+    if error:
+        return None, error
+
+    tmp = tempfile.NamedTemporaryFile(dir=spool_dir, prefix='.upload_', delete=False)
+    try:
+        with tmp:
+            _copy_limited(stream, head, tmp)
+
+        with open(tmp.name, 'rb') as f:
+            image = IngestedImage.from_bytes(f.read(), path=tmp.name)
+
+    except OverflowError:
+        os.remove(tmp.name)
+        return None, FILE_TOO_LARGE_ERROR
+    except Exception:
+        # Header was fine but the body is truncated or corrupt
+        os.remove(tmp.name)
+        return None, INVALID_IMAGE_ERROR
+
+    return image, None
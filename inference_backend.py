@@ -0,0 +1,520 @@
+"""
+Inference Backends for Skin Lesion Classification
+Common interface over the hosted Roboflow model (SDK or pooled HTTP client)
+and a local ONNX Runtime CPU model, selected with the INFERENCE_BACKEND
+environment variable
+"""
+
+import os
+import json
+import base64
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from metrics import REGISTRY
+from http_client import PooledHttpClient
+from resilience import CircuitBreaker, Hedger
+
+
+# Class order used by models trained on HAM10000 (alphabetical)
+DEFAULT_CLASSES = [
+    'Actinic keratoses',
+    'Basal cell carcinoma',
+    'Benign keratosis-like lesions',
+    'Dermatofibroma',
+    'Melanocytic nevi',
+    'Melanoma',
+    'Vascular lesions'
+]
+
+INFERENCE_BYTES = REGISTRY.counter(
+    'skincare_inference_bytes_total', 'Image bytes uploaded vs. sent to the classifier', ['kind']
+)
+INFERENCE_REQUEST_SIZE = REGISTRY.histogram(
+    'skincare_inference_request_bytes', 'Size of the image sent to the classifier',
+    buckets=(16e3, 32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+)
+INFERENCE_LATENCY = REGISTRY.histogram(
+    'skincare_inference_backend_seconds', 'Classifier call latency by backend', ['backend']
+)
+
+
+def build_prediction(all_preds: Dict, image_info: Dict, top_class: str = None) -> Dict:
+    """
+    Normalize classifier output to the shape the app uses
+
+    Args:
+        all_preds: {class_name: {'confidence': 0..1, ...}}
+        image_info: {'width': int, 'height': int}
+        top_class: Explicit top class, otherwise the most confident one
+    """
+    if top_class is None:
+        top_class = max(all_preds, key=lambda x: all_preds[x]['confidence'])
+
+    return {
+        'top_class': top_class,
+        'confidence': all_preds[top_class]['confidence'] * 100,
+        'all_predictions': all_preds,
+        'image_info': image_info
+    }
+
+
+def parse_roboflow_response(predictions: Dict) -> Optional[Dict]:
+    """Convert a Roboflow classification response; None if it holds no prediction"""
+    pred_list = predictions.get('predictions')
+    if not pred_list or not isinstance(pred_list, list) or len(pred_list) == 0:
+        return None
+
+    pred_data = pred_list[0]
+    all_preds = pred_data['predictions']
+
+    # Get top class
+    predicted_classes = pred_data.get('predicted_classes', [])
+    top_class = predicted_classes[0] if predicted_classes else None
+
+    return build_prediction(all_preds, pred_data['image'], top_class)
+
+
+def parse_hosted_response(body: Dict) -> Optional[Dict]:
+    """
+    Convert a response from Roboflow's hosted classify endpoint
+
+    Multi-label projects return {'predictions': {class: {...}}, 'predicted_classes': [...]},
+    single-label ones {'predictions': [{'class', 'confidence'}, ...], 'top': class}.
+    """
+    preds = body.get('predictions')
+    if isinstance(preds, dict) and preds:
+        predicted_classes = body.get('predicted_classes') or []
+        top_class = predicted_classes[0] if predicted_classes else None
+        return build_prediction(preds, body.get('image', {}), top_class)
+
+    if isinstance(preds, list) and preds and 'class' in preds[0]:
+        all_preds = {
+            p['class']: {'class_id': p.get('class_id'), 'confidence': p['confidence']}
+            for p in preds
+        }
+        return build_prediction(all_preds, body.get('image', {}), body.get('top'))
+
+    return None
+
+
+def _image_size(image):
+    if hasattr(image, 'rgb'):
+        return image.width, image.height
+    with Image.open(image) as img:
+        return img.size
+
+
+def preprocess_rgb(rgb: np.ndarray, width: int, height: int, mean, std, channels_first: bool) -> np.ndarray:
+    """Resize and normalize an RGB array into a float32 model input tensor"""
+    resized = cv2.resize(rgb, (width, height), interpolation=cv2.INTER_AREA)
+    tensor = (resized.astype(np.float32) / 255.0 - np.asarray(mean, dtype=np.float32)) / np.asarray(std, dtype=np.float32)
+    return tensor.transpose(2, 0, 1) if channels_first else tensor
+
+
+class InferenceBackend:
+    """
+    Interface for classifiers used by process_image_prediction
+
+    predict() takes an ingested image (anything with `rgb`, see
+    image_ingest.IngestedImage) or a file path and returns
+    {'top_class', 'confidence', 'all_predictions', 'image_info'} or None.
+    """
+    name = 'base'
+
+    def predict(self, image) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def predict_batch(self, images: List) -> List[Optional[Dict]]:
+        """
+        Classify several images; backends override this when they can batch
+
+        A failure for one image is returned in its slot as the exception
+        instance, so it does not fail the rest of the batch.
+        """
+        results = []
+        for image in images:
+            try:
+                results.append(self.predict(image))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class RoboflowBackend(InferenceBackend):
+    """
+    Hosted Roboflow classification model via the Roboflow SDK
+
+    Resolving the model (API key check, workspace, project and version
+    lookups) takes several network round trips, so it happens on the first
+    prediction. The resolved version metadata is cached in `metadata_path`
+    and later processes build the model client from it without those calls.
+    """
+    name = 'roboflow'
+
+    def __init__(self, api_key: str, workspace: str, project: str, version: str, metadata_path: str = None):
+        self.api_key = api_key
+        self.workspace = workspace
+        self.project = project
+        self.version = str(version)
+        self.metadata_path = metadata_path
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._resolve_model()
+        return self._model
+
+    def _read_metadata(self) -> Optional[Dict]:
+        if not self.metadata_path or not os.path.exists(self.metadata_path):
+            return None
+        try:
+            with open(self.metadata_path) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        key = (metadata.get('workspace'), metadata.get('project'), metadata.get('version_number'))
+        return metadata if key == (self.workspace, self.project, self.version) else None
+
+    def _write_metadata(self, metadata: Dict):
+        if not self.metadata_path:
+            return
+        try:
+            if os.path.dirname(self.metadata_path):
+                os.makedirs(os.path.dirname(self.metadata_path), exist_ok=True)
+            tmp_path = f"{self.metadata_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+            os.replace(tmp_path, self.metadata_path)
+        except OSError as e:
+            print(f"⚠️ Could not cache Roboflow metadata: {e}")
+
+    def _resolve_model(self):
+        metadata = self._read_metadata()
+        if metadata and metadata.get('type') == 'classification':
+            try:
+                from roboflow.models.classification import ClassificationModel
+                return ClassificationModel(self.api_key, metadata['id'], metadata['name'], metadata['version'])
+            except Exception as e:
+                print(f"⚠️ Cached Roboflow metadata unusable, resolving again: {e}")
+
+        from roboflow import Roboflow
+
+        rf = Roboflow(api_key=self.api_key)
+        version = rf.workspace(self.workspace).project(self.project).version(self.version)
+        self._write_metadata({
+            'workspace': self.workspace,
+            'project': self.project,
+            'version_number': self.version,
+            'id': version.id,
+            'name': version.name,
+            'version': version.version,
+            'type': getattr(version, 'type', None)
+        })
+        return version.model
+
+    def predict(self, image) -> Optional[Dict]:
+        tmp_path = None
+        try:
+            if hasattr(image, 'model_input_jpeg'):
+                # Send a model-sized JPEG instead of the full-resolution upload. The
+                # SDK only accepts file paths, so it goes through a short-lived temp file.
+                payload = image.model_input_jpeg()
+                if image.is_encoded:
+                    INFERENCE_BYTES.inc(len(image.encoded), kind='original')
+                INFERENCE_BYTES.inc(len(payload), kind='sent')
+                INFERENCE_REQUEST_SIZE.observe(len(payload))
+                with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
+                    tmp.write(payload)
+                    tmp_path = tmp.name
+                image_path = tmp_path
+            else:
+                image_path = image
+
+            with INFERENCE_LATENCY.time(backend=self.name):
+                result = self.model.predict(image_path)
+            return parse_roboflow_response(result.json())
+
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class HostedBackend(InferenceBackend):
+    """
+    Hosted Roboflow classification model called directly over HTTP
+
+    Same model as RoboflowBackend, but requests go through a pooled keep-alive
+    session with explicit timeouts and jittered retries (see http_client.py)
+    instead of the SDK, which opens a new connection per call and never times out.
+    """
+    name = 'hosted'
+
+    def __init__(self, api_key: str, project: str, version: str, base_url: str, pool_size: int = 10,
+                 **client_options):
+        self.api_key = api_key
+        self.path = f"{project}/{version}"
+        self.client = PooledHttpClient(base_url, target='inference', pool_size=pool_size, **client_options)
+        # The endpoint takes one image per request; a batch is sent as
+        # concurrent requests over the pooled connections
+        self._batch_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='hosted-inference')
+
+    def encode(self, image) -> bytes:
+        """JPEG bytes to upload: the model-sized copy for ingested images, the raw file otherwise"""
+        if hasattr(image, 'model_input_jpeg'):
+            payload = image.model_input_jpeg()
+            if image.is_encoded:
+                INFERENCE_BYTES.inc(len(image.encoded), kind='original')
+            INFERENCE_BYTES.inc(len(payload), kind='sent')
+        else:
+            with open(image, 'rb') as f:
+                payload = f.read()
+            INFERENCE_BYTES.inc(len(payload), kind='sent')
+        INFERENCE_REQUEST_SIZE.observe(len(payload))
+        return payload
+
+    def predict(self, image) -> Optional[Dict]:
+        payload = base64.b64encode(self.encode(image))
+
+        with INFERENCE_LATENCY.time(backend=self.name):
+            response = self.client.post(
+                self.path,
+                params={'api_key': self.api_key},
+                data=payload,
+                headers={'Content-Type': 'application/x-www-form-urlencoded'}
+            )
+        response.raise_for_status()
+        return parse_hosted_response(response.json())
+
+    def _predict_or_error(self, image):
+        try:
+            return self.predict(image)
+        except Exception as e:
+            return e
+
+    def predict_batch(self, images: List) -> List[Optional[Dict]]:
+        return list(self._batch_executor.map(self._predict_or_error, images))
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    Local classifier running on ONNX Runtime's CPU execution provider
+
+    Expects a single image input (NCHW or NHWC, float32) and one output of
+    per-class scores; softmax is applied when the scores are not probabilities.
+    """
+    name = 'onnx'
+
+    def __init__(self, model_path: str, labels: List[str] = None,
+                 mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("ONNX Runtime not installed. Install with: pip install onnxruntime")
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.labels = labels or DEFAULT_CLASSES
+        self.mean = np.array(mean, dtype=np.float32)
+        self.std = np.array(std, dtype=np.float32)
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        shape = model_input.shape
+        # Models exported with a fixed batch of 1 need one call per image
+        self.batchable = not isinstance(shape[0], int) or shape[0] != 1
+        self.channels_first = shape[1] == 3
+        if self.channels_first:
+            self.input_height, self.input_width = shape[2], shape[3]
+        else:
+            self.input_height, self.input_width = shape[1], shape[2]
+        # Dynamic spatial dims show up as strings/None; fall back to 224
+        if not isinstance(self.input_height, int) or not isinstance(self.input_width, int):
+            self.input_height = self.input_width = 224
+
+    def preprocess(self, image) -> np.ndarray:
+        """RGB image -> normalized float32 tensor of shape (H, W, 3) or (3, H, W)"""
+        rgb = image.rgb if hasattr(image, 'rgb') else np.array(Image.open(image).convert('RGB'))
+        return preprocess_rgb(rgb, self.input_width, self.input_height, self.mean, self.std, self.channels_first)
+
+    def run(self, tensors: np.ndarray) -> np.ndarray:
+        """Forward pass on a preprocessed batch; returns (N, num_classes) probabilities"""
+        tensors = tensors.astype(np.float32)
+        with INFERENCE_LATENCY.time(backend=self.name):
+            if self.batchable:
+                scores = self.session.run(None, {self.input_name: tensors})[0]
+            else:
+                scores = np.concatenate([
+                    self.session.run(None, {self.input_name: tensors[i:i + 1]})[0]
+                    for i in range(len(tensors))
+                ])
+        scores = scores.reshape(len(tensors), -1)
+        if scores.min() < 0 or not np.allclose(scores.sum(axis=1), 1.0, atol=1e-3):
+            scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+            scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+
+    def to_prediction(self, probs: np.ndarray, image) -> Dict:
+        all_preds = {
+            label: {'class_id': i, 'confidence': float(p)}
+            for i, (label, p) in enumerate(zip(self.labels, probs))
+        }
+        width, height = _image_size(image)
+        return build_prediction(all_preds, {'width': width, 'height': height})
+
+    def predict(self, image) -> Optional[Dict]:
+        result = self.predict_batch([image])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def predict_batch(self, images: List) -> List[Optional[Dict]]:
+        # An unreadable image fails only its own slot; the rest run as one batch
+        results = [None] * len(images)
+        tensors, slots = [], []
+        for i, image in enumerate(images):
+            try:
+                tensors.append(self.preprocess(image))
+                slots.append(i)
+            except Exception as e:
+                results[i] = e
+
+        if not tensors:
+            return results
+        try:
+            probs = self.run(np.stack(tensors))
+        except Exception as e:
+            for i in slots:
+                results[i] = e
+            return results
+
+        for i, p in zip(slots, probs):
+            try:
+                results[i] = self.to_prediction(p, images[i])
+            except Exception as e:
+                results[i] = e
+        return results
+
+
+class ResilientBackend(InferenceBackend):
+    """
+    Wraps a remote backend with a circuit breaker and request hedging
+
+    While the breaker is open predict() raises resilience.CircuitOpenError
+    immediately instead of blocking on a degraded service; slow calls are
+    raced against a hedged second attempt. Batches are sent as concurrent
+    single-image calls so every image gets the same protection.
+    """
+
+    def __init__(self, inner: InferenceBackend, breaker: CircuitBreaker, hedger: Hedger, max_workers: int = 10):
+        self.inner = inner
+        self.name = inner.name
+        self.breaker = breaker
+        self.hedger = hedger
+        self._batch_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{inner.name}-batch')
+
+    def predict(self, image) -> Optional[Dict]:
+        return self.breaker.call(self.hedger.call, self.inner.predict, image)
+
+    def _predict_or_error(self, image):
+        try:
+            return self.predict(image)
+        except Exception as e:
+            return e
+
+    def predict_batch(self, images: List) -> List[Optional[Dict]]:
+        return list(self._batch_executor.map(self._predict_or_error, images))
+
+
+def with_resilience(backend: InferenceBackend) -> InferenceBackend:
+    """Wrap a remote backend per the INFERENCE_BREAKER_* / INFERENCE_HEDGE_* settings"""
+    if os.getenv('INFERENCE_BREAKER_ENABLED', 'true').lower() != 'true':
+        return backend
+
+    breaker = CircuitBreaker(
+        backend.name,
+        failure_rate=float(os.getenv('INFERENCE_BREAKER_FAILURE_RATE', '0.5')),
+        slow_call_seconds=float(os.getenv('INFERENCE_BREAKER_SLOW_CALL_SECONDS', '10')),
+        slow_call_rate=float(os.getenv('INFERENCE_BREAKER_SLOW_CALL_RATE', '0.8')),
+        window_size=int(os.getenv('INFERENCE_BREAKER_WINDOW', '20')),
+        min_calls=int(os.getenv('INFERENCE_BREAKER_MIN_CALLS', '10')),
+        open_seconds=float(os.getenv('INFERENCE_BREAKER_OPEN_SECONDS', '30')),
+        half_open_calls=int(os.getenv('INFERENCE_BREAKER_HALF_OPEN_CALLS', '3'))
+    )
+    pool_size = int(os.getenv('INFERENCE_POOL_SIZE', '10'))
+    hedger = Hedger(
+        'inference',
+        quantile=float(os.getenv('INFERENCE_HEDGE_QUANTILE', '0.95')),
+        initial_delay=float(os.getenv('INFERENCE_HEDGE_INITIAL_DELAY', '2.0')),
+        max_ratio=float(os.getenv('INFERENCE_HEDGE_MAX_RATIO', '0.1')),
+        timeout=float(os.getenv('INFERENCE_CALL_TIMEOUT', '30')),
+        max_workers=pool_size * 2,
+        enabled=os.getenv('INFERENCE_HEDGING', 'false').lower() == 'true'
+    )
+    return ResilientBackend(backend, breaker, hedger, max_workers=pool_size)
+
+
+def load_labels(path: str = None) -> Optional[List[str]]:
+    """Read class labels from a JSON list file"""
+    if not path:
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def create_inference_backend(name: str = None) -> InferenceBackend:
+    """
+    Build the backend named by INFERENCE_BACKEND ('roboflow', 'hosted' or 'onnx')
+    """
+    name = (name or os.getenv('INFERENCE_BACKEND', 'roboflow')).lower()
+
+    # Remote backends get the circuit breaker and hedging; the local model doesn't need them
+    if name in ('hosted', 'roboflow'):
+        return with_resilience(_create_backend(name))
+    return _create_backend(name)
+
+
+def _create_backend(name: str) -> InferenceBackend:
+    if name == 'onnx':
+        return OnnxBackend(
+            model_path=os.getenv('ONNX_MODEL_PATH', 'models/skin_classifier.onnx'),
+            labels=load_labels(os.getenv('ONNX_LABELS_PATH')),
+            threads=int(os.getenv('ONNX_THREADS', '0'))
+        )
+
+    if name == 'hosted':
+        return HostedBackend(
+            api_key=os.getenv('ROBOFLOW_API_KEY'),
+            project=os.getenv('PROJECT'),
+            version=os.getenv('VERSION'),
+            base_url=os.getenv('HOSTED_INFERENCE_URL', 'https://classify.roboflow.com'),
+            pool_size=int(os.getenv('INFERENCE_POOL_SIZE', '10')),
+            connect_timeout=float(os.getenv('INFERENCE_CONNECT_TIMEOUT', '3.05')),
+            read_timeout=float(os.getenv('INFERENCE_READ_TIMEOUT', '20')),
+            max_retries=int(os.getenv('INFERENCE_MAX_RETRIES', '2')),
+            backoff_base=float(os.getenv('INFERENCE_BACKOFF_BASE', '0.25')),
+            backoff_max=float(os.getenv('INFERENCE_BACKOFF_MAX', '4'))
+        )
+
+    if name == 'roboflow':
+        return RoboflowBackend(
+            api_key=os.getenv('ROBOFLOW_API_KEY'),
+            workspace=os.getenv('WORKSPACE'),
+            project=os.getenv('PROJECT'),
+            version=os.getenv('VERSION'),
+            metadata_path=os.getenv('ROBOFLOW_METADATA_CACHE', 'models/roboflow_metadata.json')
+        )
+
+    raise ValueError(f"Unknown inference backend: {name}")
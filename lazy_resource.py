@@ -0,0 +1,71 @@
+"""
+Lazily Initialized Shared Resources
+Defers slow or network-bound construction (model clients, API clients) from
+import time to first use, so the app starts quickly and offline
+"""
+
+import threading
+import time
+from typing import Any, Callable
+
+from metrics import REGISTRY
+
+
+RESOURCE_INIT_SECONDS = REGISTRY.histogram(
+    'skincare_resource_init_seconds', 'Time spent constructing lazily initialized resources', ['resource']
+)
+RESOURCE_INIT_FAILURES = REGISTRY.counter(
+    'skincare_resource_init_failures_total', 'Failed lazy resource initializations', ['resource']
+)
+
+_UNSET = object()
+
+
+class LazyResource:
+    """
+    Thread-safe, build-once holder for a shared object
+
+    get() runs `factory` on first call (other threads wait on the lock) and
+    returns the same object afterwards. A factory that raises is retried on
+    the next call, so a dependency that was unreachable at first use can
+    recover. Attribute access and truthiness are forwarded to the object,
+    so the holder can stand in for it (`groq_client.chat...`).
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self._name = name
+        self._factory = factory
+        self._value = _UNSET
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        value = self._value
+        if value is not _UNSET:
+            return value
+
+        with self._lock:
+            if self._value is _UNSET:
+                start = time.perf_counter()
+                try:
+                    self._value = self._factory()
+                except Exception:
+                    RESOURCE_INIT_FAILURES.inc(resource=self._name)
+                    raise
+                finally:
+                    RESOURCE_INIT_SECONDS.observe(time.perf_counter() - start, resource=self._name)
+            return self._value
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not _UNSET
+
+    def reset(self):
+        """Drop the built object so the next get() constructs a new one"""
+        with self._lock:
+            self._value = _UNSET
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+    def __bool__(self):
+        return bool(self.get())
@@ -0,0 +1,225 @@
+"""
+Streaming LLM Client with a Latency Budget
+Streams chat completion tokens as they arrive and gives up once a
+per-request deadline passes, so a slow provider cannot hold an analysis
+hostage for a full-length generation
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from metrics import REGISTRY
+
+
+LLM_FIRST_TOKEN = REGISTRY.histogram(
+    'skincare_llm_first_token_seconds', 'Time from LLM request to the first content token', ['model'],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 12.0, 20.0, 30.0)
+)
+LLM_TOTAL = REGISTRY.histogram(
+    'skincare_llm_completion_seconds', 'Time from LLM request to the end of the completion', ['model', 'outcome'],
+    buckets=(0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 12.0, 20.0, 30.0, 60.0)
+)
+LLM_TIMEOUTS = REGISTRY.counter(
+    'skincare_llm_timeouts_total', 'LLM completions abandoned at the deadline', ['model', 'phase']
+)
+LLM_TOKENS = REGISTRY.counter(
+    'skincare_llm_tokens_total', 'Tokens used by LLM completions', ['model', 'kind']
+)
+LLM_PROMPT_TOKENS = REGISTRY.histogram(
+    'skincare_llm_prompt_tokens', 'Prompt tokens per LLM completion', ['model'],
+    buckets=(64, 128, 256, 384, 512, 768, 1024, 1536, 2048, 4096)
+)
+LLM_COMPLETION_TOKENS = REGISTRY.histogram(
+    'skincare_llm_completion_tokens', 'Completion tokens per LLM completion', ['model'],
+    buckets=(32, 64, 128, 256, 384, 512, 640, 768, 896, 1000, 1500, 2000)
+)
+
+# Rough size of a token in characters, used when the provider reports no usage
+CHARS_PER_TOKEN = 4
+
+_DONE = object()
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """The completion did not finish within its budget; partial holds the text received so far"""
+
+    def __init__(self, phase: str, deadline: float, partial: str = ''):
+        super().__init__(f"LLM {phase} deadline of {deadline:g}s exceeded")
+        self.phase = phase
+        self.partial = partial
+
+
+def _usage_of(chunk):
+    """Token usage carried by a stream chunk (OpenAI: chunk.usage, Groq: chunk.x_groq.usage)"""
+    usage = getattr(chunk, 'usage', None) or getattr(getattr(chunk, 'x_groq', None), 'usage', None)
+    if usage is None:
+        return None
+    return {
+        'prompt_tokens': int(getattr(usage, 'prompt_tokens', 0) or 0),
+        'completion_tokens': int(getattr(usage, 'completion_tokens', 0) or 0)
+    }
+
+
+class StreamingLLMClient:
+    """
+    Chat completions that always stream and always end by a deadline
+
+    The provider stream is read on a helper thread and handed over through
+    a queue, so the caller can stop waiting even while the socket is stuck
+    between chunks. On expiry the stream is closed and LLMDeadlineExceeded
+    is raised.
+
+    Args:
+        client: OpenAI-compatible client (or LazyResource holding one)
+        model: Model name sent with every request
+        deadline: Seconds allowed for the whole completion
+        first_token_timeout: Seconds allowed until the first token (None: only the deadline)
+        max_tokens, temperature: Generation settings
+    """
+
+    def __init__(self, client, model: str, deadline: float = 20.0, first_token_timeout: Optional[float] = None,
+                 max_tokens: int = 1000, temperature: float = 0.7):
+        self.client = client
+        self.model = model
+        self.deadline = deadline
+        self.first_token_timeout = first_token_timeout
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+
+    def _client(self):
+        return self.client.get() if hasattr(self.client, 'get') else self.client
+
+    def _pump(self, messages: List[Dict], deadline: float, tokens: queue.Queue, cancelled: threading.Event, handle: Dict):
+        try:
+            stream = self._client().chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                stream=True,
+                timeout=deadline
+            )
+            handle['stream'] = stream
+            for chunk in stream:
+                if cancelled.is_set():
+                    break
+                handle['usage'] = _usage_of(chunk) or handle.get('usage')
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    handle['finish_reason'] = chunk.choices[0].finish_reason
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    tokens.put(delta)
+            tokens.put(_DONE)
+        except Exception as e:
+            tokens.put(e)
+        finally:
+            if cancelled.is_set():
+                self._close(handle.get('stream'))
+
+    @staticmethod
+    def _close(stream):
+        close = getattr(stream, 'close', None)
+        if close:
+            try:
+                close()
+            except Exception:
+                pass
+
+    def _record_usage(self, messages: List[Dict], text: str, handle: Dict, outcome: str,
+                      latency: float, first_token: Optional[float]) -> Dict:
+        prompt_chars = sum(len(m.get('content') or '') for m in messages)
+        usage = handle.get('usage')
+        if usage is None:
+            usage = {
+                'prompt_tokens': -(-prompt_chars // CHARS_PER_TOKEN),
+                'completion_tokens': -(-len(text) // CHARS_PER_TOKEN)
+            }
+        LLM_TOKENS.inc(usage['prompt_tokens'], model=self.model, kind='prompt')
+        LLM_TOKENS.inc(usage['completion_tokens'], model=self.model, kind='completion')
+        LLM_PROMPT_TOKENS.observe(usage['prompt_tokens'], model=self.model)
+        LLM_COMPLETION_TOKENS.observe(usage['completion_tokens'], model=self.model)
+        return {
+            'model': self.model,
+            'outcome': outcome,
+            'finish_reason': handle.get('finish_reason'),
+            'prompt_tokens': usage['prompt_tokens'],
+            'completion_tokens': usage['completion_tokens'],
+            'total_tokens': usage['prompt_tokens'] + usage['completion_tokens'],
+            'tokens_estimated': handle.get('usage') is None,
+            'max_tokens': self.max_tokens,
+            'prompt_chars': prompt_chars,
+            'completion_chars': len(text),
+            'latency_seconds': round(latency, 4),
+            'first_token_seconds': round(first_token, 4) if first_token is not None else None
+        }
+
+    def stream(self, messages: List[Dict], deadline: float = None,
+               on_usage: Callable[[Dict], None] = None) -> Iterator[str]:
+        """
+        Yield content deltas as they arrive
+
+        on_usage, if given, receives one usage dict (token counts, prompt size,
+        latency, outcome) when the completion ends, however it ends. Token
+        counts are estimated from the text when the provider reports none.
+
+        Raises:
+            LLMDeadlineExceeded when the first token or the full completion is late;
+            provider errors propagate unchanged
+        """
+        deadline = deadline or self.deadline
+        first_token_timeout = min(self.first_token_timeout or deadline, deadline)
+        start = time.perf_counter()
+
+        tokens = queue.Queue()
+        cancelled = threading.Event()
+        handle = {}
+        threading.Thread(target=self._pump, args=(messages, deadline, tokens, cancelled, handle),
+                         name='llm-stream', daemon=True).start()
+
+        parts = []
+        outcome = 'error'
+        first_token = None
+        try:
+            while True:
+                phase, budget = ('generation', deadline) if parts else ('first_token', first_token_timeout)
+                try:
+                    item = tokens.get(timeout=max(0.0, start + budget - time.perf_counter()))
+                except queue.Empty:
+                    outcome = 'timeout'
+                    cancelled.set()
+                    self._close(handle.get('stream'))
+                    LLM_TIMEOUTS.inc(model=self.model, phase=phase)
+                    raise LLMDeadlineExceeded(phase, budget, ''.join(parts))
+                if item is _DONE:
+                    outcome = 'ok'
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                if not parts:
+                    first_token = time.perf_counter() - start
+                    LLM_FIRST_TOKEN.observe(first_token, model=self.model)
+                parts.append(item)
+                yield item
+        except GeneratorExit:
+            # Consumer stopped early: stop reading the provider stream too
+            outcome = 'cancelled'
+            cancelled.set()
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            LLM_TOTAL.observe(latency, model=self.model, outcome=outcome)
+            usage = self._record_usage(messages, ''.join(parts), handle, outcome, latency, first_token)
+            if on_usage:
+                on_usage(usage)
+
+    def complete(self, messages: List[Dict], on_token: Callable[[str], None] = None, deadline: float = None,
+                 on_usage: Callable[[Dict], None] = None) -> str:
+        """Full completion text, passing each delta to on_token as it arrives"""
+        parts = []
+        for delta in self.stream(messages, deadline=deadline, on_usage=on_usage):
+            parts.append(delta)
+            if on_token:
+                on_token(delta)
+        return ''.join(parts)
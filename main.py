@@ -3,10 +3,11 @@ Enhanced Skin Cancer Classification with Visualization
 """
 
 import os
-from roboflow import Roboflow
 from PIL import Image
 import matplotlib.pyplot as plt
 from dotenv import load_dotenv
+from inference_backend import create_inference_backend
+from lazy_resource import LazyResource
 
 # Load environment variables
 load_dotenv()
@@ -16,19 +17,24 @@ API_KEY = os.getenv("ROBOFLOW_API_KEY")
 WORKSPACE = os.getenv("WORKSPACE")
 PROJECT = os.getenv("PROJECT")
 VERSION = os.getenv("VERSION")
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "roboflow").lower()
 
-# Check if all required environment variables are set
-if not all([API_KEY, WORKSPACE, PROJECT, VERSION]):
+# Check if all required environment variables are set (the local ONNX backend needs none)
+if INFERENCE_BACKEND in ("roboflow", "hosted") and not all([API_KEY, WORKSPACE, PROJECT, VERSION]):
     print("❌ Error: Please set all required environment variables in .env file")
     print("Required: ROBOFLOW_API_KEY, WORKSPACE, PROJECT, VERSION")
     exit(1)
 
-# Initialize Roboflow
-print("🔄 Loading Roboflow workspace...")
-rf = Roboflow(api_key=API_KEY)
-project = rf.workspace(WORKSPACE).project(PROJECT)
-model = project.version(VERSION).model
-print("✅ Model loaded successfully!\n")
+
+def load_backend():
+    print(f"🔄 Loading {INFERENCE_BACKEND} inference backend...")
+    backend = create_inference_backend(INFERENCE_BACKEND)
+    print("✅ Model loaded successfully!\n")
+    return backend
+
+
+# The classifier is built on the first prediction, not at import
+backend = LazyResource('inference_backend', load_backend)
 
 # Skin condition information
 CONDITION_INFO = {
@@ -69,23 +75,14 @@ CONDITION_INFO = {
     }
 }
 
-def print_results(predictions):
+def print_results(predictions, image_path=None):
     """Print detailed classification results"""
-    pred_list = predictions.get('predictions')
-    if not pred_list or not isinstance(pred_list, list) or len(pred_list) == 0:
+    if not predictions:
         print("❌ No prediction data available.")
         return None, None
     
-    pred_data = predictions['predictions'][0]
-    all_preds = pred_data['predictions']
-    
-    # Get top class from predictions if predicted_classes is empty
-    predicted_classes = pred_data.get('predicted_classes', [])
-    if predicted_classes:
-        top_class = predicted_classes[0]
-    else:
-        # Find top class by confidence
-        top_class = max(all_preds, key=lambda x: all_preds[x]['confidence'])
+    all_preds = predictions['all_predictions']
+    top_class = predictions['top_class']
     
     # Sort by confidence
     sorted_preds = sorted(all_preds.items(), 
@@ -97,8 +94,8 @@ def print_results(predictions):
     print("="*70)
     
     # Image info
-    img_info = pred_data['image']
-    print(f"\n📸 Image: {pred_data.get('image_path', 'N/A')}")
+    img_info = predictions['image_info']
+    print(f"\n📸 Image: {image_path or 'N/A'}")
     print(f"   Size: {img_info['width']} x {img_info['height']} pixels")
     
     # Top prediction
@@ -135,13 +132,11 @@ def print_results(predictions):
 
 def visualize_results(image_path, predictions, save_path="result_visualization.png"):
     """Create visual chart of predictions"""
-    pred_list = predictions.get('predictions')
-    if not pred_list or not isinstance(pred_list, list) or len(pred_list) == 0:
+    if not predictions:
         print("❌ No prediction data available for visualization.")
         return
     
-    pred_data = predictions['predictions'][0]
-    all_preds = pred_data['predictions']
+    all_preds = predictions['all_predictions']
     
     # Sort predictions
     sorted_preds = sorted(all_preds.items(), 
@@ -211,23 +206,21 @@ def detect_skin_cancer(image_path, show_visualization=True):
         show_visualization (bool): Whether to show visualization
         
     Returns:
-        dict: Prediction results
+        dict: Prediction results ({'top_class', 'confidence', 'all_predictions', 'image_info'})
     """
     try:
         print(f"🔍 Analyzing image: {os.path.basename(image_path)}...")
         
         # Run prediction
-        result = model.predict(image_path)
-        predictions = result.json()
+        predictions = backend.get().predict(image_path)
         
         # Check if predictions exist
-        pred_list = predictions.get('predictions')
-        if not pred_list or not isinstance(pred_list, list) or len(pred_list) == 0:
+        if not predictions:
             print("❌ No predictions returned from the model.")
             return None
         
         # Print detailed results
-        sorted_preds, top_class = print_results(predictions)
+        sorted_preds, top_class = print_results(predictions, image_path)
         
         # Create visualization
         if show_visualization:
@@ -268,14 +261,10 @@ def batch_process(image_folder):
         result = detect_skin_cancer(img_path, show_visualization=False)
         
         if result:
-            pred_data = result['predictions'][0]
-            top_class = pred_data['predicted_classes'][0]
-            top_conf = pred_data['predictions'][top_class]['confidence'] * 100
-            
             results_summary.append({
                 'file': os.path.basename(img_path),
-                'prediction': top_class,
-                'confidence': top_conf
+                'prediction': result['top_class'],
+                'confidence': result['confidence']
             })
     
     # Print summary
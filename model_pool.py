@@ -0,0 +1,216 @@
+"""
+Multi-Model Ensemble Pool
+Runs several local ONNX classifiers in parallel worker processes and returns
+their real outputs as the predictions_dict the XGBoost ensemble consumes
+"""
+
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from inference_backend import DEFAULT_CLASSES, OnnxBackend, load_labels, preprocess_rgb
+from metrics import REGISTRY
+
+
+ENSEMBLE_MEMBERS_CONFIG = os.getenv('ENSEMBLE_MEMBERS_CONFIG', 'models/ensemble_members.json')
+
+# SkinCancerEnsemble.prepare_features appends age, gender and location
+ENSEMBLE_METADATA_FEATURES = 3
+
+MEMBER_DEFAULTS = {
+    'input_size': 224,
+    'channels_first': True,
+    'mean': [0.485, 0.456, 0.406],
+    'std': [0.229, 0.224, 0.225],
+    'labels': None
+}
+
+MEMBER_LATENCY = REGISTRY.histogram(
+    'skincare_ensemble_member_seconds', 'Forward pass time of each ensemble member model', ['model']
+)
+MEMBER_FAILURES = REGISTRY.counter(
+    'skincare_ensemble_member_failures_total', 'Ensemble member model failures', ['model']
+)
+POOL_LATENCY = REGISTRY.histogram(
+    'skincare_model_pool_seconds', 'Wall time to score one image with every ensemble member'
+)
+
+# Member sessions, loaded once per pool process by _init_process
+_SESSIONS = {}
+
+
+def load_member_config(path: str = ENSEMBLE_MEMBERS_CONFIG, n_features: int = None) -> List[Dict]:
+    """
+    Read the ensemble member list
+
+    The file holds {"members": [{"name", "path", ...}]}; optional per-member
+    keys are input_size, channels_first, mean, std and labels (a list or a
+    path to a JSON list). Members are fed to the ensemble in file order.
+
+    n_features, the XGBoost model's input width, is checked against the
+    member count (one probability per class per member plus metadata).
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    members = []
+    for member in config.get('members', []):
+        if 'name' not in member or 'path' not in member:
+            raise ValueError(f"Ensemble member needs 'name' and 'path': {member}")
+        members.append({**MEMBER_DEFAULTS, **member})
+    if not members:
+        raise ValueError(f"No ensemble members listed in {path}")
+
+    if n_features is not None:
+        expected = (n_features - ENSEMBLE_METADATA_FEATURES) / len(DEFAULT_CLASSES)
+        if len(members) != expected:
+            raise ValueError(
+                f"{path} lists {len(members)} ensemble members but the XGBoost ensemble expects "
+                f"{n_features} features ({expected:g} members x {len(DEFAULT_CLASSES)} classes "
+                f"+ {ENSEMBLE_METADATA_FEATURES} metadata)"
+            )
+    return members
+
+
+def _init_process(members: List[Dict], threads: int):
+    for member in members:
+        labels = member['labels']
+        if isinstance(labels, str):
+            labels = load_labels(labels)
+        _SESSIONS[member['name']] = OnnxBackend(
+            member['path'], labels=labels, mean=member['mean'], std=member['std'], threads=threads
+        )
+
+
+def _run_member(name: str, tensor: np.ndarray):
+    backend = _SESSIONS[name]
+    start = time.perf_counter()
+    probs = backend.run(tensor[np.newaxis])[0]
+    elapsed = time.perf_counter() - start
+    return dict(zip(backend.labels, (float(p) for p in probs))), elapsed
+
+
+class ModelPool:
+    """
+    Process pool in which every process holds all member sessions
+
+    predict_views() preprocesses each view once per distinct input spec in
+    the calling process, then scores every (view, member) pair in parallel on
+    the pool, so members run on separate cores without the GIL in the way.
+
+    Args:
+        members: Output of load_member_config()
+        processes: Pool size (defaults to one per member, capped at the CPU count)
+        threads_per_model: ONNX Runtime intra-op threads per session
+        timeout: Seconds to wait for all members of one call
+    """
+
+    def __init__(self, members: List[Dict], processes: int = None, threads_per_model: int = 1,
+                 timeout: float = 30.0):
+        self.members = members
+        self.processes = processes or min(len(members), os.cpu_count() or 1)
+        self.threads_per_model = threads_per_model
+        self.timeout = timeout
+        self._executor = self._start()
+
+    def _start(self) -> ProcessPoolExecutor:
+        # spawn: forking a process that already runs Flask/stage threads can deadlock
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_process,
+            initargs=(self.members, self.threads_per_model)
+        )
+
+    @staticmethod
+    def _input_spec(member: Dict):
+        return (member['input_size'], member['channels_first'], tuple(member['mean']), tuple(member['std']))
+
+    def predict_views(self, views) -> List[Dict[str, Dict[str, float]]]:
+        """
+        Score RGB views of one image (e.g. build_tta_views()) with every member
+
+        Returns:
+            Per view, in view order: {member name: {class: probability}} in
+            config order, classes in DEFAULT_CLASSES order (the layout
+            SkinCancerEnsemble was trained on)
+        """
+        start = time.perf_counter()
+        tensors = []
+        for rgb in views:
+            view_tensors = {}
+            for member in self.members:
+                spec = self._input_spec(member)
+                if spec not in view_tensors:
+                    size, channels_first, mean, std = spec
+                    view_tensors[spec] = preprocess_rgb(rgb, size, size, mean, std, channels_first)
+            tensors.append(view_tensors)
+
+        try:
+            futures = [
+                [
+                    (member['name'], self._executor.submit(_run_member, member['name'],
+                                                           view_tensors[self._input_spec(member)]))
+                    for member in self.members
+                ]
+                for view_tensors in tensors
+            ]
+        except BrokenProcessPool:
+            self._executor = self._start()
+            raise
+
+        rows = []
+        deadline = start + self.timeout
+        for view_futures in futures:
+            rows.append(self._collect(view_futures, deadline))
+
+        POOL_LATENCY.observe(time.perf_counter() - start)
+        return rows
+
+    def _collect(self, futures, deadline: float) -> Dict[str, Dict[str, float]]:
+        predictions = {}
+        for name, future in futures:
+            try:
+                probs, elapsed = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+            except BrokenProcessPool:
+                MEMBER_FAILURES.inc(model=name)
+                self._executor = self._start()
+                raise
+            except Exception:
+                MEMBER_FAILURES.inc(model=name)
+                raise
+            MEMBER_LATENCY.observe(elapsed, model=name)
+            predictions[name] = {cls: probs.get(cls, 0.0) for cls in DEFAULT_CLASSES}
+        return predictions
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_model_pool(config_path: str = ENSEMBLE_MEMBERS_CONFIG, n_features: int = None) -> Optional[ModelPool]:
+    """
+    ModelPool from the member config, or None when no config is present
+
+    Raises:
+        ValueError when the config is invalid or, given n_features, does not
+        match the ensemble's input width
+    """
+    if not os.path.exists(config_path):
+        print(f"⚠️ No ensemble member config at {config_path}, using simulated ensemble inputs")
+        return None
+
+    members = load_member_config(config_path, n_features=n_features)
+    pool = ModelPool(
+        members,
+        processes=int(os.getenv('MODEL_POOL_PROCESSES', '0')) or None,
+        threads_per_model=int(os.getenv('MODEL_POOL_THREADS_PER_MODEL', '1')),
+        timeout=float(os.getenv('MODEL_POOL_TIMEOUT', '30'))
+    )
+    print(f"✅ Ensemble model pool: {', '.join(m['name'] for m in members)} ({pool.processes} processes)")
+    return pool
@@ -0,0 +1,218 @@
+"""
+Perceptual-Hash Prediction Cache
+Reuses a classification for near-duplicate images (e.g. repeated phone
+captures of the same lesion) by matching difference hashes within a
+Hamming-distance tolerance
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from metrics import REGISTRY
+
+
+HASH_BITS = 64
+# The 64-bit hash is split into 8-bit bands for the on-disk index. Two hashes
+# within distance d < DISK_BANDS always share at least one band exactly
+DISK_BANDS = 8
+BAND_BITS = HASH_BITS // DISK_BANDS
+
+PREDICTION_CACHE_LOOKUPS = REGISTRY.counter(
+    'skincare_prediction_cache_lookups_total', 'Perceptual-hash prediction cache lookups', ['result']
+)
+PREDICTION_CACHE_DISTANCE = REGISTRY.histogram(
+    'skincare_prediction_cache_hit_distance', 'Hamming distance between an image and its cached match',
+    buckets=tuple(range(0, 17))
+)
+
+
+def dhash(rgb: np.ndarray) -> int:
+    """
+    64-bit difference hash of an RGB image
+
+    The image is reduced to a 9x8 grayscale thumbnail; each bit records
+    whether a pixel is brighter than its right neighbour, so the hash
+    survives re-encoding, resizing and small changes in exposure.
+    """
+    gray = rgb.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def _bands(value: int):
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (i * BAND_BITS)) & mask for i in range(DISK_BANDS)]
+
+
+class PredictionCache:
+    """
+    LRU cache of classifier outputs keyed on perceptual hash
+
+    Entries live in a scope (the owning user), and lookups only match
+    entries of the same scope, so one user's images can never be answered
+    with another user's classification. Within a scope lookups first try an
+    exact hash, then the nearest stored hash within `max_distance` bits. An optional SQLite file keeps entries across
+    restarts and worker processes; memory misses fall through to it and
+    disk hits are promoted back into memory.
+
+    Args:
+        max_distance: Largest Hamming distance treated as the same image; the
+                      disk index only finds matches below DISK_BANDS (8)
+        max_entries: In-memory LRU capacity
+        ttl_seconds: Entry lifetime (0 disables expiry)
+        disk_path: SQLite file for the on-disk tier, or None for memory only
+        namespace: Separates entries from different models in a shared disk file
+    """
+
+    def __init__(self, max_distance: int = 2, max_entries: int = 1024, ttl_seconds: float = 86400,
+                 disk_path: str = None, namespace: str = 'default'):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self.namespace = namespace
+        self._entries = OrderedDict()  # (scope, hash) -> (stored_at, prediction)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if disk_path:
+            if os.path.dirname(disk_path):
+                os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+            with closing(self._connect()) as conn, conn:
+                band_columns = ', '.join(f'b{i} INTEGER' for i in range(DISK_BANDS))
+                conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS prediction_cache ('
+                    f'namespace TEXT, hash TEXT, {band_columns}, prediction TEXT, stored_at REAL, '
+                    f'PRIMARY KEY (namespace, hash))'
+                )
+                for i in range(DISK_BANDS):
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS prediction_cache_b{i} ON prediction_cache (namespace, b{i})')
+
+    def _connect(self):
+        return sqlite3.connect(self.disk_path, timeout=5)
+
+    def _expired(self, stored_at: float) -> bool:
+        return bool(self.ttl_seconds) and time.time() - stored_at > self.ttl_seconds
+
+    def _disk_namespace(self, scope: str) -> str:
+        return f'{self.namespace}/{scope}'
+
+    def _lookup_memory(self, image_hash: int, scope: str) -> Optional[Tuple[int, Dict]]:
+        with self._lock:
+            entry = self._entries.get((scope, image_hash))
+            if entry is not None and not self._expired(entry[0]):
+                self._entries.move_to_end((scope, image_hash))
+                return 0, entry[1]
+
+            best = None
+            for (stored_scope, stored_hash), (stored_at, prediction) in self._entries.items():
+                if stored_scope != scope:
+                    continue
+                distance = hamming(image_hash, stored_hash)
+                if distance <= self.max_distance and not self._expired(stored_at):
+                    if best is None or distance < best[0]:
+                        best = (distance, stored_hash, prediction)
+            if best is None:
+                return None
+            self._entries.move_to_end((scope, best[1]))
+            return best[0], best[2]
+
+    def _lookup_disk(self, image_hash: int, scope: str) -> Optional[Tuple[int, Dict]]:
+        if not self.disk_path:
+            return None
+        bands = _bands(image_hash)
+        where = ' OR '.join(f'b{i} = ?' for i in range(DISK_BANDS))
+        with closing(self._connect()) as conn, conn:
+            rows = conn.execute(
+                f'SELECT hash, prediction, stored_at FROM prediction_cache WHERE namespace = ? AND ({where})',
+                [self._disk_namespace(scope)] + bands
+            ).fetchall()
+
+        best = None
+        for stored_hex, prediction, stored_at in rows:
+            distance = hamming(image_hash, int(stored_hex, 16))
+            if distance <= self.max_distance and not self._expired(stored_at):
+                if best is None or distance < best[0]:
+                    best = (distance, json.loads(prediction))
+        return best
+
+    def get(self, image_hash: int, scope) -> Optional[Dict]:
+        """Return the cached prediction for this hash or a near neighbour in scope, or None"""
+        scope = str(scope)
+        match = self._lookup_memory(image_hash, scope)
+        tier = 'memory'
+        if match is None:
+            try:
+                match = self._lookup_disk(image_hash, scope)
+            except sqlite3.Error as e:
+                print(f"⚠️ Prediction cache disk lookup failed: {e}")
+                match = None
+            tier = 'disk'
+            if match is not None:
+                self._put_memory(image_hash, scope, match[1])
+
+        with self._lock:
+            if match is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if match is None:
+            PREDICTION_CACHE_LOOKUPS.inc(result='miss')
+            return None
+
+        PREDICTION_CACHE_LOOKUPS.inc(result=f'hit_{tier}')
+        PREDICTION_CACHE_DISTANCE.observe(match[0])
+        return match[1]
+
+    def _put_memory(self, image_hash: int, scope: str, prediction: Dict):
+        with self._lock:
+            self._entries[(scope, image_hash)] = (time.time(), prediction)
+            self._entries.move_to_end((scope, image_hash))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def put(self, image_hash: int, prediction: Dict, scope):
+        """Store a prediction for scope in memory and, when configured, on disk"""
+        scope = str(scope)
+        self._put_memory(image_hash, scope, prediction)
+        if not self.disk_path:
+            return
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    f'INSERT OR REPLACE INTO prediction_cache VALUES (?, ?, {", ".join("?" * DISK_BANDS)}, ?, ?)',
+                    [self._disk_namespace(scope), f'{image_hash:016x}'] + _bands(image_hash) + [json.dumps(prediction), time.time()]
+                )
+        except sqlite3.Error as e:
+            print(f"⚠️ Prediction cache disk write failed: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'max_distance': self.max_distance,
+                'disk_tier': bool(self.disk_path)
+            }
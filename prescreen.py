@@ -0,0 +1,99 @@
+"""
+Local Pre-Screen for Uploaded Images
+Cheap skin-tone, blur and exposure checks that reject obvious non-lesion
+images before the remote classifier is called
+"""
+
+import os
+from typing import Dict
+
+import cv2
+import numpy as np
+
+from metrics import REGISTRY, stage_timer
+
+
+# Thresholds (all measured on the downscaled copy)
+PRESCREEN_ENABLED = os.getenv('PRESCREEN_ENABLED', 'true').lower() == 'true'
+PRESCREEN_MAX_SIDE = int(os.getenv('PRESCREEN_MAX_SIDE', '128'))
+MIN_SKIN_RATIO = float(os.getenv('PRESCREEN_MIN_SKIN_RATIO', '0.15'))
+MIN_SHARPNESS = float(os.getenv('PRESCREEN_MIN_SHARPNESS', '8.0'))
+MIN_BRIGHTNESS = float(os.getenv('PRESCREEN_MIN_BRIGHTNESS', '25'))
+MAX_BRIGHTNESS = float(os.getenv('PRESCREEN_MAX_BRIGHTNESS', '240'))
+MAX_CLIPPED_RATIO = float(os.getenv('PRESCREEN_MAX_CLIPPED_RATIO', '0.5'))
+
+# Skin chrominance range in YCrCb; holds across skin tones because it ignores luma
+SKIN_CR_RANGE = (133, 173)
+SKIN_CB_RANGE = (77, 127)
+
+THRESHOLDS = {
+    'min_skin_ratio': MIN_SKIN_RATIO,
+    'min_sharpness': MIN_SHARPNESS,
+    'min_brightness': MIN_BRIGHTNESS,
+    'max_brightness': MAX_BRIGHTNESS,
+    'max_clipped_ratio': MAX_CLIPPED_RATIO
+}
+
+PRESCREEN_RESULTS = REGISTRY.counter(
+    'skincare_prescreen_total', 'Local pre-screen outcomes', ['result']
+)
+REGISTRY.callback_gauge(
+    'skincare_prescreen_threshold', 'Configured local pre-screen thresholds',
+    lambda: {(name,): value for name, value in THRESHOLDS.items()}, ['name']
+)
+
+
+def compute_image_stats(rgb: np.ndarray) -> Dict[str, float]:
+    """
+    Skin ratio, sharpness and exposure statistics of an RGB image
+
+    Works on a copy downscaled to PRESCREEN_MAX_SIDE so the cost is
+    independent of the upload resolution.
+    """
+    height, width = rgb.shape[:2]
+    scale = PRESCREEN_MAX_SIDE / max(height, width)
+    if scale < 1:
+        rgb = cv2.resize(rgb, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+    ycrcb = cv2.cvtColor(rgb, cv2.COLOR_RGB2YCrCb)
+    luma = ycrcb[:, :, 0]
+    cr = ycrcb[:, :, 1]
+    cb = ycrcb[:, :, 2]
+
+    skin_mask = (
+        (cr >= SKIN_CR_RANGE[0]) & (cr <= SKIN_CR_RANGE[1]) &
+        (cb >= SKIN_CB_RANGE[0]) & (cb <= SKIN_CB_RANGE[1])
+    )
+
+    return {
+        'skin_ratio': float(skin_mask.mean()),
+        'sharpness': float(cv2.Laplacian(luma, cv2.CV_64F).var()),
+        'brightness': float(luma.mean()),
+        'clipped_ratio': float(((luma <= 5) | (luma >= 250)).mean())
+    }
+
+
+def prescreen_image(rgb: np.ndarray) -> Dict:
+    """
+    Decide whether an image is worth sending to the classifier
+
+    Returns:
+        {'passed': bool, 'reason': None | 'not_skin' | 'blurry' | 'underexposed' | 'overexposed',
+         'stats': compute_image_stats() output}
+    """
+    with stage_timer('prescreen'):
+        stats = compute_image_stats(rgb)
+
+    if stats['brightness'] < MIN_BRIGHTNESS:
+        reason = 'underexposed'
+    elif stats['brightness'] > MAX_BRIGHTNESS or stats['clipped_ratio'] > MAX_CLIPPED_RATIO:
+        reason = 'overexposed'
+    elif stats['sharpness'] < MIN_SHARPNESS:
+        reason = 'blurry'
+    elif stats['skin_ratio'] < MIN_SKIN_RATIO:
+        reason = 'not_skin'
+    else:
+        reason = None
+
+    PRESCREEN_RESULTS.inc(result=reason or 'pass')
+    return {'passed': reason is None, 'reason': reason, 'stats': stats}
@@ -0,0 +1,241 @@
+"""
+Resilience Helpers for Remote Calls
+Circuit breaker that fails fast while a dependency is unhealthy, and request
+hedging that races a second attempt against a slow first one
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict
+
+from metrics import REGISTRY
+
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = REGISTRY.gauge(
+    'skincare_circuit_breaker_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)', ['breaker']
+)
+BREAKER_TRANSITIONS = REGISTRY.counter(
+    'skincare_circuit_breaker_transitions_total', 'Circuit breaker state changes', ['breaker', 'state']
+)
+BREAKER_REJECTED = REGISTRY.counter(
+    'skincare_circuit_breaker_rejected_total', 'Calls rejected without being attempted', ['breaker']
+)
+HEDGED_CALLS = REGISTRY.counter(
+    'skincare_hedged_calls_total', 'Hedged requests by outcome (fired, won, lost)', ['target', 'outcome']
+)
+CALL_TIMEOUTS = REGISTRY.counter(
+    'skincare_call_timeouts_total', 'Calls abandoned after their overall deadline', ['target']
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a dependency whose circuit is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} circuit open; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Sliding-window circuit breaker
+
+    Trips to open when, over the last `window_size` calls (and at least
+    `min_calls`), the failure rate reaches `failure_rate` or the share of
+    calls slower than `slow_call_seconds` reaches `slow_call_rate`. After
+    `open_seconds` it lets `half_open_calls` trial calls through: if they all
+    succeed the circuit closes, any failure re-opens it.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, slow_call_seconds: float = 10.0,
+                 slow_call_rate: float = 0.8, window_size: int = 20, min_calls: int = 10,
+                 open_seconds: float = 30.0, half_open_calls: int = 3):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._window = deque(maxlen=window_size)  # (failed, slow) per call
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trials_started = 0
+        self._trials_succeeded = 0
+        BREAKER_STATE.set(STATE_VALUES[CLOSED], breaker=name)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def _transition(self, state: str):
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state in (OPEN, HALF_OPEN):
+            self._trials_started = 0
+            self._trials_succeeded = 0
+        if state == CLOSED:
+            self._window.clear()
+        BREAKER_STATE.set(STATE_VALUES[state], breaker=self.name)
+        BREAKER_TRANSITIONS.inc(breaker=self.name, state=state)
+        print(f"⚠️ Circuit breaker {self.name} -> {state}")
+
+    def allow(self):
+        """Raise CircuitOpenError if the call must not be attempted"""
+        with self._lock:
+            if self._state == OPEN:
+                remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+                if remaining > 0:
+                    BREAKER_REJECTED.inc(breaker=self.name)
+                    raise CircuitOpenError(self.name, remaining)
+                self._transition(HALF_OPEN)
+
+            if self._state == HALF_OPEN:
+                if self._trials_started >= self.half_open_calls:
+                    BREAKER_REJECTED.inc(breaker=self.name)
+                    raise CircuitOpenError(self.name, 1.0)
+                self._trials_started += 1
+
+    def record(self, duration: float, failed: bool):
+        """Report the outcome of an allowed call"""
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN)
+                else:
+                    self._trials_succeeded += 1
+                    if self._trials_succeeded >= self.half_open_calls:
+                        self._transition(CLOSED)
+                return
+
+            if self._state != CLOSED:
+                return
+
+            self._window.append((failed, slow))
+            calls = len(self._window)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for f, _ in self._window if f)
+            slow_calls = sum(1 for _, s in self._window if s)
+            if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate:
+                self._transition(OPEN)
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Run fn through the breaker"""
+        self.allow()
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record(time.monotonic() - start, failed=True)
+            raise
+        self.record(time.monotonic() - start, failed=False)
+        return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            calls = len(self._window)
+            return {
+                'state': self._state,
+                'window_calls': calls,
+                'window_failures': sum(1 for f, _ in self._window if f),
+                'window_slow_calls': sum(1 for _, s in self._window if s)
+            }
+
+
+class Hedger:
+    """
+    Sends a second copy of a slow request and keeps whichever finishes first
+
+    The hedge fires once the first attempt has run longer than the
+    `quantile` of recent successful latencies (`initial_delay` until
+    `min_samples` have been seen). At most `max_ratio` of calls are hedged
+    so an overloaded dependency is not hit with twice the traffic. The
+    caller gives up after `timeout` seconds.
+    """
+
+    def __init__(self, target: str, quantile: float = 0.95, initial_delay: float = 1.0,
+                 min_delay: float = 0.05, min_samples: int = 20, max_ratio: float = 0.1,
+                 timeout: float = 30.0, max_workers: int = 16, enabled: bool = True):
+        self.target = target
+        self.quantile = quantile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self.timeout = timeout
+        self.enabled = enabled
+        self._latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._hedges = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{target}-hedge')
+
+    def hedge_delay(self) -> float:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, samples[int(self.quantile * (len(samples) - 1))])
+
+    def _may_hedge(self) -> bool:
+        with self._lock:
+            if not self.enabled or self._hedges >= self.max_ratio * self._calls:
+                return False
+            self._hedges += 1
+            return True
+
+    def _timed(self, fn, *args):
+        start = time.monotonic()
+        result = fn(*args)
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return result
+
+    def call(self, fn: Callable, *args):
+        """
+        Run fn(*args), hedging if it is slow
+
+        Raises:
+            TimeoutError if no attempt finished within `timeout`, otherwise
+            the first attempt's exception when every attempt failed
+        """
+        with self._lock:
+            self._calls += 1
+        deadline = time.monotonic() + self.timeout
+        primary = self._executor.submit(self._timed, fn, *args)
+        pending = {primary}
+
+        done, _ = wait(pending, timeout=min(self.hedge_delay(), self.timeout))
+        if not done and self._may_hedge():
+            HEDGED_CALLS.inc(target=self.target, outcome='fired')
+            pending.add(self._executor.submit(self._timed, fn, *args))
+
+        first_error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        HEDGED_CALLS.inc(target=self.target, outcome='won')
+                    elif pending:
+                        HEDGED_CALLS.inc(target=self.target, outcome='lost')
+                    return future.result()
+                first_error = first_error or future.exception()
+
+        if first_error is not None and not pending:
+            raise first_error
+        CALL_TIMEOUTS.inc(target=self.target)
+        raise TimeoutError(f"{self.target} call exceeded {self.timeout:g}s")
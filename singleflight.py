@@ -0,0 +1,129 @@
+"""
+Single-Flight Call Coalescing
+Concurrent callers asking for the same key share one execution of the
+underlying call instead of each sending an identical upstream request
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import REGISTRY
+
+
+SINGLEFLIGHT_CALLS = REGISTRY.counter(
+    'skincare_singleflight_calls_total', 'Calls through a single-flight group by role', ['group', 'role']
+)
+SINGLEFLIGHT_FOLLOWER_TIMEOUTS = REGISTRY.counter(
+    'skincare_singleflight_follower_timeouts_total', 'Followers that stopped waiting for the shared call', ['group']
+)
+SINGLEFLIGHT_IN_FLIGHT = REGISTRY.gauge(
+    'skincare_singleflight_in_flight', 'Distinct keys currently being executed', ['group']
+)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.result = None
+        self.error = None
+        self.deltas: List[str] = []
+        self.subscribers: List[Callable[[str], None]] = []
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with equal keys
+
+    The first caller for a key (the leader) runs fn; callers arriving while
+    it runs (followers) wait for it and get the same result or exception.
+    fn receives a publish(delta) callback: streamed pieces are passed to the
+    leader's and every follower's on_token, and followers that join late
+    first get the pieces they missed. Nothing is kept once the call ends.
+
+    Args:
+        name: Label for this group's metrics
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        SINGLEFLIGHT_IN_FLIGHT.set(0, group=name)
+
+    def do(self, key: str, fn: Callable[[Callable[[str], None]], Any],
+           on_token: Optional[Callable[[str], None]] = None, timeout: float = None) -> Any:
+        """
+        Run fn(publish) once per key among concurrent callers
+
+        Args:
+            timeout: Longest a follower waits for the shared call (the leader
+                     is bounded by fn itself); None waits for it to finish
+
+        Returns:
+            fn's result (shared by every caller of this flight)
+
+        Raises:
+            TimeoutError when a follower's timeout passes first
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                SINGLEFLIGHT_IN_FLIGHT.set(len(self._calls), group=self.name)
+            else:
+                self.coalesced += 1
+        SINGLEFLIGHT_CALLS.inc(group=self.name, role='leader' if leader else 'follower')
+
+        if on_token:
+            with call.lock:
+                for delta in call.deltas:
+                    on_token(delta)
+                call.subscribers.append(on_token)
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with call.lock:
+                    if on_token in call.subscribers:
+                        call.subscribers.remove(on_token)
+                SINGLEFLIGHT_FOLLOWER_TIMEOUTS.inc(group=self.name)
+                raise TimeoutError(f"Shared call for {self.name} still running after {timeout:g}s")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        def publish(delta: str):
+            with call.lock:
+                call.deltas.append(delta)
+                subscribers = list(call.subscribers)
+            for subscriber in subscribers:
+                try:
+                    subscriber(delta)
+                except Exception as e:
+                    print(f"⚠️ Single-flight subscriber failed: {e}")
+
+        try:
+            call.result = fn(publish)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                SINGLEFLIGHT_IN_FLIGHT.set(len(self._calls), group=self.name)
+            call.done.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            calls = self.leaders + self.coalesced
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'coalesced_rate': round(self.coalesced / calls, 4) if calls else 0.0
+            }
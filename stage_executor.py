@@ -0,0 +1,71 @@
+"""
+Stage Executor for the Analysis Pipeline
+Runs independent pipeline stages concurrently on a bounded thread pool
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Optional
+
+
+class StageExecutor:
+    """
+    Runs named, independent pipeline stages concurrently
+
+    A single executor is shared by all requests in a process, so max_workers
+    bounds the total number of stages in flight, not just per request.
+    Stages named in dedicated_workers run on their own pool of that size, so
+    a stage that mostly waits (e.g. on a remote LLM) cannot queue the others.
+    A failing stage never cancels its siblings; its result is the default.
+    """
+
+    def __init__(self, max_workers: int = 4, thread_name_prefix: str = 'stage',
+                 dedicated_workers: Optional[Dict[str, int]] = None):
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.dedicated = {
+            name: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{thread_name_prefix}-{name}')
+            for name, workers in (dedicated_workers or {}).items()
+        }
+
+    def run(self,
+            stages: Dict[str, Callable[[], Any]],
+            on_complete: Optional[Callable[[str, Any], None]] = None,
+            defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Run all stages and wait for every one of them
+
+        Args:
+            stages: Mapping of stage name to zero-argument callable
+            on_complete: Optional callback(stage_name, result), called from the
+                         caller's thread in completion order
+            defaults: Result to use for a stage that raised (None if missing)
+
+        Returns:
+            Mapping of stage name to result
+        """
+        defaults = defaults or {}
+        results = {}
+        started = time.perf_counter()
+
+        futures = {self.dedicated.get(name, self.pool).submit(fn): name for name, fn in stages.items()}
+
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                print(f"⚠️ Stage '{name}' failed: {e}")
+                results[name] = defaults.get(name)
+
+            if on_complete:
+                on_complete(name, results[name])
+
+        print(f"⏱️ Stages {', '.join(stages)} finished in {time.perf_counter() - started:.2f}s")
+        return results
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting new stages"""
+        self.pool.shutdown(wait=wait)
+        for pool in self.dedicated.values():
+            pool.shutdown(wait=wait)
@@ -0,0 +1,205 @@
+"""
+Local Stand-In for Hosted Services
+Small HTTP server that mimics Roboflow's hosted classify endpoint and an
+OpenAI-compatible chat completions endpoint, so the hosted inference client
+and the LLM advice path can be exercised without network access or API keys.
+
+Usage:
+    python standin_server.py                              # http://127.0.0.1:9100
+    python standin_server.py --latency 0.2 --jitter 0.1   # simulate a slow model
+    python standin_server.py --failure-rate 0.2           # 20% of calls return 503
+    python standin_server.py --slow-rate 0.05 --slow-latency 5   # 5% tail of 5s calls
+
+Then run the app with:
+    INFERENCE_BACKEND=hosted HOSTED_INFERENCE_URL=http://127.0.0.1:9100
+    GROQ_BASE_URL=http://127.0.0.1:9100    # advice from the stand-in as well
+"""
+
+import io
+import re
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import Image
+
+from inference_backend import DEFAULT_CLASSES
+
+
+def fake_classification(image_bytes: bytes) -> dict:
+    """Deterministic multi-label style response: the same image always gets the same scores"""
+    seed = int.from_bytes(hashlib.sha256(image_bytes).digest()[:4], 'big')
+    scores = np.random.default_rng(seed).dirichlet(np.ones(len(DEFAULT_CLASSES)) * 0.3)
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            width, height = img.size
+    except Exception:
+        width, height = 0, 0
+
+    top = DEFAULT_CLASSES[int(np.argmax(scores))]
+    return {
+        'predictions': {
+            name: {'class_id': i, 'confidence': round(float(score), 4)}
+            for i, (name, score) in enumerate(zip(DEFAULT_CLASSES, scores))
+        },
+        'predicted_classes': [top],
+        'image': {'width': width, 'height': height}
+    }
+
+
+def prompt_field(prompt: str, label: str, default: str = '') -> str:
+    match = re.search(rf'{label}:\s*(.+)', prompt)
+    return match.group(1).strip() if match else default
+
+
+def fake_advice(messages: list) -> str:
+    """Markdown advice in the requested sections, echoing the prompt's patient fields (and placeholders)"""
+    prompt = messages[-1].get('content', '') if messages else ''
+    name = prompt_field(prompt, 'Name', 'the patient')
+    condition = prompt_field(prompt, 'Condition', 'an unknown condition')
+    confidence = prompt_field(prompt, 'Confidence', 'unknown').split(' (')[0]
+    severity = prompt_field(prompt, 'Risk Level', 'Unknown')
+    description = prompt_field(prompt, 'Description', 'Consult a healthcare professional')
+    return (
+        f"## 📋 Condition Overview\n"
+        f"The model's result for {name} is **{condition}** with {confidence} confidence. "
+        f"{description}. Risk level: {severity}.\n\n"
+        f"## ⚠️ Important Precautions\n"
+        f"- See a dermatologist to confirm this result\n"
+        f"- Watch for changes in size, shape or colour\n"
+        f"- Use sun protection every day\n\n"
+        f"*This is not a medical diagnosis.*"
+    )
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Keep connections open so clients can exercise connection reuse
+    protocol_version = 'HTTP/1.1'
+    options = None
+
+    def send_json(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        options = self.options
+
+        delay = options.latency + random.uniform(0, options.jitter)
+        if random.random() < options.slow_rate:
+            delay += options.slow_latency
+        if delay:
+            time.sleep(delay)
+
+        if random.random() < options.failure_rate:
+            self.send_json(503, {'error': 'Simulated outage'})
+            return
+
+        if self.path.split('?')[0].endswith('/chat/completions'):
+            self.chat_completion(json.loads(body or b'{}'))
+            return
+
+        try:
+            image_bytes = base64.b64decode(body)
+        except ValueError:
+            self.send_json(400, {'error': 'Body must be a base64-encoded image'})
+            return
+
+        self.send_json(200, fake_classification(image_bytes))
+
+    def chat_completion(self, request: dict):
+        text = fake_advice(request.get('messages', []))
+        model = request.get('model', 'standin')
+        base = {'id': f'chatcmpl-{random.getrandbits(48):012x}', 'created': int(time.time()), 'model': model}
+        # Rough token counts in the provider's usage format
+        prompt_tokens = sum(len(m.get('content') or '') for m in request.get('messages', [])) // 4
+        completion_tokens = len(text) // 4
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                 'total_tokens': prompt_tokens + completion_tokens}
+
+        if not request.get('stream'):
+            self.send_json(200, {
+                **base,
+                'object': 'chat.completion',
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+                'usage': usage
+            })
+            return
+
+        # Server-sent events, one chunk per word, delimited by closing the connection
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        pieces = re.findall(r'\S+\s*', text)
+        for i, piece in enumerate(pieces + [None]):
+            chunk = {
+                **base,
+                'object': 'chat.completion.chunk',
+                'choices': [{
+                    'index': 0,
+                    'delta': {'content': piece} if piece is not None else {},
+                    'finish_reason': 'stop' if piece is None else None
+                }]
+            }
+            if piece is None:
+                # Groq reports usage on the final chunk
+                chunk['x_groq'] = {'id': base['id'], 'usage': usage}
+            self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+            if self.options.token_delay and piece is not None:
+                self.wfile.flush()
+                time.sleep(self.options.token_delay)
+        self.wfile.write(b'data: [DONE]\n\n')
+
+    def log_message(self, format, *args):
+        if not self.options.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=9100, latency=0.0, jitter=0.0, failure_rate=0.0,
+                slow_rate=0.0, slow_latency=0.0, quiet=False, token_delay=0.0):
+    """Build (but don't start) a stand-in server; port 0 picks a free port"""
+    options = argparse.Namespace(latency=latency, jitter=jitter, failure_rate=failure_rate,
+                                 slow_rate=slow_rate, slow_latency=slow_latency, quiet=quiet,
+                                 token_delay=token_delay)
+    handler = type('ConfiguredStandInHandler', (StandInHandler,), {'options': options})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for hosted inference and LLM services')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=0.0, help='Base response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random delay up to this many seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of calls answered with 503')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='Fraction of calls delayed by --slow-latency')
+    parser.add_argument('--slow-latency', type=float, default=0.0, help='Extra delay for slow calls (tail latency)')
+    parser.add_argument('--quiet', action='store_true', help='Disable per-request logging')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='Delay between streamed LLM tokens')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.jitter, args.failure_rate,
+                         args.slow_rate, args.slow_latency, args.quiet, args.token_delay)
+    print(f"✅ Stand-in server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("🛑 Stand-in server stopping")
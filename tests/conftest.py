@@ -0,0 +1,28 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from standin_server import make_server
+
+
+@pytest.fixture
+def standin():
+    """Start stand-in servers on free ports: standin(**make_server options) -> base URL"""
+    servers = []
+
+    def start(**options):
+        server = make_server(port=0, quiet=True, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        host, port = server.server_address
+        return f'http://{host}:{port}'
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,64 @@
+import base64
+import time
+
+import pytest
+import requests
+
+from http_client import HTTP_CLIENT_FAILURES, HTTP_CLIENT_RETRIES, PooledHttpClient
+
+
+PAYLOAD = base64.b64encode(b'not really an image')
+
+
+def make_client(base_url, target, **options):
+    options.setdefault('backoff_base', 0.01)
+    options.setdefault('backoff_max', 0.05)
+    return PooledHttpClient(base_url, target=target, pool_size=2, **options)
+
+
+def test_classifies_against_standin(standin):
+    client = make_client(standin(), 'test_ok')
+    try:
+        response = client.post('/project/1', data=PAYLOAD)
+    finally:
+        client.close()
+
+    assert response.status_code == 200
+    assert response.json()['predicted_classes']
+    assert HTTP_CLIENT_RETRIES.value(target='test_ok', reason='503') == 0
+
+
+def test_5xx_is_retried_then_returned(standin):
+    client = make_client(standin(failure_rate=1.0), 'test_5xx', max_retries=2)
+    try:
+        response = client.post('/project/1', data=PAYLOAD)
+    finally:
+        client.close()
+
+    assert response.status_code == 503
+    assert HTTP_CLIENT_RETRIES.value(target='test_5xx', reason='503') == 2
+    assert HTTP_CLIENT_FAILURES.value(target='test_5xx', reason='503') == 1
+
+
+def test_slow_response_times_out_after_retries(standin):
+    client = make_client(standin(latency=1.0), 'test_slow', read_timeout=0.2, max_retries=1)
+    start = time.monotonic()
+    try:
+        with pytest.raises(requests.Timeout):
+            client.post('/project/1', data=PAYLOAD)
+    finally:
+        client.close()
+
+    assert time.monotonic() - start < 1.0
+    assert HTTP_CLIENT_RETRIES.value(target='test_slow', reason='timeout') == 1
+    assert HTTP_CLIENT_FAILURES.value(target='test_slow', reason='timeout') == 1
+
+
+def test_retry_after_caps_backoff():
+    client = PooledHttpClient('http://127.0.0.1:1', target='test_backoff', backoff_max=2.0)
+    try:
+        assert client.backoff(0, retry_after='1.5') == 1.5
+        assert client.backoff(0, retry_after='60') == 2.0
+        assert 0 <= client.backoff(3) <= 2.0
+    finally:
+        client.close()
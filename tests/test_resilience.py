@@ -0,0 +1,134 @@
+import base64
+import itertools
+import time
+
+import pytest
+
+from http_client import PooledHttpClient
+from resilience import CLOSED, HALF_OPEN, OPEN, HEDGED_CALLS, CircuitBreaker, CircuitOpenError, Hedger
+
+
+PAYLOAD = base64.b64encode(b'not really an image')
+
+
+@pytest.fixture
+def client_for():
+    """client_for(base_url) -> PooledHttpClient without retries, closed after the test"""
+    clients = []
+
+    def make(base_url):
+        client = PooledHttpClient(base_url, target='test_resilience', max_retries=0, read_timeout=5)
+        clients.append(client)
+        return client
+
+    yield make
+
+    for client in clients:
+        client.close()
+
+
+def classify(client):
+    response = client.post('/project/1', data=PAYLOAD)
+    response.raise_for_status()
+    return response.json()
+
+
+def make_breaker(**options):
+    defaults = dict(failure_rate=0.5, slow_call_seconds=5.0, slow_call_rate=0.8, window_size=4,
+                    min_calls=4, open_seconds=0.2, half_open_calls=2)
+    return CircuitBreaker('test', **{**defaults, **options})
+
+
+def test_breaker_opens_on_5xx_and_fails_fast(standin, client_for):
+    client = client_for(standin(failure_rate=1.0))
+    breaker = make_breaker()
+
+    for _ in range(4):
+        with pytest.raises(Exception):
+            breaker.call(classify, client)
+
+    assert breaker.state == OPEN
+    start = time.monotonic()
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.call(classify, client)
+    assert time.monotonic() - start < 0.05
+    assert excinfo.value.retry_after > 0
+
+
+def test_breaker_opens_on_slow_calls(standin, client_for):
+    client = client_for(standin(latency=0.15))
+    breaker = make_breaker(slow_call_seconds=0.1, slow_call_rate=0.5)
+
+    for _ in range(4):
+        breaker.call(classify, client)
+
+    assert breaker.state == OPEN
+
+
+def test_breaker_half_open_closes_after_successful_trials(standin, client_for):
+    failing = client_for(standin(failure_rate=1.0))
+    healthy = client_for(standin())
+    breaker = make_breaker()
+
+    for _ in range(4):
+        with pytest.raises(Exception):
+            breaker.call(classify, failing)
+    assert breaker.state == OPEN
+
+    time.sleep(0.25)
+    breaker.call(classify, healthy)
+    assert breaker.state == HALF_OPEN
+    breaker.call(classify, healthy)
+    assert breaker.state == CLOSED
+    assert breaker.stats()['window_calls'] == 0
+
+
+def test_breaker_half_open_reopens_on_failure(standin, client_for):
+    failing = client_for(standin(failure_rate=1.0))
+    breaker = make_breaker()
+
+    for _ in range(4):
+        with pytest.raises(Exception):
+            breaker.call(classify, failing)
+
+    time.sleep(0.25)
+    with pytest.raises(Exception):
+        breaker.call(classify, failing)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(classify, failing)
+
+
+def test_hedge_wins_against_slow_primary(standin, client_for):
+    slow = client_for(standin(latency=2.0))
+    fast = client_for(standin())
+    attempts = itertools.count()
+    hedger = Hedger('test_hedge_win', initial_delay=0.1, max_ratio=1.0, timeout=5.0)
+
+    def classify_next():
+        # The first attempt hits the slow stand-in, the hedge the fast one
+        return classify(slow if next(attempts) == 0 else fast)
+
+    start = time.monotonic()
+    result = hedger.call(classify_next)
+
+    assert result['predicted_classes']
+    assert time.monotonic() - start < 1.0
+    assert HEDGED_CALLS.value(target='test_hedge_win', outcome='fired') == 1
+    assert HEDGED_CALLS.value(target='test_hedge_win', outcome='won') == 1
+
+
+def test_hedge_not_fired_for_fast_calls(standin, client_for):
+    client = client_for(standin())
+    hedger = Hedger('test_hedge_fast', initial_delay=1.0, max_ratio=1.0, timeout=5.0)
+
+    assert hedger.call(classify, client)['predicted_classes']
+    assert HEDGED_CALLS.value(target='test_hedge_fast', outcome='fired') == 0
+
+
+def test_hedger_times_out(standin, client_for):
+    client = client_for(standin(latency=1.0))
+    hedger = Hedger('test_hedge_timeout', initial_delay=0.05, max_ratio=0.0, timeout=0.3)
+
+    with pytest.raises(TimeoutError):
+        hedger.call(classify, client)
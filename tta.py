@@ -0,0 +1,108 @@
+"""
+Test-Time Augmentation for Uncertainty Estimation
+Builds flipped, rotated and cropped views of an image as one batch and
+classifies them in a single backend call; the spread of the per-view
+probabilities is a real measure of how stable the prediction is
+"""
+
+import os
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from image_ingest import IngestedImage, MODEL_INPUT_SIZE
+from inference_backend import DEFAULT_CLASSES
+from metrics import stage_timer
+
+
+TTA_NUM_VIEWS = int(os.getenv('TTA_NUM_VIEWS', '9'))
+TTA_CROP_FRACTION = float(os.getenv('TTA_CROP_FRACTION', '0.9'))
+
+# Views in the order they are generated; the first TTA_NUM_VIEWS are used
+VIEW_NAMES = ('identity', 'hflip', 'vflip', 'rot90', 'rot180', 'rot270', 'crop_center', 'crop_tl', 'crop_br')
+
+# The ensemble was trained on three model outputs per feature row
+VIEWS_PER_ROW = 3
+
+
+def square_base(rgb: np.ndarray, size: int = MODEL_INPUT_SIZE) -> np.ndarray:
+    """Resize the longest side to `size` and reflect-pad to a square, keeping the whole lesion"""
+    height, width = rgb.shape[:2]
+    scale = size / max(height, width)
+    resized = cv2.resize(rgb, (max(1, round(width * scale)), max(1, round(height * scale))),
+                         interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    pad_h = size - resized.shape[0]
+    pad_w = size - resized.shape[1]
+    return cv2.copyMakeBorder(resized, pad_h // 2, pad_h - pad_h // 2, pad_w // 2, pad_w - pad_w // 2,
+                              cv2.BORDER_REFLECT)
+
+
+def build_tta_views(rgb: np.ndarray, num_views: int = TTA_NUM_VIEWS,
+                    crop_fraction: float = TTA_CROP_FRACTION, size: int = MODEL_INPUT_SIZE) -> np.ndarray:
+    """
+    Augmented views of an RGB image as one (num_views, size, size, 3) uint8 batch
+    """
+    base = square_base(rgb, size)
+    crop = max(1, int(size * crop_fraction))
+    offset = (size - crop) // 2
+
+    def resize_crop(y, x):
+        return cv2.resize(base[y:y + crop, x:x + crop], (size, size), interpolation=cv2.INTER_LINEAR)
+
+    builders = (
+        lambda: base,
+        lambda: base[:, ::-1],
+        lambda: base[::-1, :],
+        lambda: np.rot90(base, 1),
+        lambda: np.rot90(base, 2),
+        lambda: np.rot90(base, 3),
+        lambda: resize_crop(offset, offset),
+        lambda: resize_crop(0, 0),
+        lambda: resize_crop(size - crop, size - crop),
+    )
+    num_views = max(1, min(num_views, len(builders)))
+    return np.stack([np.ascontiguousarray(build()) for build in builders[:num_views]])
+
+
+def class_probabilities(prediction: Dict, classes: List[str] = DEFAULT_CLASSES) -> Dict[str, float]:
+    """Backend prediction -> {class: probability} in the fixed class order the ensemble expects"""
+    all_preds = prediction['all_predictions']
+    return {cls: float(all_preds.get(cls, {}).get('confidence', 0.0)) for cls in classes}
+
+
+def tta_predictions(backend, image, num_views: int = TTA_NUM_VIEWS) -> List[Dict[str, float]]:
+    """
+    Classify the augmented views of an image with one batched backend call
+
+    Args:
+        backend: InferenceBackend (predict_batch is called once)
+        image: IngestedImage or anything with an `rgb` array
+
+    Returns:
+        Per-view class probabilities; views the backend failed on are left out
+    """
+    with stage_timer('tta_views'):
+        views = [IngestedImage.from_rgb(view) for view in build_tta_views(image.rgb, num_views)]
+
+    with stage_timer('tta_inference'):
+        results = backend.predict_batch(views)
+
+    return [class_probabilities(r) for r in results if r and not isinstance(r, Exception)]
+
+
+def views_to_model_rows(per_view: List[Dict[str, float]]) -> Optional[List[Dict[str, Dict[str, float]]]]:
+    """
+    Group per-view probabilities into ensemble inputs of VIEWS_PER_ROW views each
+
+    Returns:
+        List of predictions_dict for SkinCancerEnsemble.prepare_features(), or
+        None if there are not enough views for a single row
+    """
+    rows = len(per_view) // VIEWS_PER_ROW
+    if rows == 0:
+        return None
+    return [
+        {f'view_{i}': per_view[row * VIEWS_PER_ROW + i] for i in range(VIEWS_PER_ROW)}
+        for row in range(rows)
+    ]
@@ -0,0 +1,190 @@
+"""
+Analysis Job Worker
+Consumes queued jobs from the AnalysisJob table and runs the analysis pipeline
+outside of the web process.
+
+Usage:
+    python worker.py                  # one worker process
+    python worker.py --processes 4    # four worker processes
+"""
+
+import os
+import json
+import time
+import socket
+import argparse
+import multiprocessing
+from datetime import datetime, timedelta
+
+from app import app, db, AnalysisJob, advice_cache, run_analysis_pipeline, backfill_llm_advice
+from image_ingest import ingest_file
+from advice_library import start_library_refresher
+
+
+# Jobs stuck in 'running' longer than this are assumed to belong to a dead worker
+STALE_JOB_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '600'))
+MAX_JOB_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1.0'))
+# Fill the precomputed advice library when the first worker starts, then
+# refresh entries older than ADVICE_LIBRARY_REFRESH_HOURS (0 = only at start).
+# Defaults to the advice cache TTL, so entries are regenerated as they expire
+ADVICE_LIBRARY_WARMUP = os.getenv('ADVICE_LIBRARY_WARMUP', 'true').lower() == 'true'
+ADVICE_LIBRARY_REFRESH_HOURS = float(os.getenv(
+    'ADVICE_LIBRARY_REFRESH_HOURS', str(advice_cache.ttl_seconds / 3600 if advice_cache else 0)
+))
+
+
+def requeue_stale_jobs():
+    """Return jobs abandoned by crashed workers to the queue (or fail them after too many attempts)"""
+    cutoff = datetime.utcnow() - timedelta(seconds=STALE_JOB_SECONDS)
+    stale_jobs = AnalysisJob.query.filter(
+        AnalysisJob.status == 'running',
+        AnalysisJob.started_at < cutoff
+    ).all()
+
+    for job in stale_jobs:
+        if job.attempts >= MAX_JOB_ATTEMPTS:
+            job.status = 'failed'
+            job.error = 'Job abandoned by worker too many times'
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = 'queued'
+            job.worker_id = None
+        print(f"⚠️ Stale job {job.id} -> {job.status}")
+
+    if stale_jobs:
+        db.session.commit()
+
+
+def claim_next_job(worker_id):
+    """
+    Atomically claim the oldest queued job
+
+    The conditional UPDATE only succeeds for one worker, so several
+    processes can poll the same table safely.
+    """
+    while True:
+        job = AnalysisJob.query.filter_by(status='queued').order_by(AnalysisJob.created_at).first()
+        if not job:
+            return None
+
+        claimed = AnalysisJob.query.filter_by(id=job.id, status='queued').update({
+            'status': 'running',
+            'worker_id': worker_id,
+            'started_at': datetime.utcnow(),
+            'attempts': AnalysisJob.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+
+        if claimed:
+            return db.session.get(AnalysisJob, job.id)
+        # Another worker won the race - try the next one
+
+
+def run_job(job):
+    """Run a claimed job and store its outcome"""
+    payload = json.loads(job.payload)
+    partial = {}
+
+    def on_stage(stage, data):
+        # Publish partial results so GET /api/analyze/jobs/<id> can show progress
+        partial.update(data)
+        partial['stage'] = stage
+        job.result = json.dumps(partial)
+        db.session.commit()
+
+    try:
+        if job.kind == 'analyze':
+            # Decode once in this process; every stage shares the result
+            image, error = ingest_file(payload['filepath'])
+            if error:
+                body, status = error
+            else:
+                body, status = run_analysis_pipeline(
+                    image,
+                    payload['filename'],
+                    payload['patient'],
+                    job.user_id,
+                    on_stage=on_stage
+                )
+        elif job.kind == 'advice':
+            # Deferred LLM advice for an analysis that was already returned
+            body, status = backfill_llm_advice(payload['analysis_id'], payload['patient'])
+        else:
+            raise ValueError(f"Unknown job kind: {job.kind}")
+
+        job.result = json.dumps(body)
+        job.status_code = status
+        job.status = 'done' if status < 400 else 'failed'
+        job.error = body.get('error') if status >= 400 else None
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Job {job.id} failed: {e}")
+        job.status = 'failed'
+        job.status_code = 500
+        job.error = f'Analysis failed: {str(e)}'
+
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    print(f"✅ Job {job.id} finished with status {job.status}")
+
+
+def worker_loop(worker_index=0):
+    """Poll the job table until interrupted"""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{worker_index}"
+    print(f"🔄 Worker {worker_id} started")
+
+    if ADVICE_LIBRARY_WARMUP and worker_index == 0:
+        start_library_refresher(ADVICE_LIBRARY_REFRESH_HOURS, holder=worker_id)
+
+    with app.app_context():
+        # Child processes inherit the pooled connections app.py opened in the
+        # parent (init_db); drop them unclosed so this process opens its own
+        db.engine.dispose(close=False)
+        requeue_stale_jobs()
+        last_stale_check = time.monotonic()
+
+        while True:
+            try:
+                if time.monotonic() - last_stale_check > STALE_JOB_SECONDS:
+                    requeue_stale_jobs()
+                    last_stale_check = time.monotonic()
+
+                job = claim_next_job(worker_id)
+                if job is None:
+                    time.sleep(POLL_INTERVAL)
+                    continue
+
+                run_job(job)
+
+            except KeyboardInterrupt:
+                print(f"🛑 Worker {worker_id} stopping")
+                break
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Worker error: {e}")
+                time.sleep(POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run analysis job workers')
+    parser.add_argument('--processes', type=int, default=int(os.getenv('JOB_WORKER_PROCESSES', '1')),
+                        help='Number of worker processes to start')
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        worker_loop()
+    else:
+        processes = [
+            multiprocessing.Process(target=worker_loop, args=(i,), daemon=False)
+            for i in range(args.processes)
+        ]
+        for p in processes:
+            p.start()
+        try:
+            for p in processes:
+                p.join()
+        except KeyboardInterrupt:
+            for p in processes:
+                p.terminate()